@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+''' Simulated wall-clock time of a multi-gpu eval with the static split of the
+    episodes (rank::world_size, then the scenes of a rank split over its envs) vs
+    the EpisodeDispatcher, on a synthetic split with heavy-tailed episode times and
+    a cost per scene load. In both, the scenes of a rank are split over its envs.
+    The dispatched run claims through a real queue file;
+    the time of a claim under contention is measured with one process per rank. '''
+
+import argparse
+import heapq
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from vlnce_baselines.common.dispatcher import EpisodeDispatcher, scene_batches
+
+
+def synthetic_split(rng, args):
+    ''' (episode_id, scene_id) pairs and seconds of each episode '''
+    scene_sizes = rng.dirichlet(np.ones(args.scenes) * 2) * args.episodes
+    scene_ids = np.repeat(np.arange(args.scenes), np.maximum(1, scene_sizes.astype(int)))
+    episodes = [(k, f'scene_{s}') for k, s in enumerate(scene_ids)]
+    # scenes differ in size, and so in the length of their episodes
+    scene_scale = rng.lognormal(0, 0.4, size=args.scenes)
+    seconds = scene_scale[scene_ids] * rng.lognormal(np.log(args.episode_s), 0.6, size=len(episodes))
+    return episodes, seconds
+
+
+def run_env(episodes, seconds, args, scene=None, t=0.):
+    for episode_id, scene_id in episodes:
+        if scene_id != scene:
+            t += args.scene_load_s
+            scene = scene_id
+        t += seconds[episode_id]
+    return t, scene
+
+
+def static_time(episodes, seconds, args):
+    rank_times = []
+    for rank in range(args.ranks):
+        rank_episodes = episodes[rank::args.ranks]
+        # construct_envs: the scenes of the rank split round-robin over its envs
+        scenes = sorted(set(s for _, s in rank_episodes))
+        env_times = []
+        for env in range(args.envs):
+            env_scenes = set(scenes[env::args.envs])
+            env_episodes = sorted((ep for ep in rank_episodes if ep[1] in env_scenes), key=lambda ep: ep[1])
+            env_times.append(run_env(env_episodes, seconds, args)[0])
+        rank_times.append(max(env_times))
+    return rank_times
+
+
+def dispatched_time(episodes, seconds, args, fname):
+    scenes = dict(episodes)
+    dispatcher = EpisodeDispatcher(fname)
+    dispatcher.create(scene_batches(episodes, args.batch))
+    # every rank holds all the scenes, split round-robin over its envs
+    all_scenes = sorted(set(scenes.values()))
+    env_scenes = [set(all_scenes[env::args.envs]) for env in range(args.envs)]
+    # the env that is done first claims next
+    envs = [(0., rank, env, None) for rank in range(args.ranks) for env in range(args.envs)]
+    heapq.heapify(envs)
+    rank_times = [0.] * args.ranks
+    while len(envs) > 0:
+        t, rank, env, scene = heapq.heappop(envs)
+        batch = dispatcher.claim(env_scenes[env])
+        if batch is None:
+            rank_times[rank] = max(rank_times[rank], t)
+            continue
+        t, scene = run_env([(ep, scenes[ep]) for ep in batch], seconds, args, scene, t)
+        heapq.heappush(envs, (t, rank, env, scene))
+    return rank_times
+
+
+def claim_all(fname, times):
+    dispatcher = EpisodeDispatcher(fname)
+    while True:
+        tic = time.perf_counter()
+        batch = dispatcher.claim()
+        times.append(time.perf_counter() - tic)
+        if batch is None:
+            return
+
+
+def claim_latency(episodes, args, fname):
+    EpisodeDispatcher(fname).create(scene_batches(episodes, 1))
+    with mp.Manager() as manager:
+        times = manager.list()
+        procs = [mp.Process(target=claim_all, args=(fname, times)) for _ in range(args.ranks)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        times = list(times)
+    return np.mean(times), len(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ranks', type=int, default=4)
+    parser.add_argument('--envs', type=int, default=2, help='envs per rank')
+    parser.add_argument('--episodes', type=int, default=1839)
+    parser.add_argument('--scenes', type=int, default=11)
+    parser.add_argument('--episode_s', type=float, default=20., help='median seconds of an episode')
+    parser.add_argument('--scene_load_s', type=float, default=10.)
+    parser.add_argument('--batch', type=int, default=8, help='IL.dispatch_episodes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    episodes, seconds = synthetic_split(rng, args)
+    print(f'{len(episodes)} episodes, {args.scenes} scenes, {args.ranks} ranks x {args.envs} envs')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = os.path.join(tmp_dir, 'dispatch.json')
+        for name, rank_times in [
+            ('static', static_time(episodes, seconds, args)),
+            ('dispatch', dispatched_time(episodes, seconds, args, fname)),
+        ]:
+            print(f'{name:8s} wall clock {max(rank_times) / 3600:6.2f}h, '
+                  f'ranks done after {", ".join(f"{t / 3600:.2f}" for t in rank_times)}h')
+        latency, claims = claim_latency(episodes, args, fname)
+        print(f'claim: {1000 * latency:.3f} ms on average over {claims} claims of {args.ranks} processes')
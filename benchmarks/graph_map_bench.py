@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+
+''' Microbenchmarks of GraphMap on synthetic long episodes. Each benchmark drives
+    a reference GraphMap and an optimized one with the same random episode, reports
+    the per-step cost bucketed by graph size and, with --check, asserts that both
+    give the same outputs at every step.
+
+    sp:      networkx all-pairs dijkstra vs the incremental shortest-path engine
+    compact: dict positions vs array-backed positions with a spatial hash
+    pair:    python double loop vs GraphMap.get_pair_dists for gmap_pair_dists
+    pos:     GraphMap.get_pos_fts vs GraphMap.get_pos_fts_batch
+    floyd:   FloydGraph vs MatrixFloydGraph
+    batch:   per-env GraphMaps vs BatchGraphMap tensors for the navigation inputs
+    distant: python loop vs the vectorized query of GraphMap.search_distant_ghost
+    budget:  per-step cost of the gmap input on long episodes, without and with
+             the graph budget of --max_nodes / --max_ghosts
+
+    --check expects the numpy pinned by the repo (<2.0): numpy 2 keeps float32
+    scalar arithmetic in float32, so the reference pos fts of pos / batch change there. '''
+
+import argparse
+import time
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+from vlnce_baselines.models.graph_utils import (
+    GraphMap, BatchGraphMap, FloydGraph, MatrixFloydGraph, MAX_DIST, calc_position_distance,
+)
+
+
+def synthetic_step(gmap, rng, state, step_id, num_cands=(3, 7)):
+    ''' one rollout-like step: observe candidates at cur_pos, then move to a ghost '''
+    cur_vp = str(gmap.allnode_cnt)
+    gmap.allnode_cnt += 1
+    cand_num = rng.randint(*num_cands)
+    ang = rng.uniform(0, 2 * np.pi, size=cand_num)
+    dis = rng.uniform(0.75, 3.0, size=cand_num)
+    cand_pos = np.stack([
+        state['pos'][0] - dis * np.sin(ang),
+        np.full(cand_num, state['pos'][1]),
+        state['pos'][2] - dis * np.cos(ang),
+    ], 1)
+    cand_vp = [f'{cur_vp}_{i}' for i in range(cand_num)]
+    embeds = np.zeros(4, dtype=np.float32)
+
+    tic = time.perf_counter()
+    gmap.update_graph(state['prev_vp'], step_id,
+                      cur_vp, state['pos'], embeds,
+                      cand_vp, list(cand_pos), [embeds] * cand_num,
+                      None, [None] * cand_num)
+    cost = time.perf_counter() - tic
+
+    ghost_vps = sorted(gmap.ghost_pos.keys())
+    if len(ghost_vps) > 0:
+        ghost_vp = ghost_vps[rng.randint(len(ghost_vps))]
+        _, front_vp = gmap.front_to_ghost_dist(ghost_vp)
+        # agent positions come from the simulator as float32
+        state['pos'] = (gmap.ghost_mean_pos[ghost_vp] + rng.normal(0, 0.1, size=3) * [1, 0, 1]).astype(np.float32)
+        state['prev_vp'] = front_vp
+        gmap.delete_ghost(ghost_vp)
+    return cost
+
+
+def run_pair(args, make_gmaps, check_fn):
+    costs = {}
+    for ep in range(args.episodes):
+        gmaps = make_gmaps()
+        rngs = {k: np.random.RandomState(args.seed + ep) for k in gmaps}
+        states = {k: {'pos': np.zeros(3, dtype=np.float32), 'prev_vp': None} for k in gmaps}
+        for stepk in range(args.steps):
+            for k, gmap in gmaps.items():
+                num_nodes = len(gmap.node_pos) + 1
+                cost = synthetic_step(gmap, rngs[k], states[k], stepk + 1)
+                costs.setdefault(k, defaultdict(list))[num_nodes // args.bucket * args.bucket].append(cost)
+            if args.check:
+                check_fn(*gmaps.values(), f'episode {ep} step {stepk}')
+
+    ref_name, opt_name = costs.keys()
+    print(f"{'nodes':>8} {ref_name + ' (ms)':>18} {opt_name + ' (ms)':>18} {'speedup':>9}")
+    for bucket in sorted(costs[ref_name].keys()):
+        t_ref = np.mean(costs[ref_name][bucket]) * 1e3
+        t_opt = np.mean(costs[opt_name][bucket]) * 1e3
+        print(f'{bucket:>8} {t_ref:>18.3f} {t_opt:>18.3f} {t_ref / t_opt:>8.1f}x')
+    if args.check:
+        print(f'{opt_name} outputs match {ref_name} at every step')
+
+
+def check_shortest_paths(ref, opt, where):
+    assert opt.shortest_dist == ref.shortest_dist, f'{where}: distances differ'
+    assert opt.shortest_path == ref.shortest_path, f'{where}: paths differ'
+
+
+def check_positions(ref, opt, where):
+    check_shortest_paths(ref, opt, where)
+    for name in ['node_pos', 'ghost_mean_pos', 'ghost_aug_pos']:
+        ref_pos, opt_pos = getattr(ref, name), getattr(opt, name)
+        assert list(ref_pos.keys()) == list(opt_pos.keys()), f'{where}: {name} ids differ'
+        for vp in ref_pos:
+            assert np.array_equal(ref_pos[vp], opt_pos[vp]), f'{where}: {name}[{vp}] differs'
+
+
+def bench_shortest_paths(args):
+    run_pair(args, lambda: {
+        'networkx': GraphMap(False, args.loc_noise, True, 0),
+        'incremental': GraphMap(False, args.loc_noise, True, 0, incremental_sp=True),
+    }, check_shortest_paths)
+
+
+def bench_compact(args):
+    run_pair(args, lambda: {
+        'dict': GraphMap(False, args.loc_noise, True, 0, incremental_sp=True),
+        'compact': GraphMap(False, args.loc_noise, True, 0, incremental_sp=True, compact=True),
+    }, check_positions)
+
+
+def pair_dists_loop(gmap, gmap_vp_ids):
+    ''' reference: the pairwise loop formerly in RLTrainer._nav_gmap_variable '''
+    gmap_pair_dists = np.zeros((len(gmap_vp_ids), len(gmap_vp_ids)), dtype=np.float32)
+    for j in range(1, len(gmap_vp_ids)):
+        for k in range(j+1, len(gmap_vp_ids)):
+            vp1 = gmap_vp_ids[j]
+            vp2 = gmap_vp_ids[k]
+            if vp1 in list(gmap.node_pos.keys()) and vp2 in list(gmap.node_pos.keys()):
+                dist = gmap.shortest_dist[vp1][vp2]
+            elif vp1 in list(gmap.node_pos.keys()) and not vp2 in list(gmap.node_pos.keys()):
+                front_dis2, front_vp2 = gmap.front_to_ghost_dist(vp2)
+                dist = gmap.shortest_dist[vp1][front_vp2] + front_dis2
+            else:
+                front_dis1, front_vp1 = gmap.front_to_ghost_dist(vp1)
+                front_dis2, front_vp2 = gmap.front_to_ghost_dist(vp2)
+                dist = front_dis1 + gmap.shortest_dist[front_vp1][front_vp2] + front_dis2
+            gmap_pair_dists[j, k] = gmap_pair_dists[k, j] = dist / MAX_DIST
+    return gmap_pair_dists
+
+
+def run_static(args, name, ref_fn, opt_fn):
+    ''' times ref_fn / opt_fn(gmap, state, gmap_vp_ids) on the map after every step '''
+    costs = {'loop': defaultdict(list), 'vectorized': defaultdict(list)}
+    front_cache = np.zeros(2, dtype=np.int64)
+    for ep in range(args.episodes):
+        gmap = GraphMap(False, args.loc_noise, True, args.ghost_aug, incremental_sp=True, compact=True)
+        rng = np.random.RandomState(args.seed + ep)
+        state = {'pos': np.zeros(3, dtype=np.float32), 'prev_vp': None}
+        for stepk in range(args.steps):
+            synthetic_step(gmap, rng, state, stepk + 1)
+            heading = rng.uniform(0, 2 * np.pi)
+            state['ori'] = np.array([0, np.sin(heading / 2), 0, np.cos(heading / 2)])
+            node_vp_ids = list(gmap.node_pos.keys())
+            ghost_vp_ids = list(gmap.ghost_pos.keys())
+            gmap_vp_ids = [None] + node_vp_ids + ghost_vp_ids
+            bucket = len(gmap_vp_ids) // args.bucket * args.bucket
+            gmap.version += 1   # defeat the cache, a new step always changes the map
+
+            tic = time.perf_counter()
+            ref = ref_fn(gmap, state, gmap_vp_ids)
+            costs['loop'][bucket].append(time.perf_counter() - tic)
+            tic = time.perf_counter()
+            out = opt_fn(gmap, state, gmap_vp_ids)
+            costs['vectorized'][bucket].append(time.perf_counter() - tic)
+            if args.check:
+                assert np.array_equal(ref, out), f'episode {ep} step {stepk}: {name} differ'
+        front_cache += [gmap.front_cache_hits, gmap.front_cache_misses]
+
+    print(f"{'gmap len':>8} {'loop (ms)':>18} {'vectorized (ms)':>18} {'speedup':>9}")
+    for bucket in sorted(costs['loop'].keys()):
+        t_ref = np.mean(costs['loop'][bucket]) * 1e3
+        t_opt = np.mean(costs['vectorized'][bucket]) * 1e3
+        print(f'{bucket:>8} {t_ref:>18.3f} {t_opt:>18.3f} {t_ref / t_opt:>8.1f}x')
+    print(f'front_to_ghost_dist cache: {front_cache[0]} hits, {front_cache[1]} misses')
+    if args.check:
+        print(f'vectorized {name} match the loop at every step')
+
+
+def bench_pair_dists(args):
+    run_static(
+        args, 'pair dists',
+        lambda gmap, state, gmap_vp_ids: pair_dists_loop(gmap, gmap_vp_ids),
+        lambda gmap, state, gmap_vp_ids: gmap.get_pair_dists(
+            [vp for vp in gmap_vp_ids[1:] if vp in gmap.node_pos],
+            [vp for vp in gmap_vp_ids[1:] if vp in gmap.ghost_pos],
+        ),
+    )
+
+
+def bench_pos_fts(args):
+    # the agent is at the last node, facing a random direction
+    def pos_fts(method):
+        def fn(gmap, state, gmap_vp_ids):
+            cur_vp = list(gmap.node_pos.keys())[-1]
+            return getattr(gmap, method)(cur_vp, gmap.node_pos[cur_vp], state['ori'], gmap_vp_ids)
+        return fn
+    run_static(args, 'pos fts', pos_fts('get_pos_fts'), pos_fts('get_pos_fts_batch'))
+
+
+def bench_floyd(args):
+    ''' a node joins per step with edges to nearby nodes, then paths from it are queried '''
+    costs = {'FloydGraph': defaultdict(list), 'MatrixFloydGraph': defaultdict(list)}
+    for ep in range(args.episodes):
+        graphs = {'FloydGraph': FloydGraph(), 'MatrixFloydGraph': MatrixFloydGraph()}
+        rng = np.random.RandomState(args.seed + ep)
+        pos = np.zeros((args.steps, 2))
+        for k in range(1, args.steps):
+            parent = rng.randint(k)
+            pos[k] = pos[parent] + rng.uniform(-2, 2, size=2)
+            dis = np.sqrt(((pos[:k] - pos[k])**2).sum(1))
+            # FloydGraph.update needs an edge of the node
+            neighbours = np.union1d(np.nonzero(dis < 2.5)[0], [parent])
+            targets = [str(j) for j in rng.randint(k, size=5)]
+            bucket = k // args.bucket * args.bucket
+            for name, graph in graphs.items():
+                tic = time.perf_counter()
+                for j in neighbours:
+                    graph.add_edge(str(j), str(k), dis[j])
+                graph.update(str(k))
+                for vp in targets:
+                    graph.path(str(k), vp)
+                costs[name][bucket].append(time.perf_counter() - tic)
+            if args.check:
+                ref, opt = graphs.values()
+                for vp in targets:
+                    assert ref.distance(str(k), vp) == opt.distance(str(k), vp), \
+                        f'episode {ep} step {k}: distances differ'
+                    assert ref.path(str(k), vp) == opt.path(str(k), vp), \
+                        f'episode {ep} step {k}: paths differ'
+
+    print(f"{'nodes':>8} {'FloydGraph (ms)':>18} {'Matrix (ms)':>18} {'speedup':>9}")
+    for bucket in sorted(costs['FloydGraph'].keys()):
+        t_ref = np.mean(costs['FloydGraph'][bucket]) * 1e3
+        t_opt = np.mean(costs['MatrixFloydGraph'][bucket]) * 1e3
+        print(f'{bucket:>8} {t_ref:>18.3f} {t_opt:>18.3f} {t_ref / t_opt:>8.1f}x')
+    if args.check:
+        print('MatrixFloydGraph distances and paths match FloydGraph at every step')
+
+
+def nav_inputs_loop(gmaps, cur_vp, cur_pos, cur_ori, batch_node_vp_ids):
+    ''' reference: the per-env loop of RLTrainer._nav_gmap_variable, on cpu '''
+    batch = defaultdict(list)
+    for i, gmap in enumerate(gmaps):
+        node_vp_ids = batch_node_vp_ids[i]
+        ghost_vp_ids = list(gmap.ghost_pos.keys())
+        gmap_vp_ids = [None] + node_vp_ids + ghost_vp_ids
+        img_fts = [gmap.get_node_embeds(vp) for vp in node_vp_ids + ghost_vp_ids]
+        batch['gmap_vp_ids'].append(gmap_vp_ids)
+        batch['gmap_step_ids'].append(torch.LongTensor(
+            [0] + [gmap.node_stepId[vp] for vp in node_vp_ids] + [0] * len(ghost_vp_ids)))
+        batch['gmap_visited_masks'].append(torch.BoolTensor(
+            [0] + [1] * len(node_vp_ids) + [0] * len(ghost_vp_ids)))
+        batch['gmap_img_fts'].append(torch.stack([torch.zeros_like(img_fts[0])] + img_fts, 0))
+        batch['gmap_pos_fts'].append(torch.from_numpy(
+            gmap.get_pos_fts_batch(cur_vp[i], cur_pos[i], cur_ori[i], gmap_vp_ids)))
+        batch['gmap_pair_dists'].append(torch.from_numpy(gmap.get_pair_dists(node_vp_ids, ghost_vp_ids)))
+
+    max_len = max(len(vp_ids) for vp_ids in batch['gmap_vp_ids'])
+    outs = {'gmap_vp_ids': batch['gmap_vp_ids']}
+    for name in ['gmap_step_ids', 'gmap_visited_masks', 'gmap_img_fts', 'gmap_pos_fts']:
+        x = batch[name][0]
+        out = x.new_zeros((len(gmaps), max_len) + x.shape[1:])
+        for i, x in enumerate(batch[name]):
+            out[i, :len(x)] = x
+        outs[name] = out
+    outs['gmap_pair_dists'] = torch.zeros(len(gmaps), max_len, max_len)
+    for i, x in enumerate(batch['gmap_pair_dists']):
+        outs['gmap_pair_dists'][i, :len(x), :len(x)] = x
+    return outs
+
+
+def bench_batch(args):
+    ''' num_envs episodes side by side, per-env GraphMaps vs one BatchGraphMap '''
+    device = torch.device(args.device)
+    costs = {'loop': defaultdict(list), 'batch': defaultdict(list)}
+    for ep in range(args.episodes):
+        make = lambda: [GraphMap(False, args.loc_noise, True, args.ghost_aug, incremental_sp=True, compact=True)
+                        for _ in range(args.num_envs)]
+        ref, opt = BatchGraphMap(make()), BatchGraphMap(make(), device=device)
+        rng = np.random.RandomState(args.seed + ep)
+        pos = [np.zeros(3, dtype=np.float32) for _ in range(args.num_envs)]
+        prev_vp = [None] * args.num_envs
+        for stepk in range(args.steps):
+            heading = rng.uniform(0, 2 * np.pi, size=args.num_envs)
+            ori = [np.array([0, np.sin(h / 2), 0, np.cos(h / 2)]) for h in heading]
+            cand_num = rng.randint(3, 7, size=args.num_envs)
+            cand_ang = [list(rng.uniform(0, 2 * np.pi, size=n)) for n in cand_num]
+            cand_dis = [list(rng.uniform(0.75, 3.0, size=n)) for n in cand_num]
+            cur_embeds = torch.from_numpy(rng.normal(size=(args.num_envs, 8)).astype(np.float32))
+            cand_embeds = [torch.from_numpy(rng.normal(size=(n, 8)).astype(np.float32)) for n in cand_num]
+
+            # same random augmentation for both maps
+            np_state = np.random.get_state()
+            outs = {}
+            for name, gmaps in (('loop', ref), ('batch', opt)):
+                np.random.set_state(np_state)
+                cur_vp, cand_vp, cand_pos = gmaps.identify_node(pos, ori, cand_ang, cand_dis)
+                gmaps.update_graph(prev_vp, stepk + 1, cur_vp, pos, cur_embeds.to(gmaps.device or 'cpu'),
+                                   cand_vp, cand_pos, [x.to(gmaps.device or 'cpu') for x in cand_embeds],
+                                   [None] * args.num_envs, [[None] * n for n in cand_num])
+                bucket = max(len(gmap.node_pos) + len(gmap.ghost_pos) for gmap in gmaps) // args.bucket * args.bucket
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                tic = time.perf_counter()
+                node_vp_ids = [gmap.select_nodes(cur_vp[i], pos[i], args.max_nodes, args.evict)
+                               for i, gmap in enumerate(gmaps)]
+                if gmaps.device is None:
+                    outs[name] = nav_inputs_loop(gmaps, cur_vp, pos, ori, node_vp_ids)
+                else:
+                    outs[name] = gmaps.get_nav_inputs(cur_vp, pos, ori, node_vp_ids)
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                costs[name][bucket].append(time.perf_counter() - tic)
+            distant = {name: gmaps.search_distant_ghosts(pos) for name, gmaps in (('loop', ref), ('batch', opt))}
+
+            if args.check:
+                where = f'episode {ep} step {stepk}'
+                for i in range(args.num_envs):
+                    check_positions(ref[i], opt[i], f'{where} env {i}')
+                assert distant['loop'] == distant['batch'], f'{where}: distant ghosts differ'
+                ref_outs, opt_outs = outs['loop'], outs['batch']
+                assert ref_outs['gmap_vp_ids'] == opt_outs['gmap_vp_ids'], f'{where}: gmap_vp_ids differ'
+                for name in ['gmap_step_ids', 'gmap_visited_masks', 'gmap_img_fts', 'gmap_pos_fts', 'gmap_pair_dists']:
+                    assert torch.equal(ref_outs[name], opt_outs[name].cpu()), f'{where}: {name} differ'
+
+            # move to a ghost, drop it, the distant ones and the ones over the budget
+            del_ghosts = []
+            for i, gmap in enumerate(ref):
+                ghost_vps = list(gmap.ghost_pos.keys())
+                if len(ghost_vps) == 0:
+                    del_ghosts.append([])
+                    continue
+                ghost_vp = ghost_vps[rng.randint(len(ghost_vps))]
+                keep = rng.uniform() < 0.5
+                del_ghosts.append([ghost_vp] + [vp for vp in distant['loop'][i] if vp != ghost_vp and not keep])
+                del_ghosts[i] += gmap.evict_ghosts(pos[i], args.max_ghosts, args.evict, ignore=set(del_ghosts[i]))
+                _, prev_vp[i] = gmap.front_to_ghost_dist(ghost_vp)
+                pos[i] = (gmap.ghost_mean_pos[ghost_vp] + rng.normal(0, 0.1, size=3) * [1, 0, 1]).astype(np.float32)
+            ref.delete_ghosts(del_ghosts)
+            opt.delete_ghosts(del_ghosts)
+
+    print(f"{'max gmap':>8} {'loop (ms)':>18} {'batch (ms)':>18} {'speedup':>9}")
+    for bucket in sorted(costs['loop'].keys()):
+        t_ref = np.mean(costs['loop'][bucket]) * 1e3
+        t_opt = np.mean(costs['batch'][bucket]) * 1e3
+        print(f'{bucket:>8} {t_ref:>18.3f} {t_opt:>18.3f} {t_ref / t_opt:>8.1f}x')
+    if args.check:
+        print('BatchGraphMap navigation inputs match the per-env loop at every step')
+
+
+def distant_ghost_loop(gmap, cur_pos, thresho1d=3.0):
+    ''' reference: the loop formerly in GraphMap.search_distant_ghost '''
+    return [vp for vp, kpos in gmap.ghost_mean_pos.items() if calc_position_distance(cur_pos, kpos) >= thresho1d]
+
+
+def bench_distant(args):
+    run_static(
+        args, 'distant ghosts',
+        lambda gmap, state, gmap_vp_ids: distant_ghost_loop(gmap, state['pos']),
+        lambda gmap, state, gmap_vp_ids: gmap.search_distant_ghost(state['pos']),
+    )
+
+
+def bench_budget(args):
+    ''' the same walk, with the gmap input growing with the episode or held by the budget '''
+    costs = {'unbounded': defaultdict(list), 'budget': defaultdict(list)}
+    gmap_lens = {'unbounded': defaultdict(list), 'budget': defaultdict(list)}
+    for ep in range(args.episodes):
+        for name in costs:
+            max_nodes, max_ghosts = (0, 0) if name == 'unbounded' else (args.max_nodes, args.max_ghosts)
+            gmap = GraphMap(False, args.loc_noise, True, args.ghost_aug, incremental_sp=True, compact=True)
+            rng = np.random.RandomState(args.seed + ep)
+            state = {'pos': np.zeros(3, dtype=np.float32), 'prev_vp': None}
+            for stepk in range(args.steps):
+                cost = synthetic_step(gmap, rng, state, stepk + 1)
+                heading = rng.uniform(0, 2 * np.pi)
+                ori = np.array([0, np.sin(heading / 2), 0, np.cos(heading / 2)])
+                cur_vp = list(gmap.node_pos.keys())[-1]
+                cur_pos = gmap.node_pos[cur_vp]
+
+                tic = time.perf_counter()
+                node_vp_ids = gmap.select_nodes(cur_vp, cur_pos, max_nodes, args.evict)
+                ghost_vp_ids = list(gmap.ghost_pos.keys())
+                gmap_vp_ids = [None] + node_vp_ids + ghost_vp_ids
+                pos_fts = gmap.get_pos_fts_batch(cur_vp, cur_pos, ori, gmap_vp_ids)
+                pair_dists = gmap.get_pair_dists(node_vp_ids, ghost_vp_ids)
+                cost += time.perf_counter() - tic
+
+                if args.check and name == 'budget':
+                    where = f'episode {ep} step {stepk}'
+                    assert max_nodes <= 0 or len(node_vp_ids) <= max_nodes, f'{where}: over the node budget'
+                    assert cur_vp in node_vp_ids, f'{where}: cur_vp dropped'
+                    # the budget input is the full input restricted to the kept nodes
+                    all_node_vp_ids = list(gmap.node_pos.keys())
+                    rows = [0] + [1 + all_node_vp_ids.index(vp) for vp in node_vp_ids] + \
+                           [1 + len(all_node_vp_ids) + k for k in range(len(ghost_vp_ids))]
+                    full_pos_fts = gmap.get_pos_fts_batch(cur_vp, cur_pos, ori, [None] + all_node_vp_ids + ghost_vp_ids)
+                    full_pair_dists = gmap.get_pair_dists(all_node_vp_ids, ghost_vp_ids)
+                    assert np.array_equal(full_pos_fts[rows], pos_fts), f'{where}: pos fts differ'
+                    assert np.array_equal(full_pair_dists[np.ix_(rows, rows)], pair_dists), f'{where}: pair dists differ'
+
+                tic = time.perf_counter()
+                for vp in gmap.evict_ghosts(cur_pos, max_ghosts, args.evict):
+                    gmap.delete_ghost(vp)
+                cost += time.perf_counter() - tic
+                if args.check:
+                    assert max_ghosts <= 0 or len(gmap.ghost_pos) <= max_ghosts, f'episode {ep} step {stepk}: over the ghost budget'
+                bucket = stepk // args.bucket * args.bucket
+                costs[name][bucket].append(cost)
+                gmap_lens[name][bucket].append(len(gmap_vp_ids))
+
+    print(f"{'step':>8} {'unbounded (ms)':>18} {'len':>6} {'budget (ms)':>18} {'len':>6}")
+    for bucket in sorted(costs['unbounded'].keys()):
+        t_ref = np.mean(costs['unbounded'][bucket]) * 1e3
+        t_opt = np.mean(costs['budget'][bucket]) * 1e3
+        len_ref = np.mean(gmap_lens['unbounded'][bucket])
+        len_opt = np.mean(gmap_lens['budget'][bucket])
+        print(f'{bucket:>8} {t_ref:>18.3f} {len_ref:>6.0f} {t_opt:>18.3f} {len_opt:>6.0f}')
+    if args.check:
+        print('budget inputs match the unbounded inputs on the kept nodes at every step')
+
+
+BENCHMARKS = {
+    'sp': bench_shortest_paths,
+    'compact': bench_compact,
+    'pair': bench_pair_dists,
+    'pos': bench_pos_fts,
+    'floyd': bench_floyd,
+    'batch': bench_batch,
+    'distant': bench_distant,
+    'budget': bench_budget,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bench', default='sp', choices=list(BENCHMARKS.keys()))
+    parser.add_argument('--episodes', default=5, type=int)
+    parser.add_argument('--steps', default=200, type=int)
+    parser.add_argument('--bucket', default=25, type=int, help='graph size bucket width')
+    parser.add_argument('--loc_noise', default=0.5, type=float)
+    parser.add_argument('--ghost_aug', default=0, type=float)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--num_envs', default=8, type=int)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--max_nodes', default=0, type=int, help='nodes in the gmap input, 0 for no limit')
+    parser.add_argument('--max_ghosts', default=0, type=int, help='ghosts kept in the gmap, 0 for no limit')
+    parser.add_argument('--evict', default='farthest', choices=['farthest', 'oldest', 'stop_score'])
+    parser.add_argument('--check', action='store_true', default=False)
+    args = parser.parse_args()
+
+    BENCHMARKS[args.bench](args)
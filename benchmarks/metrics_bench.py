@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+''' Benchmarks of the eval metrics of finished episodes on synthetic paths.
+
+    dtw:  fastdtw with the NDTW.euclidean_distance callback (the previous rollout
+          path) vs the vectorized exact dtw_distance. With --check, dtw_distance is
+          compared to the exact fastdtw.dtw and the error of the fastdtw
+          approximation on ndtw is reported.
+    pool: time the rollout waits per finished episode, with the metrics computed
+          inline vs submitted to a MetricWorkerPool. '''
+
+import argparse
+import time
+
+import numpy as np
+from fastdtw import fastdtw, dtw
+
+from vlnce_baselines.common.metrics import MetricWorkerPool, episode_metrics, dtw_distance
+
+
+def euclidean_distance(position_a, position_b):
+    ''' the callback of habitat_extensions.measures.NDTW '''
+    return np.linalg.norm(np.array(position_b) - np.array(position_a), ord=2)
+
+
+def fastdtw_distance(pred_path, gt_path):
+    return fastdtw(pred_path, gt_path, dist=euclidean_distance)[0]
+
+
+def synthetic_path(rng, length, start=None):
+    ''' a random walk on the floor, 0.25m a step '''
+    start = np.zeros(3) if start is None else start
+    heading = np.cumsum(rng.normal(0, 0.3, size=length))
+    steps = 0.25 * np.stack([np.sin(heading), np.zeros(length), np.cos(heading)], 1)
+    steps[0] = 0.
+    return start + np.cumsum(steps, 0)
+
+
+def synthetic_episode(rng, args):
+    gt_path = synthetic_path(rng, rng.randint(*args.gt_len))
+    pred_path = synthetic_path(rng, rng.randint(*args.pred_len)) + rng.normal(0, 0.5, size=3) * [1, 0, 1]
+    info = {
+        'position': {
+            'position': pred_path.tolist(),
+            'distance': np.linalg.norm(pred_path - gt_path[-1], axis=1).tolist(),
+        },
+        'steps_taken': len(pred_path),
+        'collisions': {'count': 0},
+    }
+    return info, gt_path.tolist()
+
+
+def bench_dtw(episodes, args):
+    costs = {'fastdtw': [], 'exact': []}
+    for info, gt_locations in episodes:
+        pred_path = np.array(info['position']['position'])
+        gt_path = np.array(gt_locations)
+        for name, func in [('fastdtw', fastdtw_distance), ('exact', dtw_distance)]:
+            tic = time.perf_counter()
+            func(pred_path, gt_path)
+            costs[name].append(time.perf_counter() - tic)
+    for name, cost in costs.items():
+        print(f'{name:8s} {1000 * np.mean(cost):8.3f} ms / episode')
+    print(f'speedup  {np.sum(costs["fastdtw"]) / np.sum(costs["exact"]):8.2f}x')
+
+    # the compiled fastdtw still calls the python callback at each cell of its window,
+    # the time of these calls alone bounds it from below
+    calls = []
+    def counted_distance(position_a, position_b):
+        calls.append(None)
+        return euclidean_distance(position_a, position_b)
+    for info, gt_locations in episodes:
+        fastdtw(np.array(info['position']['position']), np.array(gt_locations), dist=counted_distance)
+    a, b = np.zeros(3), np.ones(3)
+    tic = time.perf_counter()
+    for _ in range(len(calls)):
+        euclidean_distance(a, b)
+    callback = (time.perf_counter() - tic) / len(episodes)
+    print(f'fastdtw callbacks alone {1000 * callback:8.3f} ms / episode '
+          f'({len(calls) / len(episodes):.0f} calls), {callback / np.mean(costs["exact"]):.2f}x exact')
+
+    if args.check:
+        ndtw_err = []
+        for info, gt_locations in episodes:
+            pred_path = np.array(info['position']['position'])
+            gt_path = np.array(gt_locations)
+            exact = dtw(pred_path, gt_path, dist=euclidean_distance)[0]
+            assert dtw_distance(pred_path, gt_path) == exact, (dtw_distance(pred_path, gt_path), exact)
+            approx = fastdtw_distance(pred_path, gt_path)
+            assert approx >= exact - 1e-9
+            ndtw_err.append(np.exp(-exact / (len(gt_path) * 3.)) - np.exp(-approx / (len(gt_path) * 3.)))
+        print(f'check ok: dtw_distance == fastdtw.dtw on {len(episodes)} episodes; '
+              f'fastdtw underestimates ndtw by {np.mean(ndtw_err):.4f} on average, {np.max(ndtw_err):.4f} at most')
+
+
+def bench_pool(episodes, args):
+    for name, num_workers in [('inline', 0), ('pool', args.workers)]:
+        pool = MetricWorkerPool(lambda info, gt_locations: episode_metrics(info, gt_locations), num_workers)
+        stats = {}
+        wait = 0.
+        tic = time.perf_counter()
+        for k, (info, gt_locations) in enumerate(episodes):
+            # the rollout of the next step would run here
+            start = time.perf_counter()
+            stats[k] = {}
+            pool.submit(stats[k], info, gt_locations)
+            wait += time.perf_counter() - start
+        pool.join()
+        total = time.perf_counter() - tic
+        pool.close()
+        print(f'{name:8s} rollout waits {1000 * wait / len(episodes):8.3f} ms / episode, '
+              f'all metrics done in {total:.2f}s')
+        if args.check:
+            for k, (info, gt_locations) in enumerate(episodes):
+                assert stats[k] == episode_metrics(info, gt_locations)
+    if args.check:
+        print('check ok: pooled metrics == inline metrics')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bench', choices=['dtw', 'pool'], default='dtw')
+    parser.add_argument('--episodes', type=int, default=200)
+    parser.add_argument('--pred_len', type=int, nargs=2, default=[20, 200])
+    parser.add_argument('--gt_len', type=int, nargs=2, default=[30, 120])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', action='store_true', default=False)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    episodes = [synthetic_episode(rng, args) for _ in range(args.episodes)]
+    if args.bench == 'dtw':
+        bench_dtw(episodes, args)
+    else:
+        bench_pool(episodes, args)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+''' Benchmark of the waypoint heatmap nms (sigma=(7.0,5.0), max_predictions=5 on
+    the wrapped 122 x 12 heatmap, as in the waypoint forward of ETP) against
+    nms_fast, on synthetic heatmaps for batch sizes 1 to 64. With --check, the
+    outputs of both are compared. '''
+
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+from vlnce_baselines.waypoint_pred.utils import nms, nms_fast
+
+NUM_ANGLES = 120
+NUM_CLASSES = 12
+
+
+def synthetic_heatmaps(batch_size, device):
+    ''' softmax of smooth random logits, wrapped by a row on each side '''
+    logits = torch.randn(batch_size, 1, NUM_ANGLES, NUM_CLASSES, device=device)
+    logits = 8 * F.avg_pool2d(logits, (7, 3), 1, (3, 1), count_include_pad=False)
+    x = torch.softmax(logits.reshape(batch_size, -1), dim=1).reshape(batch_size, NUM_ANGLES, NUM_CLASSES)
+    x = torch.cat((x[:, -1:, :], x, x[:, :1, :]), dim=1)
+    return x.unsqueeze(1)
+
+
+def timeit(func, x, repeats, device):
+    func(x)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    tic = time.perf_counter()
+    for _ in range(repeats):
+        func(x)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - tic) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--repeats', type=int, default=100)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', action='store_true', default=False)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    device = torch.device(args.device)
+    nms_loop = lambda x: nms(x, max_predictions=5, sigma=(7.0, 5.0))
+    nms_table = lambda x: nms_fast(x, max_predictions=5, sigma=(7.0, 5.0))
+    print(f'device {device}')
+    for batch_size in args.batch_sizes:
+        x = synthetic_heatmaps(batch_size, device)
+        if args.check:
+            for _ in range(20):
+                y = synthetic_heatmaps(batch_size, device)
+                assert torch.equal(nms_loop(y), nms_table(y))
+        t_loop = timeit(nms_loop, x, args.repeats, device)
+        t_table = timeit(nms_table, x, args.repeats, device)
+        print(f'B={batch_size:3d}  nms {1000 * t_loop:7.3f} ms  nms_fast {1000 * t_table:7.3f} ms  '
+              f'speedup {t_loop / t_table:5.2f}x')
+    if args.check:
+        print('check ok: nms_fast == nms')
@@ -20,9 +20,11 @@ class GPTNavAgent():
     for k, v in env_actions.items():
         env_actions[k] = [[vx] for vx in v]
 
-    def __init__(self, rank=0):
+    def __init__(self, rank=0, profiler=None):
 
         self._build_prompt_manager()
+        # times the captions, prompts & llm calls (a vlnce_baselines RolloutProfiler)
+        self.profiler = profiler
 
         # Logs
         sys.stdout.flush()
@@ -94,13 +96,16 @@ class GPTNavAgent():
         caption_input = self.prompt_manager.img_caption()
         caption_output = [[] for _ in range(batch_size)]
         
+        self._start('llm_caption')
         for i in range(len(cand_img[0])):
             caption, _ = gpt_caption(caption_input["task_description"], caption_input["prompt"], cand_img[0][i])
 
             caption_output[0].append(caption)
+        self._stop('llm_caption')
 
         print(caption_output[0])
 
+        self._start('prompt')
         cand_inputs = self.prompt_manager.make_action_prompt(vp, ghost_vp_ids, cand_img, nearby_cand_wp, new_ghost_node, caption_output)
         if response_format == 'str':
             nav_input = self.prompt_manager.make_r2r_prompts(cand_inputs=cand_inputs, instr=instr, t=t)
@@ -108,6 +113,7 @@ class GPTNavAgent():
             nav_input = self.prompt_manager.make_r2r_json_prompts(cand_inputs=cand_inputs, instr=instr, t=t)
         else:
             raise NotImplemented
+        self._stop('prompt')
 
         image_list = self.prompt_manager.node_imgs[0]
         environment_prompts = nav_input["prompts"][0]
@@ -116,8 +122,11 @@ class GPTNavAgent():
 
         if llm == 'gpt-4-vision-preview' and response_format == 'str':
             # GPT-4V only supports string mode output
+            self._start('llm_infer')
             nav_output, tokens = gpt_infer(nav_input["task_description"], environment_prompts, image_list,
                                             llm)
+            self._stop('llm_infer')
+            self._count('llm_tokens', tokens)
             print('-------------------- Output --------------------')
             print(nav_output)
             print(f"tokens:{tokens}")
@@ -141,8 +150,11 @@ class GPTNavAgent():
             #     print('-------------------- Output --------------------')
             #     print(nav_output)
             #     print(f"tokens:{tokens}")
+            self._start('llm_infer')
             nav_output, tokens = gpt_infer(nav_input["task_description"], environment_prompts, image_list,
                                             llm, response_format={"type": "json_object"})
+            self._stop('llm_infer')
+            self._count('llm_tokens', tokens)
             json_output = json.loads(nav_output)
             a_t = self.prompt_manager.parse_json_action(json_output, nav_input["only_options"], t)
             self.prompt_manager.parse_json_planning(json_output)
@@ -183,3 +195,15 @@ class GPTNavAgent():
         # return traj
 
         return a_t
+
+    def _start(self, name):
+        if self.profiler is not None:
+            self.profiler.start(name)
+
+    def _stop(self, name):
+        if self.profiler is not None:
+            self.profiler.stop(name)
+
+    def _count(self, name, n):
+        if self.profiler is not None:
+            self.profiler.count(name, n)
@@ -13,6 +13,8 @@ class OneStagePromptManager(object):
         self.node_imgs = [[] for _ in range(self.batch_size)]
         self.node_imgcaptions = [[] for _ in range(self.batch_size)]
         self.graph  = [{} for _ in range(self.batch_size)]
+        self.node_index = [{} for _ in range(self.batch_size)]     # node to its index in nodes_list
+        self.graph_rev = [{} for _ in range(self.batch_size)]      # node to the nodes whose graph lists it
         self.trajectory = [[] for _ in range(self.batch_size)]
         self.planning = [["Navigation has just started, with no planning yet."] for _ in range(self.batch_size)]
 
@@ -44,6 +46,7 @@ class OneStagePromptManager(object):
     def make_action_prompt(self, vp, cand_wp, cand_img, nearby_cand_wp, new_ghost_node, caption_output):
 
         nodes_list, graph, trajectory, node_imgs, node_imgcaptions = self.nodes_list, self.graph, self.trajectory, self.node_imgs, self.node_imgcaptions
+        node_index, graph_rev = self.node_index, self.graph_rev
 
         batch_view_lens, batch_cand_vpids = [], []
         batch_cand_index = []
@@ -56,8 +59,9 @@ class OneStagePromptManager(object):
             action_prompts = []
             action_captions = []
 
-            if viewpoint not in nodes_list[i]:
+            if viewpoint not in node_index[i]:
                 # update nodes list (place 0)
+                node_index[i][viewpoint] = len(nodes_list[i])
                 nodes_list[i].append(viewpoint)
                 node_imgs[i].append(None)
                 node_imgcaptions[i].append(None)
@@ -73,22 +77,23 @@ class OneStagePromptManager(object):
                 # direction = self.get_action_concept(cc['absolute_heading'] - previous_angle[i]['heading'],
                 #                                           cc['absolute_elevation'] - 0)
 
-                if cc not in nodes_list[i]:
+                if cc not in node_index[i]:
+                    node_index[i][cc] = len(nodes_list[i])
                     nodes_list[i].append(cc)
                     node_imgs[i].append(img)
                     node_imgcaptions[i].append(cap)
                     # node_index = nodes_list[i].index(cc)
                 else:
-                    node_index = nodes_list[i].index(cc)
-                    node_imgs[i][node_index] = img
-                    node_imgcaptions[i][node_index] = cap
+                    cc_index = node_index[i][cc]
+                    node_imgs[i][cc_index] = img
+                    node_imgcaptions[i][cc_index] = cap
 
             for cc in cand_waypoint:
-                node_index = nodes_list[i].index(cc)     
+                cc_index = node_index[i][cc]
 
-                # action_text = direction + f" to Place {node_index} which is corresponding to Image {node_index}"
-                action_text = f" Go to Place {node_index} which is corresponding to Image {node_index}"
-                action_caption_text = f" Go to Place {node_index} which is {node_imgcaptions[i][node_index]}"
+                # action_text = direction + f" to Place {cc_index} which is corresponding to Image {cc_index}"
+                action_text = f" Go to Place {cc_index} which is corresponding to Image {cc_index}"
+                action_caption_text = f" Go to Place {cc_index} which is {node_imgcaptions[i][cc_index]}"
                 action_prompts.append(action_text)
                 action_captions.append(action_caption_text)
 
@@ -100,6 +105,8 @@ class OneStagePromptManager(object):
             # update graph
             if viewpoint not in graph[i].keys():
                 graph[i][viewpoint] = nb_cand_wp
+                for adj_node in nb_cand_wp:
+                    graph_rev[i].setdefault(adj_node, set()).add(viewpoint)
 
         return {
             'cand_vpids': batch_cand_vpids,
@@ -108,6 +115,14 @@ class OneStagePromptManager(object):
             'action_captions': batch_action_captions
         }
 
+    def delete_ghosts(self, i, ghost_vps):
+        # drop the image of each ghost and its connections to the visited places,
+        # through graph_rev instead of scanning the whole graph
+        for ghost_vp in ghost_vps:
+            self.node_imgs[i][self.node_index[i][ghost_vp]] = None
+            for node in self.graph_rev[i].pop(ghost_vp, ()):
+                self.graph[i][node].remove(ghost_vp)
+
     def make_action_options(self, cand_inputs, t):
         action_options_batch = []  # complete action options
         only_options_batch = []  # only option labels
@@ -140,7 +155,7 @@ class OneStagePromptManager(object):
     def make_map_prompt(self, i):
         # graph-related text
         trajectory = self.trajectory[i]
-        nodes_list = self.nodes_list[i]
+        node_index = self.node_index[i]
         graph = self.graph[i]
 
         no_dup_nodes = []
@@ -151,8 +166,7 @@ class OneStagePromptManager(object):
 
         # trajectory and map connectivity
         for node in trajectory:
-            node_index = nodes_list.index(node)
-            trajectory_text += f""" {node_index}"""
+            trajectory_text += f""" {node_index[node]}"""
 
             if node not in no_dup_nodes:
                 no_dup_nodes.append(node)
@@ -162,10 +176,9 @@ class OneStagePromptManager(object):
 
                 if adjacent_nodes != []:
                     for adj_node in adjacent_nodes:
-                        adj_index = nodes_list.index(adj_node)
-                        adj_text += f""" {adj_index},"""
+                        adj_text += f""" {node_index[adj_node]},"""
 
-                    graph_text += f"""\nPlace {node_index} is connected with Places{adj_text}"""[:-1]
+                    graph_text += f"""\nPlace {node_index[node]} is connected with Places{adj_text}"""[:-1]
 
         # # ghost nodes info
         # graph_supp_text = ''
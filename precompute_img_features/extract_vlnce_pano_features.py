@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+''' Script to precompute the CLIP rgb & DDPPO depth embeddings of VLN-CE panoramas for
+    the pano feature store (IL.pano_feature_store): the 12 views (30 degrees apart) of
+    the sensors of the ETP trainer are rendered at navigable positions sampled on the
+    navmesh of each scene, one per grid_res x grid_res cell, at headings_per_view
+    headings each, and encoded with the encoders of Policy_ViewSelection_ETP. The
+    embeddings of a scene are written to memory-mapped npy files, see
+    vlnce_baselines/common/feature_store.py. Scenes already written are skipped. '''
+
+import os
+import sys
+
+import argparse
+import numpy as np
+import json
+import math
+import time
+from copy import deepcopy
+
+import torch
+import torch.multiprocessing as mp
+try:
+    mp.set_start_method('spawn')
+except RuntimeError:
+    pass
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from habitat import make_dataset
+from habitat.sims import make_sim
+from habitat_baselines.common.obs_transformers import (
+    apply_obs_transforms_batch,
+    apply_obs_transforms_obs_space,
+    get_active_obs_transforms,
+)
+from habitat_baselines.utils.common import batch_obs
+
+import habitat_extensions  # noqa: F401
+from vlnce_baselines.config.default import get_config
+from vlnce_baselines.common.feature_store import VIEW_DEG, scene_name
+from vlnce_baselines.common.utils import get_camera_orientations12
+from vlnce_baselines.models.encoders.resnet_encoders import CLIPEncoder, VlnResnetDepthEncoder
+
+NUM_IMGS = 12
+SAMPLE_ROUND = 1000 # navmesh samples between two checks for new cells
+
+def build_config(args):
+    ''' the config of the 12-view sensors, as in the _set_config of the ETP trainer '''
+    config = get_config(args.exp_config, args.opts)
+    config.defrost()
+    config.TASK_CONFIG.DATASET.SPLIT = args.split
+    resize_config = config.RL.POLICY.OBS_TRANSFORMS.RESIZER_PER_SENSOR.SIZES
+    crop_config = config.RL.POLICY.OBS_TRANSFORMS.CENTER_CROPPER_PER_SENSOR.SENSOR_CROPS
+    task_config = config.TASK_CONFIG
+    for sensor_type in ["RGB", "DEPTH"]:
+        resizer_size = dict(resize_config)[sensor_type.lower()]
+        cropper_size = dict(crop_config)[sensor_type.lower()]
+        sensor = getattr(task_config.SIMULATOR, f"{sensor_type}_SENSOR")
+        for action, orient in get_camera_orientations12().items():
+            camera_template = f"{sensor_type}_{action}"
+            camera_config = deepcopy(sensor)
+            camera_config.ORIENTATION = orient
+            camera_config.UUID = camera_template.lower()
+            setattr(task_config.SIMULATOR, camera_template, camera_config)
+            task_config.SIMULATOR.AGENT_0.SENSORS.append(camera_template)
+            resize_config.append((camera_template.lower(), resizer_size))
+            crop_config.append((camera_template.lower(), cropper_size))
+    config.RL.POLICY.OBS_TRANSFORMS.RESIZER_PER_SENSOR.SIZES = resize_config
+    config.RL.POLICY.OBS_TRANSFORMS.CENTER_CROPPER_PER_SENSOR.SENSOR_CROPS = crop_config
+    config.TASK_CONFIG = task_config
+    config.freeze()
+    return config
+
+def load_scene_ids(config):
+    dataset = make_dataset(id_dataset=config.TASK_CONFIG.DATASET.TYPE, config=config.TASK_CONFIG.DATASET)
+    scene_ids = sorted(set(ep.scene_id for ep in dataset.episodes))
+    print('Loaded %d scenes' % len(scene_ids))
+    return scene_ids
+
+def sample_positions(sim, grid_res, max_samples):
+    ''' navigable positions, one per grid_res x grid_res cell of each floor, sampled
+        until a round of samples finds less than 1% new cells '''
+    cells = {}
+    for _ in range(max(1, max_samples // SAMPLE_ROUND)):
+        num_cells = len(cells)
+        for _ in range(SAMPLE_ROUND):
+            p = np.array(sim.sample_navigable_point(), dtype=np.float32)
+            cell = (int(round(p[1])), int(p[0] // grid_res), int(p[2] // grid_res))
+            cells.setdefault(cell, p)
+        if len(cells) - num_cells < 0.01 * SAMPLE_ROUND:
+            break
+    return np.stack([cells[k] for k in sorted(cells)])
+
+def view12_keys(sensor_type):
+    ''' the keys of the views in clockwise order, as Policy_ViewSelection_ETP._view12_keys '''
+    ccw_keys = [sensor_type] + [f'{sensor_type}_{a}' for a in get_camera_orientations12()]
+    return [ccw_keys[(NUM_IMGS - v) % NUM_IMGS] for v in range(NUM_IMGS)]
+
+def heading_rotation(deg):
+    ''' quaternion [x, y, z, w] of a counter-clockwise heading of deg degrees '''
+    rad = math.radians(deg)
+    return [0., math.sin(rad / 2), 0., math.cos(rad / 2)]
+
+def build_feature_extractor(config, observation_space, device):
+    model_config = config.MODEL
+    rgb_encoder = CLIPEncoder(device)
+    depth_encoder = VlnResnetDepthEncoder(
+        observation_space,
+        output_size=model_config.DEPTH_ENCODER.output_size,
+        checkpoint=model_config.DEPTH_ENCODER.ddppo_checkpoint,
+        backbone=model_config.DEPTH_ENCODER.backbone,
+        spatial_output=model_config.spatial_output,
+    ).to(device)
+    depth_encoder.eval()
+    return rgb_encoder, depth_encoder
+
+def process_scene(sim, scene_id, encoders, obs_transforms, args, device):
+    rgb_encoder, depth_encoder = encoders
+    positions = sample_positions(sim, args.grid_res, args.max_samples)
+    headings = [VIEW_DEG / args.headings_per_view * j for j in range(args.headings_per_view)]
+    rgb_keys, depth_keys = view12_keys('rgb'), view12_keys('depth')
+    dtype = np.float16 if args.fp16 else np.float32
+
+    scene_dir = os.path.join(args.output_dir, scene_name(scene_id))
+    os.makedirs(scene_dir, exist_ok=True)
+    np.save(os.path.join(scene_dir, 'positions.npy'), positions)
+    rgb_file, depth_file = None, None
+    for k in range(0, len(positions), args.batch_size):
+        observations = [
+            sim.get_observations_at(pos.tolist(), heading_rotation(h), keep_agent_at_new_pose=False)
+            for pos in positions[k: k + args.batch_size] for h in headings
+        ]
+        batch = batch_obs(observations, device)
+        batch = apply_obs_transforms_batch(batch, obs_transforms)
+        rgb_fts = rgb_encoder({'rgb': torch.stack([batch[x] for x in rgb_keys], dim=1).flatten(0, 1)})
+        depth_fts = depth_encoder({'depth': torch.stack([batch[x] for x in depth_keys], dim=1).flatten(0, 1)})
+        # positions x headings x views
+        n = len(observations) // len(headings)
+        rgb_fts = rgb_fts.reshape(n, len(headings), NUM_IMGS, *rgb_fts.shape[1:]).cpu().numpy()
+        depth_fts = depth_fts.reshape(n, len(headings), NUM_IMGS, *depth_fts.shape[1:]).cpu().numpy()
+        if rgb_file is None:
+            rgb_file = np.lib.format.open_memmap(
+                os.path.join(scene_dir, 'rgb.npy'), mode='w+', dtype=dtype,
+                shape=(len(positions), *rgb_fts.shape[1:]))
+            depth_file = np.lib.format.open_memmap(
+                os.path.join(scene_dir, 'depth.npy'), mode='w+', dtype=dtype,
+                shape=(len(positions), *depth_fts.shape[1:]))
+        rgb_file[k: k + n] = rgb_fts
+        depth_file[k: k + n] = depth_fts
+    rgb_file.flush()
+    depth_file.flush()
+    del rgb_file, depth_file
+    # written last: the scene is complete
+    with open(os.path.join(scene_dir, 'meta.json'), 'w') as f:
+        json.dump({'scene_id': scene_id, 'headings_per_view': args.headings_per_view,
+                   'grid_res': args.grid_res, 'num_positions': len(positions)}, f)
+    return len(positions)
+
+def process_features(proc_id, scene_ids, args):
+    print('start proc_id: %d' % proc_id)
+
+    torch.set_grad_enabled(False)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    config = build_config(args)
+    obs_transforms = get_active_obs_transforms(config)
+    sim, encoders = None, None
+    for scene_id in scene_ids:
+        if os.path.exists(os.path.join(args.output_dir, scene_name(scene_id), 'meta.json')):
+            continue
+        tic = time.time()
+        if sim is not None:
+            sim.close()
+        sim_config = config.TASK_CONFIG.SIMULATOR.clone()
+        sim_config.defrost()
+        sim_config.SCENE = scene_id
+        sim_config.freeze()
+        sim = make_sim(id_sim=sim_config.TYPE, config=sim_config)
+        sim.pathfinder.seed(args.seed)
+        if encoders is None:
+            observation_space = apply_obs_transforms_obs_space(
+                sim.sensor_suite.observation_spaces, obs_transforms)
+            encoders = build_feature_extractor(config, observation_space, device)
+        num_positions = process_scene(sim, scene_id, encoders, obs_transforms, args, device)
+        print('proc %d: %s, %d positions x %d headings in %.1fs' % (
+            proc_id, scene_name(scene_id), num_positions, args.headings_per_view, time.time() - tic))
+    if sim is not None:
+        sim.close()
+
+def build_feature_store(args):
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    scene_ids = load_scene_ids(build_config(args))
+
+    num_workers = min(args.num_workers, len(scene_ids))
+    processes = []
+    for proc_id in range(num_workers):
+        process = mp.Process(
+            target=process_features,
+            args=(proc_id, scene_ids[proc_id::num_workers], args)
+        )
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--exp_config', default='run_r2r/iter_train.yaml')
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--output_dir', default='data/pano_features/r2r_clip_ddppo')
+    parser.add_argument('--grid_res', type=float, default=0.25, help='meters between two positions')
+    parser.add_argument('--headings_per_view', type=int, default=3, help='headings rendered in 30 degrees')
+    parser.add_argument('--max_samples', type=int, default=100000, help='navmesh samples per scene')
+    parser.add_argument('--batch_size', type=int, default=8, help='positions encoded at once')
+    parser.add_argument('--fp16', action='store_true', default=False)
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('opts', default=None, nargs=argparse.REMAINDER,
+                        help='Modify config options from command line')
+    args = parser.parse_args()
+
+    build_feature_store(args)
@@ -10,4 +10,7 @@ export PYTHONPATH=Matterport3DSimulator/build:$PYTHONPATH
 python precompute_img_features/save_img.py --img_type rgb
 python precompute_img_features/save_img.py --img_type depth
 python precompute_img_features/extract_rgb_features.py
-python precompute_img_features/extract_depth_features.py
\ No newline at end of file
+python precompute_img_features/extract_depth_features.py
+
+# VLN-CE panoramas at navmesh poses, for IL.pano_feature_store
+# python precompute_img_features/extract_vlnce_pano_features.py --exp_config run_r2r/iter_train.yaml --split train
@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# vlnce_baselines/__init__.py imports the trainers to register them, and with them
+# habitat-sim, lmdb, clip and the gpt agent; the tests only import the modules
+# they cover, which need none of these
+if 'vlnce_baselines' not in sys.modules:
+    package = types.ModuleType('vlnce_baselines')
+    package.__path__ = [os.path.join(ROOT, 'vlnce_baselines')]
+    sys.modules['vlnce_baselines'] = package
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip('habitat')
+from vlnce_baselines.models.graph_utils import GraphMap, BatchGraphMap
+
+
+def nav_inputs_loop(gmaps, cur_vp, cur_pos, cur_ori, batch_node_vp_ids):
+    ''' the per-env path of RLTrainer._nav_gmap_variable, padded over envs '''
+    batch = []
+    for i, gmap in enumerate(gmaps):
+        node_vp_ids = batch_node_vp_ids[i]
+        ghost_vp_ids = list(gmap.ghost_pos.keys())
+        gmap_vp_ids = [None] + node_vp_ids + ghost_vp_ids
+        img_fts = [gmap.get_node_embeds(vp) for vp in node_vp_ids + ghost_vp_ids]
+        batch.append({
+            'gmap_step_ids': torch.LongTensor([0] + [gmap.node_stepId[vp] for vp in node_vp_ids] + [0] * len(ghost_vp_ids)),
+            'gmap_visited_masks': torch.BoolTensor([0] + [1] * len(node_vp_ids) + [0] * len(ghost_vp_ids)),
+            'gmap_img_fts': torch.stack([torch.zeros_like(img_fts[0])] + img_fts, 0),
+            'gmap_pos_fts': torch.from_numpy(gmap.get_pos_fts_batch(cur_vp[i], cur_pos[i], cur_ori[i], gmap_vp_ids)),
+            'gmap_pair_dists': torch.from_numpy(gmap.get_pair_dists(node_vp_ids, ghost_vp_ids)),
+            'gmap_vp_ids': gmap_vp_ids,
+        })
+    max_len = max(len(x['gmap_vp_ids']) for x in batch)
+    outs = {'gmap_vp_ids': [x['gmap_vp_ids'] for x in batch]}
+    for name in ['gmap_step_ids', 'gmap_visited_masks', 'gmap_img_fts', 'gmap_pos_fts']:
+        outs[name] = batch[0][name].new_zeros((len(gmaps), max_len) + batch[0][name].shape[1:])
+        for i, x in enumerate(batch):
+            outs[name][i, :len(x[name])] = x[name]
+    outs['gmap_pair_dists'] = torch.zeros(len(gmaps), max_len, max_len)
+    for i, x in enumerate(batch):
+        n = len(x['gmap_pair_dists'])
+        outs['gmap_pair_dists'][i, :n, :n] = x['gmap_pair_dists']
+    return outs
+
+
+def run_episode(seed, num_envs, steps, ghost_aug, max_nodes):
+    ''' the same random episodes in per-env GraphMaps and in a BatchGraphMap on the cpu '''
+    make = lambda: [GraphMap(False, 0.5, True, ghost_aug, incremental_sp=True, compact=True) for _ in range(num_envs)]
+    ref, opt = BatchGraphMap(make()), BatchGraphMap(make(), device=torch.device('cpu'))
+    rng = np.random.RandomState(seed)
+    pos = [np.zeros(3, dtype=np.float32) for _ in range(num_envs)]
+    prev_vp = [None] * num_envs
+    for stepk in range(steps):
+        heading = rng.uniform(0, 2 * np.pi, size=num_envs)
+        ori = [np.array([0, np.sin(h / 2), 0, np.cos(h / 2)]) for h in heading]
+        cand_num = rng.randint(3, 7, size=num_envs)
+        cand_ang = [list(rng.uniform(0, 2 * np.pi, size=n)) for n in cand_num]
+        cand_dis = [list(rng.uniform(0.75, 3.0, size=n)) for n in cand_num]
+        cur_embeds = torch.from_numpy(rng.normal(size=(num_envs, 8)).astype(np.float32))
+        cand_embeds = [torch.from_numpy(rng.normal(size=(n, 8)).astype(np.float32)) for n in cand_num]
+
+        # same random augmentation for both maps
+        np_state = np.random.get_state()
+        outs, distant = [], []
+        for gmaps in (ref, opt):
+            np.random.set_state(np_state)
+            cur_vp, cand_vp, cand_pos = gmaps.identify_node(pos, ori, cand_ang, cand_dis)
+            gmaps.update_graph(prev_vp, stepk + 1, cur_vp, pos, cur_embeds, cand_vp, cand_pos, cand_embeds,
+                               [None] * num_envs, [[None] * n for n in cand_num])
+            node_vp_ids = [gmap.select_nodes(cur_vp[i], pos[i], max_nodes) for i, gmap in enumerate(gmaps)]
+            if gmaps.device is None:
+                outs.append(nav_inputs_loop(gmaps, cur_vp, pos, ori, node_vp_ids))
+            else:
+                outs.append(gmaps.get_nav_inputs(cur_vp, pos, ori, node_vp_ids))
+            distant.append(gmaps.search_distant_ghosts(pos))
+        yield outs, distant
+
+        # move to a ghost, drop it and, every other step, the distant ones
+        del_ghosts = []
+        for i, gmap in enumerate(ref):
+            ghost_vps = list(gmap.ghost_pos.keys())
+            if len(ghost_vps) == 0:
+                del_ghosts.append([])
+                continue
+            ghost_vp = ghost_vps[rng.randint(len(ghost_vps))]
+            keep = rng.uniform() < 0.5
+            del_ghosts.append([ghost_vp] + [vp for vp in distant[0][i] if vp != ghost_vp and not keep])
+            _, prev_vp[i] = gmap.front_to_ghost_dist(ghost_vp)
+            pos[i] = (gmap.ghost_mean_pos[ghost_vp] + rng.normal(0, 0.1, size=3) * [1, 0, 1]).astype(np.float32)
+        ref.delete_ghosts(del_ghosts)
+        opt.delete_ghosts(del_ghosts)
+
+
+@pytest.mark.parametrize('ghost_aug, max_nodes', [(0, 0), (0.2, 0), (0, 10)])
+@pytest.mark.parametrize('seed', range(3))
+def test_batch_nav_inputs_match_per_env(seed, ghost_aug, max_nodes):
+    for ref_outs, opt_outs in (outs for outs, _ in run_episode(seed, 4, 40, ghost_aug, max_nodes)):
+        assert opt_outs['gmap_vp_ids'] == ref_outs['gmap_vp_ids']
+        for name in ['gmap_step_ids', 'gmap_visited_masks', 'gmap_img_fts', 'gmap_pos_fts', 'gmap_pair_dists']:
+            assert opt_outs[name].dtype == ref_outs[name].dtype
+            assert torch.equal(opt_outs[name], ref_outs[name]), name
+
+
+def test_batch_distant_ghosts_match_per_env():
+    for _, (ref_distant, opt_distant) in run_episode(0, 4, 40, 0, 0):
+        assert opt_distant == ref_distant
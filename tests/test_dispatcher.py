@@ -0,0 +1,59 @@
+import multiprocessing as mp
+
+from vlnce_baselines.common.dispatcher import EpisodeDispatcher, scene_batches
+
+EPISODES = [(k, f'scene_{k % 3 if k < 9 else 0}') for k in range(12)]
+
+
+def test_scene_batches():
+    assert scene_batches(EPISODES, 2) == [
+        ('scene_0', [0, 3]), ('scene_0', [6, 9]), ('scene_0', [10, 11]),
+        ('scene_1', [1, 4]), ('scene_1', [7]),
+        ('scene_2', [2, 5]), ('scene_2', [8]),
+    ]
+
+
+def test_claim_in_order(tmp_path):
+    batches = scene_batches(EPISODES, 2)
+    EpisodeDispatcher(str(tmp_path / 'queue.json')).create(batches)
+    # claimed by another dispatcher on the same file, like another rank
+    dispatcher = EpisodeDispatcher(str(tmp_path / 'queue.json'))
+    assert [dispatcher.claim() for _ in batches] == [episode_ids for _, episode_ids in batches]
+    assert dispatcher.claim() is None
+
+
+def test_claim_of_scenes(tmp_path):
+    dispatcher = EpisodeDispatcher(str(tmp_path / 'queue.json'))
+    dispatcher.create(scene_batches(EPISODES, 2))
+    assert dispatcher.claim({'scene_1', 'scene_2'}) == [1, 4]
+    assert dispatcher.claim({'scene_2'}) == [2, 5]
+    assert dispatcher.claim() == [0, 3]
+    assert dispatcher.claim({'scene_1'}) == [7]
+    assert dispatcher.claim({'scene_1'}) is None
+    assert dispatcher.claim({'scene_2', 'scene_0'}) == [6, 9]
+
+
+def claim_all(fname, scenes, claims):
+    dispatcher = EpisodeDispatcher(fname)
+    while True:
+        batch = dispatcher.claim(scenes)
+        if batch is None:
+            return
+        claims.append(batch)
+
+
+def test_every_episode_once_across_processes(tmp_path):
+    fname = str(tmp_path / 'queue.json')
+    episodes = [(k, f'scene_{k % 7}') for k in range(500)]
+    EpisodeDispatcher(fname).create(scene_batches(episodes, 3))
+    # two ranks of two envs, each env with half of the scenes
+    env_scenes = [{f'scene_{s}' for s in range(7) if s % 2 == env} for env in range(2)]
+    with mp.Manager() as manager:
+        claims = manager.list()
+        procs = [mp.Process(target=claim_all, args=(fname, scenes, claims)) for scenes in env_scenes * 2]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        claims = list(claims)
+    assert sorted(ep for batch in claims for ep in batch) == list(range(500))
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+
+import torch
+
+from vlnce_baselines.common.feature_cache import PanoFeatureCache
+
+
+def test_lru_of_embeddings(tmp_path):
+    ''' against an OrderedDict of the embeddings, over random gets & puts '''
+    g = torch.Generator().manual_seed(0)
+    cache, ref = PanoFeatureCache(5), OrderedDict()
+    for _ in range(200):
+        keys = [('scene', (int(k),), 0) for k in torch.randint(12, (3,), generator=g)]
+        slots = cache.get(keys)
+        for key, slot in zip(keys, slots):
+            assert (slot is not None) == (key in ref)
+            if slot is not None:
+                ref.move_to_end(key)
+                rgb, depth = cache.lookup([slot])
+                assert torch.equal(rgb[0], ref[key][0]) and torch.equal(depth[0], ref[key][1])
+        miss = [key for key, slot in zip(keys, slots) if slot is None]
+        rgb, depth = torch.randn(len(miss), 12, 4, generator=g), torch.randn(len(miss), 12, 2, 2, generator=g)
+        cache.put(miss, rgb, depth)
+        for key, x, y in zip(miss, rgb, depth):
+            ref[key] = (x, y)
+            ref.move_to_end(key)
+        while len(ref) > 5:
+            ref.popitem(last=False)
+        assert list(cache.entries.keys()) == list(ref.keys())
+        assert len(cache.rgb) <= 5
+
+    cache.save(str(tmp_path / 'cache.pth'))
+    loaded = PanoFeatureCache(5)
+    assert loaded.load(str(tmp_path / 'cache.pth')) == 5
+    assert list(loaded.entries.keys()) == list(ref.keys())
+    rgb, depth = loaded.lookup(loaded.get(list(ref.keys())))
+    assert torch.equal(rgb, torch.stack([x for x, _ in ref.values()]))
+    assert torch.equal(depth, torch.stack([y for _, y in ref.values()]))
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('habitat')
+from vlnce_baselines.models.graph_utils import FloydGraph, MatrixFloydGraph
+
+
+def random_graphs(seed, steps, integer_weights):
+    ''' the two graphs built from the same nodes & edges, after each update '''
+    rng = np.random.RandomState(seed)
+    ref, opt = FloydGraph(), MatrixFloydGraph(capacity=4)
+    pos = np.zeros((steps, 2))
+    for k in range(1, steps):
+        parent = rng.randint(k)
+        pos[k] = pos[parent] + rng.uniform(-1.5, 1.5, size=2)
+        dis = np.sqrt(((pos[:k] - pos[k])**2).sum(1))
+        # integer weights give many equally short paths
+        weights = np.ceil(dis) if integer_weights else dis
+        for j in np.union1d(np.nonzero(dis < 2.5)[0], [parent]):
+            ref.add_edge(str(j), str(k), float(weights[j]))
+            opt.add_edge(str(j), str(k), float(weights[j]))
+        if rng.rand() < 0.2:
+            # a viewpoint not in the graph yet is asked for
+            ref.distance(f'q{k}', '0')
+            opt.distance(f'q{k}', '0')
+        ref.update(str(k))
+        opt.update(str(k))
+        yield k, ref, opt
+
+
+@pytest.mark.parametrize('integer_weights', [False, True])
+@pytest.mark.parametrize('seed', range(10))
+def test_matrix_floyd_graph_matches_floyd_graph(seed, integer_weights):
+    for k, ref, opt in random_graphs(seed, 30, integer_weights):
+        vps = [str(j) for j in range(k + 1)]
+        for x in vps:
+            for y in vps:
+                assert opt.distance(x, y) == ref.distance(x, y)
+                assert opt.path(x, y) == ref.path(x, y)
+        assert opt.visited(str(k)) and not opt.visited('q0')
@@ -0,0 +1,256 @@
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip('habitat')
+from vlnce_baselines.models.graph_utils import GraphMap, PositionTable, calc_position_distance
+
+
+def walk(gmaps, seed, steps, lattice=False):
+    ''' the same random episode in every gmap: observe candidates, then move to a
+        ghost of the first gmap and delete it; on a lattice, edges tie exactly '''
+    rng = np.random.RandomState(seed)
+    pos, prev_vp = np.zeros(3, dtype=np.float32), None
+    for step_id in range(1, steps + 1):
+        cand_num = rng.randint(3, 7)
+        if lattice:
+            offsets = rng.randint(-2, 3, size=(cand_num, 3)) * [1, 0, 1]
+        else:
+            ang = rng.uniform(0, 2 * np.pi, size=cand_num)
+            dis = rng.uniform(0.75, 3.0, size=cand_num)
+            offsets = np.stack([-dis * np.sin(ang), np.zeros(cand_num), -dis * np.cos(ang)], 1)
+        embeds = np.zeros(4, dtype=np.float32)
+        # same random ghost augmentation in every gmap
+        np_state = np.random.get_state()
+        for gmap in gmaps:
+            np.random.set_state(np_state)
+            cur_vp = str(gmap.allnode_cnt)
+            gmap.allnode_cnt += 1
+            gmap.update_graph(prev_vp, step_id, cur_vp, pos, embeds,
+                              [f'{cur_vp}_{i}' for i in range(cand_num)], list(pos + offsets), [embeds] * cand_num,
+                              None, [None] * cand_num)
+        yield cur_vp, pos
+
+        ghost_vps = list(gmaps[0].ghost_pos.keys())
+        if len(ghost_vps) == 0:
+            continue
+        ghost_vp = ghost_vps[rng.randint(len(ghost_vps))]
+        _, prev_vp = gmaps[0].front_to_ghost_dist(ghost_vp)
+        pos = gmaps[0].ghost_mean_pos[ghost_vp] + rng.normal(0, 0.1, size=3) * [1, 0, 1]
+        pos = (np.round(pos) if lattice else pos).astype(np.float32)
+        for gmap in gmaps:
+            gmap.delete_ghost(ghost_vp)
+
+
+def observe_ghost(gmap, num_obs):
+    ''' num_obs steps whose single candidate merges into the same ghost '''
+    real_pos, prev_vp = [], None
+    for step_id in range(num_obs):
+        cur_vp = str(gmap.allnode_cnt)
+        gmap.allnode_cnt += 1
+        cur_pos = np.array([0., 0., 10. * step_id])
+        # far from every node, within loc_noise of the ghost
+        cand_pos = np.array([5., 0., 0.01 * (step_id % 3)])
+        real_pos.append(cand_pos + step_id)
+        gmap.update_graph(prev_vp, step_id + 1,
+                          cur_vp, cur_pos, np.zeros(4, dtype=np.float32),
+                          [f'{cur_vp}_0'], [cand_pos], [np.zeros(4, dtype=np.float32)],
+                          [real_pos[-1]], [None])
+        prev_vp = cur_vp
+    return real_pos
+
+
+def test_ghost_real_pos_keeps_every_observation():
+    gmap = GraphMap(True, 0.5, True, 0, max_real_pos=16)
+    state = random.getstate()
+    real_pos = observe_ghost(gmap, gmap.max_real_pos)
+    (gvp, kept), = gmap.ghost_real_pos.items()
+    assert gmap.ghost_pos[gvp][1] == len(real_pos)
+    assert all(np.array_equal(a, b) for a, b in zip(kept, real_pos)) and len(kept) == len(real_pos)
+    assert random.getstate() == state
+
+
+def test_ghost_real_pos_is_capped():
+    gmap = GraphMap(True, 0.5, True, 0, max_real_pos=16)
+    state = random.getstate()
+    real_pos = observe_ghost(gmap, 3 * gmap.max_real_pos)
+    (gvp, kept), = gmap.ghost_real_pos.items()
+    assert len(kept) == gmap.max_real_pos
+    assert all(any(np.array_equal(a, b) for b in real_pos) for a in kept)
+    assert random.getstate() == state
+
+
+def test_ghost_real_pos_unbounded():
+    ''' the baseline: every observation, and no draw from the global random state '''
+    state = random.getstate()
+    gmap = GraphMap(True, 0.5, True, 0)
+    real_pos = observe_ghost(gmap, 50)
+    (gvp, kept), = gmap.ghost_real_pos.items()
+    assert all(np.array_equal(a, b) for a, b in zip(kept, real_pos)) and len(kept) == len(real_pos)
+    assert random.getstate() == state
+
+
+def test_ghost_real_pos_samples_differ_across_maps():
+    random.seed(0)
+    samples = []
+    for _ in range(2):
+        gmap = GraphMap(True, 0.5, True, 0, max_real_pos=4)
+        observe_ghost(gmap, 64)
+        (gvp, kept), = gmap.ghost_real_pos.items()
+        samples.append([tuple(pos) for pos in kept])
+    assert samples[0] != samples[1]
+
+
+@pytest.mark.parametrize('lattice', [False, True])
+@pytest.mark.parametrize('seed', range(3))
+def test_incremental_sp_matches_networkx(seed, lattice):
+    ref = GraphMap(False, 0.5, True, 0)
+    opt = GraphMap(False, 0.5, True, 0, incremental_sp=True)
+    for _ in walk([ref, opt], seed, 60, lattice):
+        assert opt.shortest_dist == ref.shortest_dist
+        assert opt.shortest_path == ref.shortest_path
+        # the arrays of the vectorized consumers
+        sp = opt.sp_engine
+        for u, dists in ref.shortest_dist.items():
+            for v, dis in dists.items():
+                assert sp.dist_array[sp.index[u], sp.index[v]] == dis
+                assert sp.hops_array[sp.index[u], sp.index[v]] == len(ref.shortest_path[u][v])
+
+
+@pytest.mark.parametrize('lattice, ghost_aug', [(False, 0), (False, 0.2), (True, 0)])
+@pytest.mark.parametrize('seed', range(3))
+def test_compact_positions_match_dicts(seed, lattice, ghost_aug):
+    ref = GraphMap(False, 0.5, True, ghost_aug, incremental_sp=True)
+    opt = GraphMap(False, 0.5, True, ghost_aug, incremental_sp=True, compact=True)
+    for _ in walk([ref, opt], seed, 60, lattice):
+        assert opt.shortest_path == ref.shortest_path
+        assert list(opt.ghost_pos.keys()) == list(ref.ghost_pos.keys())
+        for name in ['node_pos', 'ghost_mean_pos', 'ghost_aug_pos']:
+            ref_pos, opt_pos = getattr(ref, name), getattr(opt, name)
+            assert list(opt_pos.keys()) == list(ref_pos.keys())
+            for vp in ref_pos:
+                assert opt_pos[vp].dtype == ref_pos[vp].dtype
+                assert np.array_equal(opt_pos[vp], ref_pos[vp])
+
+
+def test_position_table_nearest_matches_localize():
+    ''' nearest against the dict loop of GraphMap._localize, through sets and deletions '''
+    rng = np.random.RandomState(0)
+    gmap, wide_gmap = GraphMap(False, 0.5, True, 0), GraphMap(False, 2.0, True, 0)
+    table, ref = PositionTable(gmap.loc_noise), {}
+    for k in range(1500):
+        vp = str(rng.randint(150))
+        if vp in ref and rng.uniform() < 0.5:
+            del table[vp], ref[vp]
+        else:
+            # half of them on a coarse grid, for exact ties
+            pos = rng.randint(-4, 5, size=3) * 0.25 if k % 2 else rng.uniform(-3, 3, size=3)
+            table[vp] = ref[vp] = pos
+        assert list(table.keys()) == list(ref.keys())
+        for _ in range(2):
+            qpos = rng.randint(-4, 5, size=3) * 0.25 if rng.uniform() < 0.5 else rng.uniform(-3, 3, size=3)
+            for ignore_height in (False, True):
+                assert table.nearest(qpos, gmap.loc_noise, ignore_height) == \
+                    gmap._localize(qpos, ref, ignore_height)
+            # wider than the cells of the grid
+            assert table.nearest(qpos, wide_gmap.loc_noise) == wide_gmap._localize(qpos, ref)
+
+
+def keep_order_reference(scores, keep_first=None):
+    ''' indices by decreasing score, ties in gmap order, keep_first before all '''
+    return sorted(range(len(scores)), key=lambda i: (i != keep_first, -scores[i], i))
+
+
+def evict_ghosts_reference(gmap, cur_pos, max_ghosts, strategy, ignore=()):
+    ghost_vp_ids = [vp for vp in gmap.ghost_pos.keys() if vp not in ignore]
+    if max_ghosts <= 0 or len(ghost_vp_ids) <= max_ghosts:
+        return []
+    if strategy == 'farthest':
+        scores = [-calc_position_distance(cur_pos, gmap.ghost_mean_pos[vp]) for vp in ghost_vp_ids]
+    elif strategy == 'oldest':
+        scores = [gmap.node_stepId[gmap.ghost_fronts[vp][0]] for vp in ghost_vp_ids]
+    else:
+        scores = [max(gmap.node_stop_scores.get(front_vp, 0) for front_vp in gmap.ghost_fronts[vp])
+                  for vp in ghost_vp_ids]
+    evicted = keep_order_reference(scores)[max_ghosts:]
+    return [vp for i, vp in enumerate(ghost_vp_ids) if i in evicted]
+
+
+def select_nodes_reference(gmap, cur_vp, cur_pos, max_nodes, strategy):
+    node_vp_ids = list(gmap.node_pos.keys())
+    if max_nodes <= 0 or len(node_vp_ids) <= max_nodes:
+        return node_vp_ids
+    if strategy == 'farthest':
+        scores = [-calc_position_distance(cur_pos, gmap.node_pos[vp]) for vp in node_vp_ids]
+    elif strategy == 'oldest':
+        scores = [gmap.node_stepId[vp] for vp in node_vp_ids]
+    else:
+        scores = [gmap.node_stop_scores.get(vp, 0) for vp in node_vp_ids]
+    kept = keep_order_reference(scores, node_vp_ids.index(cur_vp))[:max_nodes]
+    return [vp for i, vp in enumerate(node_vp_ids) if i in kept]
+
+
+@pytest.mark.parametrize('strategy', ['farthest', 'oldest', 'stop_score'])
+@pytest.mark.parametrize('lattice', [False, True])
+def test_budget_matches_reference(strategy, lattice):
+    gmap = GraphMap(False, 0.5, True, 0, incremental_sp=True, compact=True)
+    rng = np.random.RandomState(0)
+    for cur_vp, cur_pos in walk([gmap], 0, 60, lattice):
+        # coarse stop scores, for ties
+        gmap.node_stop_scores[cur_vp] = rng.randint(5) / 4
+        for max_nodes in [0, 1, 5, 12]:
+            node_vp_ids = gmap.select_nodes(cur_vp, cur_pos, max_nodes, strategy)
+            assert node_vp_ids == select_nodes_reference(gmap, cur_vp, cur_pos, max_nodes, strategy)
+            # the budget input is the full input restricted to the kept nodes
+            ghost_vp_ids = list(gmap.ghost_pos.keys())
+            all_node_vp_ids = list(gmap.node_pos.keys())
+            rows = [0] + [1 + all_node_vp_ids.index(vp) for vp in node_vp_ids] + \
+                   [1 + len(all_node_vp_ids) + k for k in range(len(ghost_vp_ids))]
+            ori = np.array([0, np.sin(0.3), 0, np.cos(0.3)])
+            full_pos_fts = gmap.get_pos_fts_batch(cur_vp, cur_pos, ori, [None] + all_node_vp_ids + ghost_vp_ids)
+            pos_fts = gmap.get_pos_fts_batch(cur_vp, cur_pos, ori, [None] + node_vp_ids + ghost_vp_ids)
+            assert np.array_equal(full_pos_fts[rows], pos_fts)
+            full_pair_dists = gmap.get_pair_dists(all_node_vp_ids, ghost_vp_ids)
+            assert np.array_equal(full_pair_dists[np.ix_(rows, rows)], gmap.get_pair_dists(node_vp_ids, ghost_vp_ids))
+
+        ignore = set(list(gmap.ghost_pos.keys())[:2])
+        for max_ghosts in [0, 3, 8]:
+            assert gmap.evict_ghosts(cur_pos, max_ghosts, strategy, ignore) == \
+                evict_ghosts_reference(gmap, cur_pos, max_ghosts, strategy, ignore)
+        for vp in gmap.evict_ghosts(cur_pos, 8, strategy):
+            gmap.delete_ghost(vp)
+        assert len(gmap.ghost_pos) <= 8
+
+
+def test_unknown_evict_strategy():
+    with pytest.raises(ValueError, match='farthest'):
+        GraphMap(False, 0.5, True, 0, evict='nearest')
+    gmap = GraphMap(False, 0.5, True, 0, evict='oldest')
+    with pytest.raises(ValueError):
+        gmap.evict_ghosts(np.zeros(3), 1, 'nearest')
+
+
+def fresh_front_dists(gmap):
+    ''' front_to_ghost_dist of every ghost, recomputed without the cache '''
+    cache, gmap.front_cache = gmap.front_cache, {}
+    hits, misses = gmap.front_cache_hits, gmap.front_cache_misses
+    dists = {vp: gmap.front_to_ghost_dist(vp) for vp in gmap.ghost_pos}
+    gmap.front_cache, gmap.front_cache_hits, gmap.front_cache_misses = cache, hits, misses
+    return dists
+
+
+@pytest.mark.parametrize('ghost_aug', [0, 0.2])
+def test_front_cache_matches_recompute(ghost_aug):
+    gmap = GraphMap(False, 0.5, True, ghost_aug, incremental_sp=True, compact=True)
+    for stepk, (cur_vp, cur_pos) in enumerate(walk([gmap], 0, 40)):
+        assert {vp: gmap.front_to_ghost_dist(vp) for vp in gmap.ghost_pos} == fresh_front_dists(gmap)
+        if stepk % 5 == 4:
+            # a front of some ghosts observed again from a moved position
+            front_vp = next(iter(gmap.ghost_fronts.values()))[0]
+            gmap.update_graph(None, stepk + 1, front_vp, gmap.node_pos[front_vp] + np.float32(0.3),
+                              np.zeros(4, dtype=np.float32), [], [], [], None, [])
+            assert {vp: gmap.front_to_ghost_dist(vp) for vp in gmap.ghost_pos} == fresh_front_dists(gmap)
+    if ghost_aug == 0:
+        # the cache outlives the steps
+        assert gmap.front_cache_hits > gmap.front_cache_misses
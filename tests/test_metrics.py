@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from vlnce_baselines.common.metrics import dtw_distance
+
+
+def euclidean_distance(position_a, position_b):
+    ''' the callback of habitat_extensions.measures.NDTW '''
+    return np.linalg.norm(np.array(position_b) - np.array(position_a), ord=2)
+
+
+def dtw_reference(x, y, dist=euclidean_distance):
+    ''' the recursion of fastdtw.dtw, a cell at a time '''
+    D = {(0, 0): 0.}
+    for i in range(1, len(x) + 1):
+        for j in range(1, len(y) + 1):
+            dt = dist(x[i - 1], y[j - 1])
+            D[i, j] = min(D.get((i - 1, j), np.inf) + dt, D.get((i, j - 1), np.inf) + dt,
+                          D.get((i - 1, j - 1), np.inf) + dt)
+    return D[len(x), len(y)]
+
+
+def random_paths(seed, num_paths):
+    rng = np.random.RandomState(seed)
+    for _ in range(num_paths):
+        x = np.cumsum(rng.normal(0, 0.5, size=(rng.randint(1, 40), 3)), 0)
+        y = np.cumsum(rng.normal(0, 0.5, size=(rng.randint(1, 40), 3)), 0)
+        yield x, y
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_dtw_distance_is_exact(seed):
+    for x, y in random_paths(seed, 50):
+        assert dtw_distance(x, y) == dtw_reference(x, y)
+        assert dtw_distance(y, x) == dtw_reference(y, x)
+
+
+def test_dtw_distance_matches_fastdtw():
+    fastdtw = pytest.importorskip('fastdtw')
+    for x, y in random_paths(0, 50):
+        assert dtw_distance(x, y) == fastdtw.dtw(x, y, dist=euclidean_distance)[0]
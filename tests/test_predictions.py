@@ -0,0 +1,55 @@
+import json
+import random
+
+import pytest
+
+jsonlines = pytest.importorskip('jsonlines')
+from vlnce_baselines.common.predictions import PredictionShardWriter, compact_path, merge_predictions
+
+
+def write_shards(tmp_path, num_ranks, rxr):
+    ''' random episodes finished by the ranks, a few of them twice, and the
+        path_eps dict the ranks gathered in rank order '''
+    rng = random.Random(0)
+    fnames = [str(tmp_path / f'preds_r{rank}.jsonl') for rank in range(num_ranks)]
+    path_eps, inst_ids = {}, {}
+    episode_ids = rng.sample(range(1000), 40)
+    episode_ids += rng.sample(episode_ids, 5)
+    for rank, fname in enumerate(fnames):
+        writer = PredictionShardWriter(fname)
+        rank_eps = {}
+        for ep_id in episode_ids[rank::num_ranks]:
+            positions = [[rng.choice([0., 1.]), 0., rng.random()] for _ in range(rng.randint(1, 6))]
+            path = compact_path(positions, [rng.random() for _ in positions])
+            inst_ids[ep_id] = 7 * ep_id % 1000 if rxr else None
+            writer.append(ep_id, path, inst_ids[ep_id])
+            rank_eps[ep_id] = path
+        writer.close()
+        path_eps.update(rank_eps)
+    return fnames, path_eps, inst_ids
+
+
+def test_merge_r2r_as_path_eps(tmp_path):
+    fnames, path_eps, _ = write_shards(tmp_path, 3, False)
+    # a line cut by a crash
+    with open(fnames[1], 'a') as f:
+        f.write('{"episode_id": 1')
+    assert merge_predictions(fnames, str(tmp_path / 'preds.json'), 'r2r') == len(path_eps)
+    with open(tmp_path / 'ref.json', 'w') as f:
+        json.dump(path_eps, f, indent=2)
+    assert (tmp_path / 'preds.json').read_text() == (tmp_path / 'ref.json').read_text()
+
+
+def test_merge_rxr_sorted_by_instruction_id(tmp_path):
+    fnames, path_eps, inst_ids = write_shards(tmp_path, 3, True)
+    assert merge_predictions(fnames, str(tmp_path / 'preds.jsonl'), 'rxr') == len(path_eps)
+    preds = []
+    for k, v in path_eps.items():
+        path = [v[0]['position']]
+        for p in v[1:]:
+            if p['position'] != path[-1]:
+                path.append(p['position'])
+        preds.append({'instruction_id': inst_ids[k], 'path': path})
+    preds.sort(key=lambda x: x['instruction_id'])
+    with jsonlines.open(tmp_path / 'preds.jsonl') as reader:
+        assert list(reader) == preds
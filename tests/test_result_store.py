@@ -0,0 +1,52 @@
+from vlnce_baselines.common.result_store import EpisodeResultStore, file_hash, read_results
+
+TAG = {'checkpoint': 'abc', 'split': 'val_unseen', 'fast_eval': False, 'episode_count': -1, 'exact_dtw': True}
+
+
+def write(fname, metrics, resume=False, tag=TAG):
+    store = EpisodeResultStore(fname, resume=resume, tag=tag)
+    for ep_id, metric in metrics.items():
+        store.append(ep_id, metric)
+    store.close()
+    return store
+
+
+def test_resume_of_the_same_tag(tmp_path):
+    fname = str(tmp_path / 'stats_r0.jsonl')
+    assert not write(fname, {1: {'spl': 0.5}, 2: {'spl': 1.}}).resumed
+    # a record cut by a crash
+    with open(fname, 'a') as f:
+        f.write('{"episode_id": 3, "sp')
+    assert write(fname, {3: {'spl': 0.}}, resume=True).resumed
+    assert read_results([fname], TAG) == {1: {'spl': 0.5}, 2: {'spl': 1.}, 3: {'spl': 0.}}
+
+
+def test_no_resume_of_another_tag(tmp_path):
+    fname = str(tmp_path / 'stats_r0.jsonl')
+    write(fname, {1: {'spl': 0.5}, 2: {'spl': 1.}})
+    other = dict(TAG, checkpoint='def')
+    assert read_results([fname], other) == {}
+    # another checkpoint starts over even with resume
+    assert not write(fname, {2: {'spl': 0.}}, resume=True, tag=other).resumed
+    assert read_results([fname], other) == {2: {'spl': 0.}}
+    assert read_results([fname], TAG) == {}
+    # and without resume, the same tag too
+    write(fname, {}, tag=other)
+    assert read_results([fname], other) == {}
+
+
+def test_read_results_of_the_episodes(tmp_path):
+    fnames = [str(tmp_path / f'stats_r{rank}.jsonl') for rank in range(3)]
+    write(fnames[0], {1: {'spl': 0.5}, 2: {'spl': 1.}})
+    write(fnames[1], {3: {'spl': 0.}, 4: {'spl': 1.}})
+    # a stale store of an earlier run
+    write(fnames[2], {5: {'spl': 1.}}, tag=dict(TAG, fast_eval=True))
+    assert read_results(fnames, TAG, {'1', '3', '4'}) == {1: {'spl': 0.5}, 3: {'spl': 0.}, 4: {'spl': 1.}}
+    assert list(read_results(fnames)) == [1, 2, 3, 4, 5]
+
+
+def test_file_hash(tmp_path):
+    (tmp_path / 'a.pth').write_bytes(b'x' * 3000000)
+    (tmp_path / 'b.pth').write_bytes(b'x' * 2999999 + b'y')
+    assert file_hash(str(tmp_path / 'a.pth')) == file_hash(str(tmp_path / 'a.pth'))
+    assert file_hash(str(tmp_path / 'a.pth')) != file_hash(str(tmp_path / 'b.pth'))
@@ -0,0 +1,29 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from vlnce_baselines.waypoint_pred.utils import nms, nms_fast
+
+
+def heatmaps(generator, batch_size, height, width, ties):
+    ''' softmax heatmaps wrapped by a row on each side, as in the waypoint forward,
+        or coarse random maps full of ties '''
+    if ties:
+        return (4 * torch.rand(batch_size, 1, height, width, generator=generator)).round() / 4
+    logits = torch.randn(batch_size, 1, height - 2, width, generator=generator)
+    logits = 8 * F.avg_pool2d(logits, (7, 3), 1, (3, 1), count_include_pad=False)
+    x = torch.softmax(logits.reshape(batch_size, -1), dim=1).reshape(batch_size, height - 2, width)
+    return torch.cat((x[:, -1:], x, x[:, :1]), dim=1).unsqueeze(1)
+
+
+@pytest.mark.parametrize('ties', [False, True])
+@pytest.mark.parametrize('height, width, max_predictions, sigma', [
+    (122, 12, 5, (7.0, 5.0)),
+    (122, 12, 10, (1.0, 1.0)),
+    (10, 6, 8, (2.0, 0.0)),
+])
+def test_nms_fast_matches_nms(height, width, max_predictions, sigma, ties):
+    generator = torch.Generator().manual_seed(0)
+    for batch_size in [1, 8, 32]:
+        x = heatmaps(generator, batch_size, height, width, ties)
+        assert torch.equal(nms_fast(x, max_predictions, sigma), nms(x, max_predictions, sigma))
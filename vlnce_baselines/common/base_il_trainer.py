@@ -65,6 +65,8 @@ class BaseVLNCETrainer(BaseILTrainer):
     def __init__(self, config=None):
         super().__init__(config)
         self.policy = None
+        self.eval_envs = None   # envs kept for the next checkpoints, see _construct_eval_envs
+        self.eval_envs_key = None
         self.device = (
             torch.device("cuda", self.config.TORCH_GPU_ID)
             if torch.cuda.is_available()
@@ -165,6 +167,46 @@ class BaseVLNCETrainer(BaseILTrainer):
     def load_checkpoint(self, checkpoint_path, *args, **kwargs) -> Dict:
         return torch.load(checkpoint_path, *args, **kwargs)
 
+    def _load_policy_weights(self, ckpt_path, strict=True) -> None:
+        r"""Swaps the weights of a checkpoint into the initialized policy, for the
+        next checkpoint of an eval that keeps its envs and policy.
+        """
+        ckpt_dict = self.load_checkpoint(ckpt_path, map_location="cpu")
+        state_dict = ckpt_dict["state_dict"]
+        if 'module' in list(state_dict.keys())[0] and self.config.GPU_NUMBERS == 1:
+            # saved from the DDP-wrapped net
+            state_dict = {k.replace('net.module.', 'net.', 1): v for k, v in state_dict.items()}
+        self.policy.load_state_dict(state_dict, strict=strict)
+        logger.info(f"Loaded weights from checkpoint: {ckpt_path}")
+
+    def _construct_eval_envs(self, config, episodes_allowed=None):
+        r"""The envs of _eval_checkpoint. With EVAL.reuse_envs they are kept for the
+        next checkpoints of eval(), which only rewind their episode iterators instead
+        of restarting the simulators and reloading the scenes, as long as the episodes
+        are the same. Kept envs are closed by _close_eval_envs().
+        """
+        reuse = config.EVAL.reuse_envs and not config.EVAL.USE_CKPT_CONFIG
+        key = None if episodes_allowed is None else tuple(episodes_allowed)
+        if self.eval_envs is not None:
+            if reuse and key == self.eval_envs_key:
+                self.eval_envs.resume_all()
+                self.eval_envs.call(["rewind_episodes"] * self.eval_envs.num_envs)
+                return self.eval_envs
+            self._close_eval_envs()
+        envs = construct_envs(
+            config, get_env_class(config.ENV_NAME),
+            auto_reset_done=False,
+            episodes_allowed=episodes_allowed,
+        )
+        if reuse:
+            self.eval_envs, self.eval_envs_key = envs, key
+        return envs
+
+    def _close_eval_envs(self) -> None:
+        if self.eval_envs is not None:
+            self.eval_envs.close()
+        self.eval_envs, self.eval_envs_key = None, None
+
     # def _update_agent(
     #     self,
     #     observations,
@@ -311,9 +353,8 @@ class BaseVLNCETrainer(BaseILTrainer):
                 print("skipping -- evaluation exists.")
                 return
 
-        envs = construct_envs(
-            config, get_env_class(config.ENV_NAME),
-            auto_reset_done=False,
+        envs = self._construct_eval_envs(
+            config,
             episodes_allowed=self.traj  # split by rank
         )
 
@@ -324,12 +365,16 @@ class BaseVLNCETrainer(BaseILTrainer):
         observation_space = apply_obs_transforms_obs_space(
             envs.observation_spaces[0], obs_transforms
         )
-        self._initialize_policy(
-            config,
-            load_from_ckpt=True,
-            observation_space=observation_space,
-            action_space=envs.action_spaces[0],
-        )
+        if envs is self.eval_envs and self.policy is not None:
+            # same envs and model as the last checkpoint, only the weights change
+            self._load_policy_weights(checkpoint_path)
+        else:
+            self._initialize_policy(
+                config,
+                load_from_ckpt=True,
+                observation_space=observation_space,
+                action_space=envs.action_spaces[0],
+            )
         self.policy.eval()
         self.waypoint_predictor.eval()
 
@@ -639,7 +684,8 @@ class BaseVLNCETrainer(BaseILTrainer):
             if 'VLNBERT' in self.config.MODEL.policy_name:
                 h_t = rnn_states
 
-        envs.close()
+        if envs is not self.eval_envs:
+            envs.close()
         if config.use_pbar:
             pbar.close()
         if self.world_size > 1:
@@ -726,7 +772,8 @@ class BaseVLNCETrainer(BaseILTrainer):
                 ep_data = json.load(f)
 
         ep_ids = [x['episode_id'] for x in ep_data['episodes']]
-        ep_ids = ep_ids[self.config.local_rank::self.config.GPU_NUMBERS]
+        if self.config.IL.dispatch_episodes <= 0:   # else handed out to the ranks by a dispatcher
+            ep_ids = ep_ids[self.config.local_rank::self.config.GPU_NUMBERS]
         return ep_ids
 
     def collect_val_traj(self):
@@ -767,7 +814,9 @@ class BaseVLNCETrainer(BaseILTrainer):
 
         trajectories = gt_data
         self.trajectories = gt_data
-        trajectories = list(trajectories.keys())[self.config.local_rank::self.config.GPU_NUMBERS]
+        trajectories = list(trajectories.keys())
+        if self.config.IL.dispatch_episodes <= 0:   # else handed out to the ranks by a dispatcher
+            trajectories = trajectories[self.config.local_rank::self.config.GPU_NUMBERS]
 
         return trajectories
 
@@ -887,6 +936,7 @@ class BaseVLNCETrainer(BaseILTrainer):
                         writer=writer,
                         checkpoint_index=self.get_ckpt_id(current_ckpt),
                     )
+        self._close_eval_envs()
 
     def get_ckpt_id(self, ckpt_path):
         ckpt_path = os.path.basename(ckpt_path)
@@ -0,0 +1,81 @@
+''' Dynamic dispatch of the eval / inference episodes: a queue of scene-grouped
+    batches of episodes in a json file shared by the ranks, from which each env
+    claims its next batch once it is done with the last one, under an exclusive
+    flock of a lock file next to it. The envs keep their share of the scenes, as
+    split by construct_envs, and only claim batches of these scenes; every rank
+    holds all the scenes over its envs, so ranks that draw short episodes or light
+    scenes take over the remaining work instead of waiting for the others.
+
+    The ranks must share the filesystem of the queue (a single node, or a shared
+    filesystem on which flock works across nodes). '''
+
+import fcntl
+import json
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def scene_batches(episodes, batch_size):
+    ''' (scene_id, episode_ids) batches of at most batch_size episodes of a single
+        scene, from the (episode_id, scene_id) pairs of episodes, the scenes with
+        most episodes first so that the small batches are left for the end '''
+    scenes = OrderedDict()
+    for episode_id, scene_id in episodes:
+        scenes.setdefault(scene_id, []).append(episode_id)
+    batches = []
+    for scene_id, episode_ids in sorted(scenes.items(), key=lambda x: len(x[1]), reverse=True):
+        for k in range(0, len(episode_ids), batch_size):
+            batches.append((scene_id, episode_ids[k: k + batch_size]))
+    return batches
+
+
+class EpisodeDispatcher:
+    def __init__(self, fname):
+        self.fname = fname                      # the batches, written once
+        self.claimed_fname = fname + '.claimed' # a '0' / '1' flag per batch
+        self.lock_fname = fname + '.lock'
+        self.batches = None
+        if os.path.dirname(fname):
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_fname, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_claimed(self):
+        with open(self.claimed_fname) as f:
+            return f.read()
+
+    def _write_claimed(self, claimed):
+        with open(self.claimed_fname, 'w') as f:
+            f.write(claimed)
+
+    def create(self, batches):
+        ''' (re)starts the queue with the (scene_id, episode_ids) batches, by a single
+            rank before the others claim '''
+        with self._locked():
+            with open(self.fname, 'w') as f:
+                json.dump(batches, f)
+            self._write_claimed('0' * len(batches))
+        self.batches = batches
+
+    def claim(self, scenes=None):
+        ''' the episode ids of the next batch of one of scenes (of any scene if None),
+            None once there is none left '''
+        if self.batches is None:
+            with open(self.fname) as f:
+                self.batches = json.load(f)
+        with self._locked():
+            claimed = self._read_claimed()
+            for k, (scene_id, episode_ids) in enumerate(self.batches):
+                if claimed[k] == '0' and (scenes is None or scene_id in scenes):
+                    self._write_claimed(claimed[:k] + '1' + claimed[k + 1:])
+                    return episode_ids
+        return None
+
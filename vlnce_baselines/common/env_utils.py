@@ -217,3 +217,54 @@ def construct_envs_for_rl(
         workers_ignore_signals=workers_ignore_signals,
     )
     return envs
+
+
+class VectorEnvGroup:
+    r"""A group of the envs of a VectorEnv, with the VectorEnv methods used by
+    a rollout. Steps are split in :ref:`async_step` and :ref:`wait_step` so
+    that a group simulates while the policy runs on another one.
+
+    Only the envs of the group are talked to, the pipes of the envs of other
+    groups may be waiting on a step. Hence episodes are given at creation,
+    which holds for envs that are not reset on done (auto_reset_done=False),
+    and pausing an env only drops it from the group, as :ref:`VectorEnv.pause_at`
+    would renumber the envs of the other groups.
+    """
+
+    def __init__(self, envs: VectorEnv, env_ids: List[int], episodes: List) -> None:
+        self._envs = envs
+        self.env_ids = list(env_ids)
+        self._episodes = list(episodes)
+
+    @property
+    def num_envs(self) -> int:
+        return len(self.env_ids)
+
+    def current_episodes(self) -> List:
+        return list(self._episodes)
+
+    def call_at(self, index_env: int, function_name: str, function_args=None):
+        return self._envs.call_at(self.env_ids[index_env], function_name, function_args)
+
+    def call(self, function_names: List[str], function_args_list=None) -> List:
+        if function_args_list is None:
+            function_args_list = [None] * len(function_names)
+        return [
+            self.call_at(i, name, args)
+            for i, (name, args) in enumerate(zip(function_names, function_args_list))
+        ]
+
+    def async_step(self, data: List) -> None:
+        for index_env, action in zip(self.env_ids, data):
+            self._envs.async_step_at(index_env, action)
+
+    def wait_step(self) -> List:
+        return [self._envs.wait_step_at(index_env) for index_env in self.env_ids]
+
+    def step(self, data: List) -> List:
+        self.async_step(data)
+        return self.wait_step()
+
+    def pause_at(self, index: int) -> None:
+        self.env_ids.pop(index)
+        self._episodes.pop(index)
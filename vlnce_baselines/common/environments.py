@@ -94,6 +94,30 @@ class VLNCEDaggerEnv(habitat.RLEnv):
         ori = np.array([*(agent_state.rotation.imag), agent_state.rotation.real])
         return (pos, ori)
 
+    def get_current_episode(self):
+        # for VectorEnv.call_at, which reaches a single env
+        return self.current_episode
+
+    def get_episode_scenes(self):
+        # (episode_id, scene_id) of the episodes of the env, for the episode dispatcher
+        return [(ep.episode_id, ep.scene_id) for ep in self.episodes]
+
+    def set_episodes(self, episode_ids):
+        # the next resets go through these episodes of the env, in order
+        if not hasattr(self, '_episodes_by_id'):
+            self._episodes_by_id = {ep.episode_id: ep for ep in self.episodes}
+        self._env.episode_iterator = iter([self._episodes_by_id[ep_id] for ep_id in episode_ids])
+
+    def rewind_episodes(self):
+        # a fresh episode iterator as built by habitat.Env, for envs reused by the next eval
+        iter_option_dict = {
+            k.lower(): v
+            for k, v in self._env._config.ENVIRONMENT.ITERATOR_OPTIONS.items()
+        }
+        iter_option_dict["seed"] = self._env._config.SEED
+        self._env.episode_iterator = self._env._dataset.get_episode_iterator(**iter_option_dict)
+        self.prev_episode_id = "something different"
+
     def get_observation_at(self,
         source_position: List[float],
         source_rotation: List[Union[int, np.float64]],
@@ -117,6 +141,9 @@ class VLNCEDaggerEnv(habitat.RLEnv):
             pos, self._env.current_episode.goals[0].position,
         )
         return dist
+
+    def point_dist_to_goal_batch(self, points):
+        return [self.point_dist_to_goal(pos) for pos in points]
     
     def get_cand_real_pos(self, forward, angle):
         '''get cand real_pos by executing action'''
@@ -142,6 +169,10 @@ class VLNCEDaggerEnv(habitat.RLEnv):
         
         return post_pose
 
+    def get_cand_real_pos_batch(self, angles, forwards):
+        '''get_cand_real_pos of all cands of a step, in one call'''
+        return [self.get_cand_real_pos(forward, angle) for angle, forward in zip(angles, forwards)]
+
     def current_dist_to_refpath(self, path):
         sim = self._env.sim
         init_state = sim.get_agent_state()
@@ -155,6 +186,9 @@ class VLNCEDaggerEnv(habitat.RLEnv):
         return circle_dists
 
     def ghost_dist_to_ref(self, ghost_vp_pos, ref_path):
+        # nothing to choose from, e.g. for envs called along with others
+        if len(ghost_vp_pos) == 0:
+            return None
         episode_id = self._env.current_episode.episode_id
         if episode_id != self.prev_episode_id:
             self.progress = 0
@@ -266,6 +300,10 @@ class VLNCEDaggerEnv(habitat.RLEnv):
         sim.set_agent_state(init_state.position, init_state.rotation)
         
         return post_distance
+
+    def cand_dist_to_goal_batch(self, angles, forwards):
+        '''cand_dist_to_goal of all cands of a step, in one call'''
+        return [self.cand_dist_to_goal(angle, forward) for angle, forward in zip(angles, forwards)]
     
     def cand_dist_to_subgoal(self, 
         angle: float, forward: float,
@@ -0,0 +1,132 @@
+''' LRU cache of the 12-view rgb & depth embeddings of panoramas, keyed by
+    (scene, position, heading) quantized to pos_res meters and heading_res
+    degrees. The encoders are frozen, so a panorama seen again, at a node the
+    agent goes back to or in the eval of the next checkpoint, needs not be
+    encoded twice. Only the encoder outputs are kept, 12 x 512 rgb and 12 x 128 x
+    4 x 4 depth floats (~120KB) per panorama, in the slots of two tensors on the
+    device of the encoders, grown up to capacity slots, so that a hit is a gather
+    there rather than a copy from the host. They can be saved to / loaded from a file to carry them
+    over runs. '''
+
+import math
+import os
+from collections import OrderedDict
+
+import torch
+
+
+def heading_deg(ori):
+    ''' counter-clockwise heading of a quaternion [x, y, z, w] about the vertical axis '''
+    return math.degrees(2 * math.atan2(ori[1], ori[3]))
+
+
+class PanoFeatureCache:
+    def __init__(self, capacity, pos_res=0.01, heading_res=1.0, device=None):
+        self.capacity = capacity
+        self.pos_res = pos_res              # meters
+        self.heading_res = heading_res      # degrees
+        self.num_headings = int(round(360 / heading_res))
+        self.device = device                # of the embeddings put first if None
+        self.entries = OrderedDict()        # key to slot, least recently used first
+        self.rgb = None                     # slots x 12 x ... embeddings of the views
+        self.depth = None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, scene_id, pos, ori):
+        ''' the key of the panorama at pos with the orientation ori, a quaternion
+            [x, y, z, w] of a rotation about the vertical axis '''
+        return (
+            scene_id,
+            tuple(int(round(float(p) / self.pos_res)) for p in pos),
+            int(round(heading_deg(ori) / self.heading_res)) % self.num_headings,
+        )
+
+    def get(self, keys):
+        ''' the slot of each key in self.rgb / self.depth, None for the ones not cached '''
+        slots = []
+        for key in keys:
+            slot = self.entries.get(key)
+            if slot is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            slots.append(slot)
+        return slots
+
+    def lookup(self, slots):
+        ''' the (rgb, depth) embeddings of the views of the panoramas in slots '''
+        slots = torch.tensor(slots, dtype=torch.long, device=self.rgb.device)
+        return self.rgb.index_select(0, slots), self.depth.index_select(0, slots)
+
+    def put(self, keys, rgb_embeds, depth_embeds):
+        ''' caches the embeddings of the views of each key, rgb_embeds[i] and
+            depth_embeds[i] those of keys[i], evicting the least recently used '''
+        if self.rgb is None:
+            device = rgb_embeds.device if self.device is None else self.device
+            self.rgb = rgb_embeds.new_empty((0, *rgb_embeds.shape[1:]), device=device)
+            self.depth = depth_embeds.new_empty((0, *depth_embeds.shape[1:]), device=device)
+        # the last embeddings of each key, of the last capacity keys, are the ones left
+        rows = sorted({key: k for k, key in enumerate(keys)}.values())[-self.capacity:]
+        keys = [keys[k] for k in rows]
+        rows = torch.tensor(rows, dtype=torch.long, device=rgb_embeds.device)
+        rgb_embeds, depth_embeds = rgb_embeds.index_select(0, rows), depth_embeds.index_select(0, rows)
+        slots = []
+        for key in keys:
+            slot = self.entries.get(key)
+            if slot is None:
+                if len(self.entries) < self.capacity:
+                    slot = len(self.entries)
+                else:
+                    _, slot = self.entries.popitem(last=False)
+            self.entries[key] = slot
+            self.entries.move_to_end(key)
+            slots.append(slot)
+        self._reserve(len(self.entries))
+        slots = torch.tensor(slots, dtype=torch.long, device=self.rgb.device)
+        self.rgb.index_copy_(0, slots, rgb_embeds.detach().to(self.rgb.device, self.rgb.dtype))
+        self.depth.index_copy_(0, slots, depth_embeds.detach().to(self.depth.device, self.depth.dtype))
+
+    def _reserve(self, num_slots):
+        if num_slots <= len(self.rgb):
+            return
+        num_slots = min(max(num_slots, 2 * len(self.rgb)), self.capacity)
+        pad = num_slots - len(self.rgb)
+        self.rgb = torch.cat([self.rgb, self.rgb.new_empty((pad, *self.rgb.shape[1:]))])
+        self.depth = torch.cat([self.depth, self.depth.new_empty((pad, *self.depth.shape[1:]))])
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def save(self, fname):
+        if os.path.dirname(fname):
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+        keys = list(self.entries.keys())
+        rgb, depth = self.lookup(list(self.entries.values())) if keys else (None, None)
+        torch.save({
+            'pos_res': self.pos_res,
+            'heading_res': self.heading_res,
+            'keys': keys,
+            'rgb': rgb.cpu() if keys else None,
+            'depth': depth.cpu() if keys else None,
+        }, fname)
+
+    def load(self, fname):
+        ''' adds the entries saved in fname, if it was saved with the same
+            quantization. Returns the number of entries loaded. '''
+        state = torch.load(fname, map_location='cpu')
+        if (state['pos_res'], state['heading_res']) != (self.pos_res, self.heading_res) \
+                or len(state['keys']) == 0:
+            return 0
+        self.put(state['keys'], state['rgb'], state['depth'])
+        return len(state['keys'])
@@ -0,0 +1,82 @@
+''' Precomputed 12-view rgb & depth embeddings of panoramas at dense navmesh
+    poses of each scene, written by precompute_img_features/extract_vlnce_pano_features.py,
+    to stand in for the frozen encoders in the rollout.
+
+    The store is a directory with one subdirectory per scene holding
+        positions.npy   P x 3 agent positions
+        rgb.npy         P x m x 12 x ... rgb embeddings of the views
+        depth.npy       P x m x 12 x ... depth embeddings of the views
+        meta.json       {"headings_per_view": m}
+    the views in clockwise order from the front, at the headings 30 / m * j
+    degrees (j < m) of each position. The embeddings are memory-mapped. A pose
+    is looked up by its nearest position; the panorama at a heading 30 * s
+    degrees further is the same views shifted by s, so the heading is matched
+    to 30 / m degrees. '''
+
+import json
+import math
+import os
+
+import numpy as np
+import torch
+
+from vlnce_baselines.common.feature_cache import heading_deg
+
+VIEW_DEG = 30   # degrees between two of the 12 views
+
+
+def scene_name(scene_id):
+    ''' data/scene_datasets/mp3d/17DRP5sb8fy/17DRP5sb8fy.glb -> 17DRP5sb8fy '''
+    return os.path.splitext(os.path.basename(scene_id))[0]
+
+
+class PanoFeatureStore:
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.scenes = {}    # scene name to (positions, rgb, depth, headings_per_view)
+        self.lookups = 0
+        self.total_dist = 0.
+
+    def _scene(self, scene_id):
+        name = scene_name(scene_id)
+        if name not in self.scenes:
+            scene_dir = os.path.join(self.dirname, name)
+            if not os.path.isdir(scene_dir):
+                raise FileNotFoundError(f"no precomputed panoramas of scene {name} in {self.dirname}")
+            with open(os.path.join(scene_dir, 'meta.json')) as f:
+                meta = json.load(f)
+            self.scenes[name] = (
+                np.load(os.path.join(scene_dir, 'positions.npy')),
+                np.load(os.path.join(scene_dir, 'rgb.npy'), mmap_mode='r'),
+                np.load(os.path.join(scene_dir, 'depth.npy'), mmap_mode='r'),
+                meta['headings_per_view'],
+            )
+        return self.scenes[name]
+
+    def lookup(self, poses):
+        ''' the (rgb, depth) embeddings, B x 12 x ... float tensors, of the panoramas
+            nearest to the (scene_id, position, orientation) poses '''
+        rgb_fts, depth_fts = [], []
+        for scene_id, pos, ori in poses:
+            positions, rgb, depth, m = self._scene(scene_id)
+            dists = np.square(positions - np.asarray(pos, dtype=positions.dtype)).sum(1)
+            i = int(np.argmin(dists))
+            offset = int(round(heading_deg(ori) * m / VIEW_DEG)) % (12 * m)
+            # clockwise view v at heading h + 30 * s is view v - s at heading h
+            shift = offset // m
+            rgb_fts.append(np.roll(rgb[i, offset % m], shift, axis=0))
+            depth_fts.append(np.roll(depth[i, offset % m], shift, axis=0))
+            self.lookups += 1
+            self.total_dist += math.sqrt(dists[i])
+        return (
+            torch.from_numpy(np.stack(rgb_fts).astype(np.float32)),
+            torch.from_numpy(np.stack(depth_fts).astype(np.float32)),
+        )
+
+    @property
+    def mean_dist(self):
+        return self.total_dist / self.lookups if self.lookups > 0 else 0.
+
+    def reset_stats(self):
+        self.lookups = 0
+        self.total_dist = 0.
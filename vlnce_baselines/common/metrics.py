@@ -0,0 +1,112 @@
+import queue
+import threading
+
+import numpy as np
+
+
+def dtw_distance(x, y):
+    r"""Exact DTW distance between paths x (N x 3) and y (M x 3) with euclidean point
+    distances, i.e. fastdtw.dtw(x, y, dist=NDTW.euclidean_distance)[0], not the
+    approximation of fastdtw.fastdtw. All point distances are computed at once, then
+    the recursion runs along the anti-diagonals i + j = k of the cost matrix, whose
+    cells do not depend on each other.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # DTW is symmetric, the anti-diagonals are indexed along the shorter path
+    if len(x) > len(y):
+        x, y = y, x
+    n, m = len(x), len(y)
+    diff = y[None, :, :] - x[:, None, :]
+    # sqrt(diff . diff) with the dot of np.linalg.norm, to round as the callback
+    cost = np.sqrt(np.matmul(diff[:, :, None, :], diff[:, :, :, None])[:, :, 0, 0])
+
+    # skewed costs: diag_cost[k, i] = cost[i-1, k-i-1], inf off the matrix
+    diag_cost = np.full((n + m + 1, n + 1), np.inf)
+    i, j = np.meshgrid(np.arange(1, n + 1), np.arange(1, m + 1), indexing='ij')
+    diag_cost[i + j, i] = cost
+
+    # D[i, k-i] of the last two anti-diagonals, indexed by i
+    prev2 = np.full(n + 1, np.inf)
+    prev2[0] = 0.
+    prev1 = np.full(n + 1, np.inf)
+    cur = np.full(n + 1, np.inf)
+    for k in range(2, n + m + 1):
+        cur[0] = np.inf     # D[0, k]
+        # D[i-1, j], D[i, j-1], D[i-1, j-1]
+        np.minimum(prev1[:-1], prev1[1:], out=cur[1:])
+        np.minimum(cur[1:], prev2[:-1], out=cur[1:])
+        cur[1:] += diag_cost[k, 1:]
+        prev2, prev1, cur = prev1, cur, prev2
+    return prev1[n]
+
+
+def episode_metrics(info, gt_locations, dtw_func=dtw_distance):
+    r"""Metrics of a finished episode from its info (POSITION measure, steps taken,
+    collisions) and the locations of its reference path.
+    """
+    gt_path = np.array(gt_locations).astype(np.float64)
+    pred_path = np.array(info['position']['position'])
+    distances = np.array(info['position']['distance'])
+    metric = {}
+    metric['steps_taken'] = info['steps_taken']
+    metric['distance_to_goal'] = distances[-1]
+    metric['success'] = 1. if distances[-1] <= 3. else 0.
+    metric['oracle_success'] = 1. if (distances <= 3.).any() else 0.
+    metric['path_length'] = float(np.linalg.norm(pred_path[1:] - pred_path[:-1], axis=1).sum())
+    metric['collisions'] = info['collisions']['count'] / len(pred_path)
+    gt_length = distances[0]
+    metric['spl'] = metric['success'] * gt_length / max(gt_length, metric['path_length'])
+    dtw = dtw_func(pred_path, gt_path)
+    metric['ndtw'] = np.exp(-dtw / (len(gt_path) * 3.))
+    metric['sdtw'] = metric['ndtw'] * metric['success']
+    return metric
+
+
+class MetricWorkerPool:
+    r"""Computes episode metrics on background threads fed through a queue, so that
+    the rollout does not wait for them. submit() takes the (empty) metric dict of the
+    episode, which is filled in place once computed; join() waits for all of them.
+    With no workers, submit() computes right away.
+    """
+
+    def __init__(self, metric_fn, num_workers=2):
+        self.metric_fn = metric_fn
+        self.queue = queue.Queue()
+        self.errors = []
+        self.workers = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, metric, *args):
+        if len(self.workers) == 0:
+            metric.update(self.metric_fn(*args))
+        else:
+            self.queue.put((metric, args))
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                metric, args = item
+                metric.update(self.metric_fn(*args))
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        self.queue.join()
+        if len(self.errors) > 0:
+            raise self.errors[0]
+
+    def close(self):
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
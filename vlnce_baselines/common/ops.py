@@ -66,3 +66,61 @@ def pad_tensors_wgrad(tensors, lens=None):
         output.append(tmp)
     output = torch.stack(output, 0)
     return output
+
+class PinnedBatchBuffer(object):
+    """
+    Collates the host side inputs of a step into one float32 buffer, pinned and reused
+    across steps, which is sent to the device in one non-blocking copy.
+    The buffer grows geometrically, so that after the first steps a step allocates nothing
+    on the host (and nothing on the device when grads are off). Fields are laid out one
+    after the other; integer / bool fields are sent as floats and cast on the device.
+    """
+    def __init__(self, device, growth=2):
+        self.device = device
+        self.growth = growth
+        self.pin = torch.cuda.is_available()
+        self.host = torch.zeros(0)
+        self.dev = None
+        self.copied = None      # cuda event of the last copy out of self.host
+        self.fields = []
+
+    def begin(self, shapes):
+        """ zeroed numpy views of the buffer, {name: shape}, to be filled in place """
+        numel = 0
+        self.fields = []
+        for name, shape in shapes.items():
+            n = 1
+            for s in shape:
+                n *= s
+            self.fields.append((name, tuple(shape), numel, n))
+            numel += n
+        self.numel = numel
+
+        # the previous copy still reads the buffer
+        if self.copied is not None:
+            self.copied.synchronize()
+            self.copied = None
+        if numel > self.host.numel():
+            size = max(numel, self.growth * self.host.numel())
+            self.host = torch.zeros(size, pin_memory=self.pin)
+        host = self.host[:numel]
+        host.zero_()
+        host = host.numpy()
+        return {name: host[start: start+n].reshape(shape) for name, shape, start, n in self.fields}
+
+    def send(self):
+        """ the fields on the device, valid until the next begin() when grads are off """
+        if torch.is_grad_enabled() or self.dev is None or self.numel > self.dev.numel():
+            # with grads on, the tensors may be saved for backward, so they are not reused
+            size = self.host.numel() if not torch.is_grad_enabled() else self.numel
+            dev = torch.empty(size, device=self.device)
+            if not torch.is_grad_enabled():
+                self.dev = dev
+        else:
+            dev = self.dev
+        dev = dev[:self.numel]
+        dev.copy_(self.host[:self.numel], non_blocking=self.pin)
+        if self.pin and dev.is_cuda:
+            self.copied = torch.cuda.Event()
+            self.copied.record()
+        return {name: dev[start: start+n].view(shape) for name, shape, start, n in self.fields}
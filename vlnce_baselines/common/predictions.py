@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+''' Streaming writer of the inference predictions: each rank appends the path of
+    every finished episode to its own jsonl shard as soon as it is done, one record
+    {"episode_id": ..., "instruction_id": ..., "path": [...]} a line, and the shards
+    are merged into the leaderboard file as the gathered path_eps dict was written:
+    r2r in rollout order (rank 0 first), rxr sorted by instruction_id, the last
+    record of an episode kept. Only the offsets of the lines are held in memory.
+
+    Run as a script to merge the shards of an interrupted inference, in rank order:
+        python vlnce_baselines/common/predictions.py r2r preds.json preds_r0.jsonl preds_r1.jsonl '''
+
+import argparse
+import json
+import os
+
+import jsonlines
+
+
+def compact_path(positions, headings, max_len=500):
+    ''' the r2r path of an episode: its points where the position changed, at most
+        max_len of them, the last one with stop '''
+    path = [{'position': positions[0], 'heading': headings[0], 'stop': False}]
+    for p, h in zip(positions[1:], headings[1:]):
+        if p != path[-1]['position']:
+            path.append({'position': p, 'heading': h, 'stop': False})
+    path = path[:max_len]
+    path[-1]['stop'] = True
+    return path
+
+
+class PredictionShardWriter:
+    def __init__(self, fname):
+        self.fname = fname
+        if os.path.dirname(fname):
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+        self.f = open(fname, 'w')
+
+    def append(self, episode_id, path, instruction_id=None):
+        record = {'episode_id': episode_id, 'instruction_id': instruction_id, 'path': path}
+        self.f.write(json.dumps(record) + '\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def _record_key(record):
+    return record['episode_id'] if record['instruction_id'] is None else record['instruction_id']
+
+
+def _record_index(fnames):
+    ''' key -> (shard, offset) of the records, in the order the keys were first
+        written and pointing to their last record, as the path_eps dicts of the
+        ranks updated one after another '''
+    index = {}
+    for shard, fname in enumerate(fnames):
+        with open(fname, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    index[_record_key(json.loads(line))] = (shard, offset)
+                except ValueError:
+                    pass    # cut by a crash
+                offset += len(line)
+    return index
+
+
+def _read_records(fnames, locations):
+    ''' the records at the (shard, offset) locations, read one at a time '''
+    files = [open(fname, 'rb') for fname in fnames]
+    try:
+        for shard, offset in locations:
+            files[shard].seek(offset)
+            yield json.loads(files[shard].readline())
+    finally:
+        for f in files:
+            f.close()
+
+
+def merge_predictions(fnames, output_file, task_type='r2r'):
+    ''' merge of the shards, given in rank order, into the predictions file: a
+        json dict {episode_id: path} in rollout order for r2r, jsonlines
+        {"instruction_id", "path": positions} sorted by instruction_id for the
+        rxr-habitat leaderboard. Returns the number of episodes. '''
+    fnames = [fname for fname in fnames if os.path.exists(fname)]
+    index = _record_index(fnames)
+    count = 0
+    if task_type == 'r2r':
+        with open(output_file, 'w') as f:
+            f.write('{')
+            for record in _read_records(fnames, index.values()):
+                # as json.dump(path_eps, f, indent=2)
+                f.write(',\n' if count > 0 else '\n')
+                f.write('  ' + json.dumps(str(record['episode_id'])) + ': ')
+                f.write(json.dumps(record['path'], indent=2).replace('\n', '\n  '))
+                count += 1
+            f.write('\n}' if count > 0 else '}')
+    else:
+        locations = [index[key] for key in sorted(index)]
+        with jsonlines.open(output_file, mode='w') as writer:
+            for record in _read_records(fnames, locations):
+                # save only positions that changed
+                path = [record['path'][0]['position']]
+                for p in record['path'][1:]:
+                    if p['position'] != path[-1]:
+                        path.append(p['position'])
+                writer.write({'instruction_id': record['instruction_id'], 'path': path})
+                count += 1
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('task_type', choices=['r2r', 'rxr'])
+    parser.add_argument('output_file')
+    parser.add_argument('fnames', nargs='+')
+    args = parser.parse_args()
+
+    count = merge_predictions(args.fnames, args.output_file, args.task_type)
+    print(f'{count} episodes merged into {args.output_file}')
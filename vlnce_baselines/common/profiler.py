@@ -0,0 +1,121 @@
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict
+
+import torch
+
+
+class RolloutProfiler:
+    r"""Named timers of the rollout phases (language encoding, waypoint
+    prediction, env stepping, llm calls, ...) and counters of steps and
+    episodes, to report the time of each phase per step and per episode.
+
+    A phase is timed on the host with perf_counter and, when cuda is used, on
+    the device with a pair of cuda events. The events are only read once they
+    are done (or in summary()), so timing a phase adds no synchronization and
+    the profiler can be left on. Phases may nest, e.g. the llm call within the
+    agent phase; they are reported each on its own. A phase is either a
+    `with profiler.phase(name)` block or spans start(name) to stop(name).
+    """
+
+    # pending cuda events beyond which the finished ones are read
+    max_pending = 256
+
+    def __init__(self, enabled: bool = True, use_cuda: bool = None):
+        self.enabled = enabled
+        self.use_cuda = torch.cuda.is_available() if use_cuda is None else use_cuda
+        self.reset()
+
+    def reset(self):
+        self.calls = defaultdict(int)
+        self.wall = defaultdict(float)      # seconds on the host
+        self.gpu = defaultdict(float)       # seconds on the device
+        self.counters = defaultdict(float)
+        self._pending = []                  # (name, start event, end event)
+        self._open = {}                     # started phases
+
+    def start(self, name: str):
+        if not self.enabled:
+            return
+        start_event = None
+        if self.use_cuda:
+            start_event = torch.cuda.Event(enable_timing=True)
+            start_event.record()
+        self._open[name] = (time.perf_counter(), start_event)
+
+    def stop(self, name: str):
+        if not self.enabled:
+            return
+        tic, start_event = self._open.pop(name)
+        self.wall[name] += time.perf_counter() - tic
+        self.calls[name] += 1
+        if start_event is not None:
+            end_event = torch.cuda.Event(enable_timing=True)
+            end_event.record()
+            self._pending.append((name, start_event, end_event))
+            if len(self._pending) > self.max_pending:
+                self._read_events(wait=False)
+
+    @contextmanager
+    def phase(self, name: str):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def count(self, name: str, n: float = 1):
+        r"""Adds n to a counter, e.g. 'steps' (env actions) or 'episodes'."""
+        if self.enabled:
+            self.counters[name] += n
+
+    def _read_events(self, wait: bool):
+        pending = []
+        for name, start_event, end_event in self._pending:
+            if wait:
+                end_event.synchronize()
+            elif not end_event.query():
+                pending.append((name, start_event, end_event))
+                continue
+            self.gpu[name] += start_event.elapsed_time(end_event) / 1000.
+        self._pending = pending
+
+    def summary(self) -> Dict:
+        r"""Seconds, calls and milliseconds per step and per episode of each
+        phase, and the counters.
+        """
+        self._read_events(wait=True)
+        steps = self.counters.get('steps', 0)
+        episodes = self.counters.get('episodes', 0)
+        phases = {}
+        for name in self.calls:
+            stats = {
+                'calls': self.calls[name],
+                'wall_s': self.wall[name],
+            }
+            if self.use_cuda:
+                stats['gpu_s'] = self.gpu[name]
+            if steps > 0:
+                stats['wall_ms_per_step'] = 1000. * self.wall[name] / steps
+            if episodes > 0:
+                stats['wall_ms_per_episode'] = 1000. * self.wall[name] / episodes
+            phases[name] = stats
+        return {'phases': phases, 'counters': dict(self.counters)}
+
+    def write_tensorboard(self, writer, step: int, prefix: str = 'rollout'):
+        summary = self.summary()
+        for name, stats in summary['phases'].items():
+            for k, v in stats.items():
+                if k != 'calls':
+                    writer.add_scalar(f'{prefix}_{k}/{name}', v, step)
+        for name, v in summary['counters'].items():
+            writer.add_scalar(f'{prefix}_count/{name}', v, step)
+
+    def save_json(self, fname: str):
+        if os.path.dirname(fname):
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
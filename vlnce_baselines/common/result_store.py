@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+''' Append-only store of per-episode eval results: one jsonl file per rank, one
+    record {"episode_id": ..., <metric>: ...} per finished episode, flushed as soon
+    as it is written, so that an interrupted eval loses nothing it finished and can
+    be restarted where it stopped. The first line {"tag": ...} holds the checkpoint
+    hash and eval config the records were computed with; records of another tag are
+    not resumed from nor read back.
+
+    Run as a script to merge the files of all ranks and print the averages:
+        python vlnce_baselines/common/result_store.py data/logs/eval_results/<exp>/stats_ep_ckpt_0_val_unseen_r*.jsonl '''
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def file_hash(fname, chunk_size=1 << 20):
+    ''' sha1 of the content of fname '''
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_tag(fname):
+    ''' the tag of the store fname, None if it has none or does not exist '''
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        try:
+            return json.loads(f.readline()).get('tag')
+        except ValueError:
+            return None
+
+
+class EpisodeResultStore:
+    def __init__(self, fname, resume=False, tag=None):
+        self.fname = fname
+        self.lock = threading.Lock()
+        if os.path.dirname(fname):
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+        # the records of another checkpoint or eval config are started over
+        self.resumed = resume and os.path.exists(fname) and read_tag(fname) == tag
+        self.f = open(fname, 'a' if self.resumed else 'w')
+        if not self.resumed:
+            self.f.write(json.dumps({'tag': tag}) + '\n')
+            self.f.flush()
+        # a record cut by a crash is dropped by read_results, the next one starts on its own line
+        with open(fname, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                self.f.write('\n')
+                self.f.flush()
+
+    def append(self, episode_id, metric):
+        record = OrderedDict(episode_id=episode_id)
+        record.update(metric)
+        # numpy scalars as python ones
+        line = json.dumps(record, default=lambda x: x.item()) + '\n'
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def read_results(fnames, tag=None, episode_ids=None):
+    ''' {episode_id: metric} of the records in fnames, the last one of an episode wins.
+        Given a tag, the files of another tag are skipped; given episode_ids, the
+        records of other episodes. '''
+    results = OrderedDict()
+    for fname in fnames:
+        if not os.path.exists(fname):
+            continue
+        if tag is not None and read_tag(fname) != tag:
+            continue
+        with open(fname) as f:
+            for line in f:
+                try:
+                    record = json.loads(line, object_pairs_hook=OrderedDict)
+                except ValueError:
+                    continue    # cut by a crash
+                if 'episode_id' not in record:
+                    continue    # the tag
+                episode_id = record.pop('episode_id')
+                if episode_ids is None or str(episode_id) in episode_ids:
+                    results[episode_id] = record
+    return results
+
+
+def aggregate_results(results):
+    ''' average of each metric over the episodes of results '''
+    aggregated = OrderedDict()
+    if len(results) == 0:
+        return aggregated
+    for k in next(iter(results.values())).keys():
+        aggregated[k] = sum(v[k] for v in results.values()) / len(results)
+    return aggregated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fnames', nargs='+')
+    parser.add_argument('--output_file', default=None, help='json file of the averages')
+    args = parser.parse_args()
+
+    results = read_results(args.fnames)
+    aggregated = aggregate_results(results)
+    print(f'Episodes evaluated: {len(results)}')
+    for k, v in aggregated.items():
+        print(f'Average episode {k}: {v:.6f}')
+    if args.output_file is not None:
+        with open(args.output_file, 'w') as f:
+            json.dump(aggregated, f, indent=2)
@@ -33,6 +33,11 @@ _C.EVAL.LANGUAGES = ["en-US", "en-IN"]
 _C.EVAL.SAMPLE = False
 _C.EVAL.SAVE_RESULTS = True
 _C.EVAL.EVAL_NONLEARNING = False
+# skip the episodes in the per-episode results of an earlier, interrupted eval
+# of the same checkpoint file and eval config, else they are evaluated again
+_C.EVAL.resume = False
+# keep the envs of an eval for its next checkpoints, only rewinding their episodes
+_C.EVAL.reuse_envs = True
 _C.EVAL.NONLEARNING = CN()
 _C.EVAL.NONLEARNING.AGENT = "RandomAgent"
 
@@ -63,6 +68,44 @@ _C.IL.use_iw = True
 _C.IL.inflection_weight_coef = 3.2
 # load an already trained model for fine tuning
 _C.IL.waypoint_aug = False
+# real positions of a ghost kept for the teacher, a uniform sample of the observations
+# beyond; 0 keeps all of them
+_C.IL.max_ghost_real_pos = 0
+# update the gmap shortest paths in place instead of rerunning all-pairs dijkstra
+_C.IL.incremental_sp = False
+# array-backed gmap positions with a spatial hash for localization
+_C.IL.compact_gmap = False
+# mirror the gmaps of all envs in padded tensors on the gpu, needs incremental_sp
+_C.IL.batch_gmap = False
+# ghosts kept in the gmap and nodes in the gmap input, 0 for no limit
+_C.IL.max_gmap_ghosts = 0
+_C.IL.max_gmap_nodes = 0
+# which ghosts / nodes go over the budget: farthest / oldest / stop_score
+_C.IL.gmap_evict = "farthest"
+# >1: env groups simulate their actions while the policy runs on another group
+_C.IL.pipeline_groups = 0
+# eval / inference: reset each env with its next episode once it is done
+_C.IL.continuous_eval = False
+# time the rollout phases, written to tensorboard and json
+_C.IL.profile_rollout = False
+# threads computing the eval metrics of finished episodes, 0 to compute them in the rollout
+_C.IL.metric_workers = 2
+# exact DTW for ndtw / sdtw, else the fastdtw approximation
+_C.IL.exact_dtw = True
+# eval / inference: >0 for the envs of all ranks to pull scene-grouped batches of
+# this many episodes from a shared queue, 0 to split the episodes statically
+_C.IL.dispatch_episodes = 0
+# >0: LRU cache of the encoded panoramas of this many (scene, position, heading), 0 for none;
+# kept on the gpu, ~120KB each
+_C.IL.pano_cache_size = 0
+# quantization of the cache keys, in meters and degrees
+_C.IL.pano_cache_pos_res = 0.01
+_C.IL.pano_cache_heading_res = 1.0
+# saves the cache after eval / inference to <root>_r<rank><ext>, loaded by the next runs
+_C.IL.pano_cache_file = ""
+# directory of the precomputed panorama embeddings of the scenes, looked up by the
+# nearest pose in place of the encoders (no depth views rendered), "" to encode the views
+_C.IL.pano_feature_store = ""
 _C.IL.load_from_ckpt = False
 _C.IL.ckpt_to_load = "data/checkpoints/ckpt.0.pth"
 # if True, loads the optimizer state, epoch, and step_id from the ckpt dict.
@@ -136,6 +179,8 @@ _C.MODEL.policy_name = "CMAPolicy"  # or "Seq2SeqPolicy"
 _C.MODEL.ablate_depth = False
 _C.MODEL.ablate_rgb = False
 _C.MODEL.ablate_instruction = False
+# waypoint heatmap nms with precomputed suppression masks, same peaks
+_C.MODEL.fast_nms = True
 
 _C.MODEL.INSTRUCTION_ENCODER = CN()
 _C.MODEL.INSTRUCTION_ENCODER.sensor_uuid = "instruction"
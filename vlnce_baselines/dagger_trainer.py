@@ -24,6 +24,7 @@ from habitat_baselines.utils.common import batch_obs
 from vlnce_baselines.common.aux_losses import AuxLosses
 from vlnce_baselines.common.base_il_trainer import BaseVLNCETrainer
 from vlnce_baselines.common.env_utils import construct_envs, is_slurm_batch_job
+from vlnce_baselines.common.profiler import RolloutProfiler
 from vlnce_baselines.common.utils import extract_instruction_tokens, get_camera_orientations12
 
 with warnings.catch_warnings():
@@ -189,6 +190,7 @@ class DaggerTrainer(BaseVLNCETrainer):
         self.lmdb_features_dir = config.IL.DAGGER.lmdb_features_dir.format(split=config.TASK_CONFIG.DATASET.SPLIT)
         super().__init__(config)
         self.max_len = int(config.IL.max_traj_len)
+        self.profiler = RolloutProfiler(enabled=config.IL.profile_rollout)
 
     def _make_dirs(self) -> None:
         os.system(f"mkdir -p {self.lmdb_features_dir}")
@@ -213,17 +215,16 @@ class DaggerTrainer(BaseVLNCETrainer):
         )
 
     def _teacher_action(self, batch_angles, batch_distances, candidate_lengths):
-        cand_dists_to_goal = [[] for _ in range(len(batch_angles))]
+        # all cands of all envs, the envs being asked at once
+        cand_dists_to_goal = self.envs.call(
+            ["cand_dist_to_goal_batch"] * self.envs.num_envs,
+            [{"angles": angles, "forwards": distances} for angles, distances in zip(batch_angles, batch_distances)]
+        )
+        curr_dists_to_goal = self.envs.call(["current_dist_to_goal"] * self.envs.num_envs)
         oracle_cand_idx = []
         for j in range(len(batch_angles)):
-            for k in range(len(batch_angles[j])):
-                angle_k = batch_angles[j][k]
-                forward_k = batch_distances[j][k]
-                dist_k = self.envs.call_at(j, "cand_dist_to_goal", {"angle": angle_k, "forward": forward_k})
-                cand_dists_to_goal[j].append(dist_k)
-            curr_dist_to_goal = self.envs.call_at(j, "current_dist_to_goal")
             # if within target range (which def as 3.0)
-            if curr_dist_to_goal < 1.5:
+            if curr_dists_to_goal[j] < 1.5:
                 oracle_cand_idx.append(candidate_lengths[j] - 1)
             else:
                 oracle_cand_idx.append(np.argmin(cand_dists_to_goal[j]))
@@ -231,24 +232,28 @@ class DaggerTrainer(BaseVLNCETrainer):
 
     @torch.no_grad()
     def _collect_batch(self, dagger_ratio):
+        profiler = self.profiler
         self.envs.resume_all()
-        observations = self.envs.reset()
-        observations = extract_instruction_tokens(observations, self.config.TASK_CONFIG.TASK.INSTRUCTION_SENSOR_UUID)
-        batch = batch_obs(observations, self.device)
-        batch = apply_obs_transforms_batch(batch, self.obs_transforms)
+        with profiler.phase('env_step'):
+            observations = self.envs.reset()
+        with profiler.phase('obs_transform'):
+            observations = extract_instruction_tokens(observations, self.config.TASK_CONFIG.TASK.INSTRUCTION_SENSOR_UUID)
+            batch = batch_obs(observations, self.device)
+            batch = apply_obs_transforms_batch(batch, self.obs_transforms)
 
         not_done_masks = torch.zeros(self.envs.num_envs, 1, dtype=torch.bool, device=self.device)
         not_done_index = list(range(self.envs.num_envs))
         id2episodes = defaultdict(list)
 
         # encode instructions
-        lang_idx_tokens = batch['instruction']
-        all_lang_masks = (lang_idx_tokens != 0)
-        h_t, all_language_features = self.policy.net(
-            mode='language',
-            lang_idx_tokens=lang_idx_tokens,
-            lang_masks=all_lang_masks,
-        )
+        with profiler.phase('language'):
+            lang_idx_tokens = batch['instruction']
+            all_lang_masks = (lang_idx_tokens != 0)
+            h_t, all_language_features = self.policy.net(
+                mode='language',
+                lang_idx_tokens=lang_idx_tokens,
+                lang_masks=all_lang_masks,
+            )
         _lang_idx_tokens = lang_idx_tokens.cpu().numpy().astype(np.float16) # for collection
 
         # build hook
@@ -266,48 +271,55 @@ class DaggerTrainer(BaseVLNCETrainer):
             depth_hook = self.policy.net.space_pool_depth.register_forward_hook(hook_builder(depth_features))
 
         for stepk in range(self.max_len):
+            profiler.count('steps', self.envs.num_envs)
             language_features = all_language_features[not_done_index]
             lang_masks = all_lang_masks[not_done_index]
             language_features = torch.cat((h_t.unsqueeze(1), language_features[:,1:,:]), dim=1)
 
             # agent's current position and heading
+            profiler.start('env_query')
             positions = []; headings = []
             for ob_i in range(self.envs.num_envs):
                 agent_state_i = self.envs.call_at(ob_i, "get_agent_info", {})
                 positions.append(agent_state_i['position'])
                 headings.append(agent_state_i['heading'])
+            profiler.stop('env_query')
             
             # cand waypoint prediction
-            cand_rgb, cand_depth, cand_direction, cand_mask, candidate_lengths, \
-            batch_angles, batch_distances = self.policy.net(
-                mode = "waypoint",
-                waypoint_predictor = self.waypoint_predictor,
-                observations = batch,
-                in_train = self.config.IL.waypoint_aug,
-            )
+            with profiler.phase('waypoint'):
+                cand_rgb, cand_depth, cand_direction, cand_mask, candidate_lengths, \
+                batch_angles, batch_distances = self.policy.net(
+                    mode = "waypoint",
+                    waypoint_predictor = self.waypoint_predictor,
+                    observations = batch,
+                    in_train = self.config.IL.waypoint_aug,
+                )
 
             # navigation logit
-            logits, h_t = self.policy.net(
-                mode = 'navigation',
-                observations=batch,
-                lang_masks=lang_masks,
-                lang_feats=language_features,
-                headings=headings,
-                cand_rgb = cand_rgb, 
-                cand_depth = cand_depth,
-                cand_direction = cand_direction,
-                cand_mask = cand_mask,                    
-                masks = not_done_masks,
-            )
-            logits = logits.masked_fill_(cand_mask, -float('inf'))
+            with profiler.phase('navigation'):
+                logits, h_t = self.policy.net(
+                    mode = 'navigation',
+                    observations=batch,
+                    lang_masks=lang_masks,
+                    lang_feats=language_features,
+                    headings=headings,
+                    cand_rgb = cand_rgb, 
+                    cand_depth = cand_depth,
+                    cand_direction = cand_direction,
+                    cand_mask = cand_mask,                    
+                    masks = not_done_masks,
+                )
+                logits = logits.masked_fill_(cand_mask, -float('inf'))
 
             # sample action
-            oracle_cand_idx = self._teacher_action(batch_angles, batch_distances, candidate_lengths)
+            with profiler.phase('teacher'):
+                oracle_cand_idx = self._teacher_action(batch_angles, batch_distances, candidate_lengths)
             oracle_actions = torch.tensor(oracle_cand_idx, device=self.device).unsqueeze(1)
             actions = logits.argmax(dim=-1, keepdim=True)
             actions = torch.where(torch.rand_like(actions, dtype=torch.float)<=dagger_ratio, oracle_actions, actions)
 
             # update rgb & depth features
+            profiler.start('collect')
             _rgb_features = rgb_features.numpy().astype(np.float16)
             _depth_features = depth_features.numpy().astype(np.float16)
             _cand_direction = cand_direction.cpu().numpy().astype(np.float16)
@@ -330,6 +342,7 @@ class DaggerTrainer(BaseVLNCETrainer):
                 observations[j]['prev_action'] = np.array([headings[j]]).astype(np.float16)
             for j, ep in enumerate(self.envs.current_episodes()):
                 id2episodes[ep.episode_id].append(observations[j])
+            profiler.stop('collect')
 
             # make equiv action
             env_actions = []
@@ -340,8 +353,10 @@ class DaggerTrainer(BaseVLNCETrainer):
                     t_angle = batch_angles[j][actions[j].item()]
                     t_distance = batch_distances[j][actions[j].item()]
                     env_actions.append({'action':{'action': 4, 'action_args':{'angle': t_angle, 'distance': t_distance}}})
-            outputs = self.envs.step(env_actions)
+            with profiler.phase('env_step'):
+                outputs = self.envs.step(env_actions)
             observations, _, dones, _ = [list(x) for x in zip(*outputs)]
+            profiler.count('episodes', sum(dones))
 
             # pause env
             if sum(dones) > 0:
@@ -360,9 +375,10 @@ class DaggerTrainer(BaseVLNCETrainer):
 
             not_done_masks = torch.zeros(self.envs.num_envs, 1, dtype=torch.bool, device=self.device)
             h_t = h_t[np.array(dones)==False]
-            observations = extract_instruction_tokens(observations,self.config.TASK_CONFIG.TASK.INSTRUCTION_SENSOR_UUID)
-            batch = batch_obs(observations, self.device)
-            batch = apply_obs_transforms_batch(batch, self.obs_transforms)
+            with profiler.phase('obs_transform'):
+                observations = extract_instruction_tokens(observations,self.config.TASK_CONFIG.TASK.INSTRUCTION_SENSOR_UUID)
+                batch = batch_obs(observations, self.device)
+                batch = apply_obs_transforms_batch(batch, self.obs_transforms)
 
         if rgb_hook is not None:
             rgb_hook.remove()
@@ -561,7 +577,13 @@ class DaggerTrainer(BaseVLNCETrainer):
             for dagger_it in range(self.config.IL.DAGGER.iterations):
                 step_id = 0
                 if not self.config.IL.DAGGER.preload_lmdb_features:
+                    self.profiler.reset()
                     self._update_dataset(dagger_it + (1 if self.config.IL.load_from_ckpt else 0))
+                    if self.profiler.enabled:
+                        self.profiler.save_json(os.path.join(
+                            self.config.TENSORBOARD_DIR, f"rollout_profile_dagger_it{dagger_it}_r{self.local_rank}.json"
+                        ))
+                        self.profiler.write_tensorboard(writer, dagger_it)
 
                 if torch.cuda.is_available():
                     with torch.cuda.device(self.device):
@@ -15,6 +15,7 @@ from habitat_baselines.rl.ppo.policy import Net
 
 from vlnce_baselines.models.etp.vlnbert_init import get_vlnbert_models
 from vlnce_baselines.common.aux_losses import AuxLosses
+from vlnce_baselines.common.profiler import RolloutProfiler
 from vlnce_baselines.models.encoders.instruction_encoder import (
     InstructionEncoder,
 )
@@ -143,6 +144,16 @@ class ETP(Net):
         self.rgb_encoder = CLIPEncoder(self.device)
         self.space_pool_rgb = nn.Sequential(nn.AdaptiveAvgPool2d((1,1)), nn.Flatten(start_dim=2))
     
+        # peaks of the waypoint heatmap with precomputed suppression masks
+        self.fast_nms = model_config.fast_nms
+
+        # times the encoders & the waypoint predictor, set by the trainer
+        self.profiler = RolloutProfiler(enabled=False)
+        # embeddings of the panoramas already encoded, set by the trainer
+        self.pano_cache = None
+        # precomputed embeddings in place of the encoders, set by the trainer
+        self.pano_store = None
+
         self.pano_img_idxes = np.arange(0, 12, dtype=np.int64)        # 逆时针
         pano_angle_rad_c = (1-self.pano_img_idxes/12) * 2 * math.pi   # 对应到逆时针
         self.pano_angle_fts = angle_feature_torch(torch.from_numpy(pano_angle_rad_c))
@@ -159,9 +170,110 @@ class ETP(Net):
     def num_recurrent_layers(self):
         return 1
 
+    def _view12_keys(self, observations, num_imgs):
+        r"""The depth and rgb keys of observations in clockwise view order: the
+        a-th rgb key (counter-clockwise from the front) is view (num_imgs - a) % num_imgs.
+        Computed once for the keys of the observations. The depth views are not
+        observed with the pano feature store.
+        """
+        keys = tuple(observations.keys())
+        if getattr(self, '_view12_cache', (None,))[0] != keys:
+            # rgb, rgb_30, ..., rgb_330 (not the rgbfront, ... of the videos)
+            ccw_keys = [k for k in keys if k == 'rgb' or k.startswith('rgb_')]  # You might need to double check the keys order
+            assert len(ccw_keys) == num_imgs, ccw_keys
+            rgb_keys = [ccw_keys[(num_imgs - v) % num_imgs] for v in range(num_imgs)]
+            depth_keys = [k.replace('rgb', 'depth') for k in rgb_keys]
+            self._view12_cache = (keys, depth_keys, rgb_keys)
+        return self._view12_cache[1:]
+
+    def _encode_view12(self, obs_view12, batch_size, num_imgs, pano_poses=None):
+        r"""The depth & rgb embeddings of the views of each env, at the
+        (scene_id, position, orientation) pano_poses: those of the nearest
+        panoramas of self.pano_store if set, else taken from self.pano_cache for
+        the envs whose panorama is cached, the others encoded (and cached).
+        """
+        if self.pano_store is not None:
+            rgb_fts, depth_fts = self.pano_store.lookup(pano_poses)
+            return (
+                depth_fts.to(self.device, non_blocking=True).flatten(0, 1),
+                rgb_fts.to(self.device, non_blocking=True).flatten(0, 1),
+            )
+        cached = [None] * batch_size
+        pano_keys = None
+        if self.pano_cache is not None and pano_poses is not None:
+            pano_keys = [self.pano_cache.key(*pose) for pose in pano_poses]
+            cached = self.pano_cache.get(pano_keys)
+        miss = [i for i, x in enumerate(cached) if x is None]
+        if 0 < len(miss) < batch_size:
+            rows = torch.arange(num_imgs).unsqueeze(0) + num_imgs * torch.tensor(miss).unsqueeze(1)
+            rows = rows.flatten().to(self.device)
+            obs_view12 = {k: v.index_select(0, rows) for k, v in obs_view12.items()}
+        if len(miss) > 0:
+            with self.profiler.phase('depth_encoder'):
+                depth_embedding = self.depth_encoder(obs_view12)  # torch.Size([bs, 128, 4, 4])
+            with self.profiler.phase('rgb_encoder'):
+                rgb_embedding = self.rgb_encoder(obs_view12)      # torch.Size([bs, 2048, 7, 7])
+            if pano_keys is not None:
+                self.pano_cache.put(
+                    [pano_keys[i] for i in miss],
+                    rgb_embedding.reshape(len(miss), num_imgs, *rgb_embedding.shape[1:]),
+                    depth_embedding.reshape(len(miss), num_imgs, *depth_embedding.shape[1:]),
+                )
+            if len(miss) == batch_size:
+                return depth_embedding, rgb_embedding
+        # the cached envs, gathered from the slots of the cache
+        hit = [i for i, x in enumerate(cached) if x is not None]
+        rgb_hit, depth_hit = self.pano_cache.lookup([cached[i] for i in hit])
+        rgb_hit = rgb_hit.to(self.device, non_blocking=True)
+        depth_hit = depth_hit.to(self.device, non_blocking=True)
+        rgb_all = rgb_hit.new_empty((batch_size, *rgb_hit.shape[1:]))
+        depth_all = depth_hit.new_empty((batch_size, *depth_hit.shape[1:]))
+        rgb_all[hit] = rgb_hit
+        depth_all[hit] = depth_hit
+        if len(miss) > 0:
+            rgb_all[miss] = rgb_embedding.reshape(len(miss), *rgb_hit.shape[1:])
+            depth_all[miss] = depth_embedding.reshape(len(miss), *depth_hit.shape[1:])
+        return depth_all.flatten(0, 1), rgb_all.flatten(0, 1)
+
+    @staticmethod
+    def _peak_positions(peak_envs, batch_size):
+        r"""The position of each heatmap peak among the peaks of its env, in the
+        order of nonzero(), and the number of peaks of each env.
+        """
+        peak_lens = torch.bincount(peak_envs, minlength=batch_size)
+        offsets = torch.cumsum(peak_lens, 0) - peak_lens
+        peak_pos = torch.arange(len(peak_envs), device=peak_envs.device) - offsets[peak_envs]
+        return peak_pos, peak_lens
+
+    @staticmethod
+    def _pad_peaks(values, peak_envs, peak_pos, batch_size, num_peaks):
+        r"""The values of the peaks of each env in a B x num_peaks tensor, 0 padded."""
+        padded = values.new_zeros((batch_size, num_peaks))
+        padded[peak_envs, peak_pos] = values
+        return padded
+
+    @staticmethod
+    def _sample_waypoint_aug(batch_way_heats_regional, peak_envs, angle_idxes):
+        r"""Waypoint augmentation of the peaks of all envs at once: a waypoint is
+        sampled in the heatmap region of the image of each peak, with a single
+        multinomial. Returns the angle & distance indexes of the sampled waypoints.
+        """
+        if len(angle_idxes) == 0:
+            return angle_idxes, angle_idxes
+        # clockwise image indexes (same as batch_x_norm)
+        img_idxes = (angle_idxes + 5) // 10
+        img_idxes[img_idxes == 12] = 0
+        # heatmap regions for sampling
+        way_heats_regional = batch_way_heats_regional[peak_envs, img_idxes].flatten(1)
+        way_heats_probs = F.softmax(way_heats_regional, 1)
+        way_heats_act = torch.multinomial(way_heats_probs, 1, True).squeeze(1).detach()
+        angle_pointer = torch.where(
+            img_idxes != 0, (img_idxes - 1) * 10 + 5, torch.zeros_like(img_idxes))
+        return way_heats_act // 12 + angle_pointer, way_heats_act % 12
+
     def forward(self, mode=None, 
                 txt_ids=None, txt_masks=None, txt_embeds=None, 
-                waypoint_predictor=None, observations=None, in_train=True,
+                waypoint_predictor=None, observations=None, in_train=True, pano_poses=None,
                 rgb_fts=None, dep_fts=None, loc_fts=None, 
                 nav_types=None, view_lens=None,
                 gmap_vp_ids=None, gmap_step_ids=None,
@@ -181,27 +293,21 @@ class ETP(Net):
             NUM_ANGLES = 120    # 120 angles 3 degrees each
             NUM_IMGS = 12
             NUM_CLASSES = 12    # 12 distances at each sector
-            depth_batch = torch.zeros_like(observations['depth']).repeat(NUM_IMGS, 1, 1, 1)
-            rgb_batch = torch.zeros_like(observations['rgb']).repeat(NUM_IMGS, 1, 1, 1)
-
-            # reverse the order of input images to clockwise
-            a_count = 0
-            for i, (k, v) in enumerate(observations.items()):
-                if 'depth' in k:  # You might need to double check the keys order
-                    for bi in range(v.size(0)):
-                        ra_count = (NUM_IMGS - a_count) % NUM_IMGS
-                        depth_batch[ra_count + bi*NUM_IMGS] = v[bi]
-                        rgb_batch[ra_count + bi*NUM_IMGS] = observations[k.replace('depth','rgb')][bi]
-                    a_count += 1
+            NUM_PEAKS = 5       # waypoints kept by nms
+            # reverse the order of input images to clockwise, all views of an env in a row
+            depth_keys, rgb_keys = self._view12_keys(observations, NUM_IMGS)
+            rgb_batch = torch.stack([observations[k] for k in rgb_keys], dim=1).flatten(0, 1)
             obs_view12 = {}
-            obs_view12['depth'] = depth_batch
+            if self.pano_store is None:
+                depth_batch = torch.stack([observations[k] for k in depth_keys], dim=1).flatten(0, 1)
+                obs_view12['depth'] = depth_batch
             obs_view12['rgb'] = rgb_batch
-            depth_embedding = self.depth_encoder(obs_view12)  # torch.Size([bs, 128, 4, 4])
-            rgb_embedding = self.rgb_encoder(obs_view12)      # torch.Size([bs, 2048, 7, 7])
+            depth_embedding, rgb_embedding = self._encode_view12(obs_view12, batch_size, NUM_IMGS, pano_poses)
 
             ''' waypoint prediction ----------------------------- '''
-            waypoint_heatmap_logits = waypoint_predictor(
-                rgb_embedding, depth_embedding)
+            with self.profiler.phase('waypoint_predictor'):
+                waypoint_heatmap_logits = waypoint_predictor(
+                    rgb_embedding, depth_embedding)
 
             # reverse the order of images back to counter-clockwise
             rgb_embed_reshape = rgb_embedding.reshape(
@@ -237,8 +343,9 @@ class ETP(Net):
                 dim=1)
             batch_output_map = nms(
                 batch_x_norm_wrap.unsqueeze(1), 
-                max_predictions=5,
-                sigma=(7.0,5.0))
+                max_predictions=NUM_PEAKS,
+                sigma=(7.0,5.0),
+                fast=self.fast_nms)
 
             # predicted waypoints before sampling
             batch_output_map = batch_output_map.squeeze(1)[:,1:-1,:]
@@ -249,6 +356,10 @@ class ETP(Net):
             # max_candidate = max(candidate_lengths)  # including stop
             # cand_mask = length2mask(candidate_lengths, device=self.device)
 
+            # the peaks of all envs with a single nonzero: env, angle & distance indexes
+            peaks = batch_output_map.nonzero()
+            peak_envs = peaks[:, 0]
+            peak_pos, peak_lens = self._peak_positions(peak_envs, batch_size)
             if in_train:
                 # Waypoint augmentation
                 # parts of heatmap for sampling (fix offset first)
@@ -258,38 +369,14 @@ class ETP(Net):
                     waypoint_heatmap_logits[:,:-HEATMAP_OFFSET,:],
                 ), dim=1)
                 batch_way_heats_regional = batch_way_heats_regional.reshape(batch_size, 12, 10, 12)
-                batch_sample_angle_idxes = []
-                batch_sample_distance_idxes = []
-                # batch_way_log_prob = []
-                for j in range(batch_size):
-                    # angle indexes with candidates
-                    angle_idxes = batch_output_map[j].nonzero()[:, 0]
-                    # clockwise image indexes (same as batch_x_norm)
-                    img_idxes = ((angle_idxes.cpu().numpy()+5) // 10)
-                    img_idxes[img_idxes==12] = 0
-                    # # candidate waypoint states
-                    # way_feats_regional = way_feats[j][img_idxes]
-                    # heatmap regions for sampling
-                    way_heats_regional = batch_way_heats_regional[j][img_idxes].view(img_idxes.size, -1)
-                    way_heats_probs = F.softmax(way_heats_regional, 1)
-                    probs_c = torch.distributions.Categorical(way_heats_probs)
-                    way_heats_act = probs_c.sample().detach()
-                    sample_angle_idxes = []
-                    sample_distance_idxes = []
-                    for k, way_act in enumerate(way_heats_act):
-                        if img_idxes[k] != 0:
-                            angle_pointer = (img_idxes[k] - 1) * 10 + 5
-                        else:
-                            angle_pointer = 0
-                        sample_angle_idxes.append(way_act//12+angle_pointer)
-                        sample_distance_idxes.append(way_act%12)
-                    batch_sample_angle_idxes.append(sample_angle_idxes)
-                    batch_sample_distance_idxes.append(sample_distance_idxes)
-                    # batch_way_log_prob.append(
-                    #     probs_c.log_prob(way_heats_act))
+                cand_angle_idxes, cand_distance_idxes = self._sample_waypoint_aug(
+                    batch_way_heats_regional, peak_envs, peaks[:, 1])
             else:
                 # batch_way_log_prob = None
-                None
+                cand_angle_idxes, cand_distance_idxes = peaks[:, 1], peaks[:, 2]
+            batch_angle_idxes = self._pad_peaks(cand_angle_idxes, peak_envs, peak_pos, batch_size, NUM_PEAKS).cpu()
+            batch_distance_idxes = self._pad_peaks(cand_distance_idxes, peak_envs, peak_pos, batch_size, NUM_PEAKS).cpu()
+            peak_lens = peak_lens.tolist()
             
             rgb_feats = self.space_pool_rgb(rgb_feats)
             depth_feats = self.space_pool_depth(depth_feats)
@@ -302,12 +389,9 @@ class ETP(Net):
             cand_angles = []
             cand_distances = []
             for j in range(batch_size):
-                if in_train:
-                    angle_idxes = torch.tensor(batch_sample_angle_idxes[j])
-                    distance_idxes = torch.tensor(batch_sample_distance_idxes[j])
-                else:
-                    angle_idxes = batch_output_map[j].nonzero()[:, 0]
-                    distance_idxes = batch_output_map[j].nonzero()[:, 1]
+                angle_idxes = batch_angle_idxes[j, :peak_lens[j]]
+                distance_idxes = batch_distance_idxes[j, :peak_lens[j]]
+                if not in_train:
                     #llm plan目前选择同一视角中距离最近的waypoint
                     angle_idxes, distance_idxes = filter_minimum_distances(angle_idxes, distance_idxes)
                 # for angle & distance
@@ -1,5 +1,10 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from collections.abc import MutableMapping
+import heapq
+import random
+from itertools import count
 import numpy as np
+import torch
 from copy import deepcopy
 import networkx as nx
 import matplotlib.pyplot as plt
@@ -9,6 +14,7 @@ from habitat.utils.geometry_utils import quaternion_rotate_vector, quaternion_fr
 MAX_DIST = 30
 MAX_STEP = 10
 # NOISE = 0.5
+EVICT_STRATEGIES = ('farthest', 'oldest', 'stop_score')    # of the ghost / node budget
 
 def calc_position_distance(a, b):
     # a, b: (x, y, z)
@@ -43,6 +49,30 @@ def calculate_vp_rel_pos_fts(a, b, base_heading=0, base_elevation=0, to_clock=Fa
 
     return heading, elevation, xyz_dist
 
+def calculate_vp_rel_pos_fts_batch(a, b, base_heading=0, base_elevation=0, to_clock=False):
+    # a: (x, y, z), b: (N, 3)
+    # same outputs as calculate_vp_rel_pos_fts(a, b[i], ...) for every i
+    a = np.asarray(a)
+    b = np.asarray(b).reshape(-1, 3)
+    diff = b - a[None, :]
+    # the scalar version leaves the dtype of the positions as soon as a python
+    # number is involved under numpy's legacy scalar promotion, arrays never do
+    work_dtype = np.asarray(diff.dtype.type(0) * 2).dtype
+    dx, dy, dz = diff.astype(work_dtype).T
+    xz_dist = np.maximum(np.sqrt(dx**2 + dz**2), 1e-8)
+    xyz_dist = np.maximum(np.sqrt(dx**2 + dy**2 + dz**2), 1e-8)
+
+    heading = np.arcsin(-dx / xz_dist)  # [-pi/2, pi/2]
+    heading = np.where(b[:, 2] > a[2], np.pi - heading, heading)
+    heading = heading - base_heading
+    if to_clock:
+        heading = 2 * np.pi - heading
+
+    elevation = np.arcsin(dz / xyz_dist)  # [-pi/2, pi/2]
+    elevation = elevation - base_elevation
+
+    return heading, elevation, xyz_dist
+
 def get_angle_fts(headings, elevations, angle_feat_size):
     ang_fts = [np.sin(headings), np.cos(headings), np.sin(elevations), np.cos(elevations)]
     ang_fts = np.vstack(ang_fts).transpose().astype(np.float32)
@@ -135,22 +165,399 @@ class FloydGraph(object):
             return self.path(x, k) + self.path(k, y)
 
 
+class MatrixFloydGraph(object):
+    """
+    FloydGraph on a dense float64 distance matrix, with the same API and the
+    same outputs.
+
+    The viewpoints get their rows in the order FloydGraph first sees them, and
+    update(k) relaxes in FloydGraph's order with the same strict <: the x-k
+    distances row by row, as a shorter x-k serves the next rows, then all
+    pairs through k at once, as no pair changes the k row or column. Equally
+    short paths are thus broken the same way. path() is rebuilt iteratively
+    from the intermediate-node matrix, with an LRU cache that is flushed
+    whenever the graph changes.
+    """
+    UNREACHABLE = 95959595
+
+    def __init__(self, capacity=64, path_cache_size=4096):
+        self._index = {}        # viewpoint to row
+        self._vps = []          # row to viewpoint
+        self._dis = np.full((capacity, capacity), self.UNREACHABLE, dtype=np.float64)
+        self._point = np.full((capacity, capacity), -1, dtype=np.int64)    # -1: direct edge
+        self._visited = set()
+        self._path_cache = OrderedDict()
+        self._path_cache_size = path_cache_size
+
+    def _row(self, x):
+        if x in self._index:
+            return self._index[x]
+        row = len(self._vps)
+        if row == len(self._dis):
+            dis = np.full((2 * row, 2 * row), self.UNREACHABLE, dtype=np.float64)
+            dis[:row, :row] = self._dis
+            point = np.full((2 * row, 2 * row), -1, dtype=np.int64)
+            point[:row, :row] = self._point
+            self._dis, self._point = dis, point
+        self._index[x] = row
+        self._vps.append(x)
+        return row
+
+    def distance(self, x, y):
+        if x == y:
+            return 0
+        # FloydGraph's defaultdict also makes a row for x
+        i = self._row(x)
+        if y not in self._index:
+            return self.UNREACHABLE
+        return self._dis[i, self._index[y]]
+
+    def add_edge(self, x, y, dis):
+        i, j = self._row(x), self._row(y)
+        dis = float(dis)
+        if dis < self._dis[i, j]:
+            self._dis[i, j] = self._dis[j, i] = dis
+            self._point[i, j] = self._point[j, i] = -1
+            self._path_cache.clear()
+
+    def update(self, k):
+        i = self._row(k)
+        n = len(self._vps)
+        dis, point = self._dis[:n, :n], self._point[:n, :n]
+
+        # shortest distance from every x to k through one of its neighbours y,
+        # the first y of the minimum as FloydGraph's strict <
+        for x in range(n):
+            if x == i:
+                continue
+            t_dis = dis[x] + dis[:, i]
+            t_dis[x] = t_dis[i] = np.inf
+            y = int(t_dis.argmin())
+            if t_dis[y] < dis[x, i]:
+                dis[x, i] = dis[i, x] = t_dis[y]
+                point[x, i] = point[i, x] = y
+
+        # then every pair through k
+        t_dis = dis[:, i][:, None] + dis[i, :][None, :]
+        better = (t_dis < dis) & ~np.eye(n, dtype=bool)
+        dis[better] = t_dis[better]
+        point[better] = i
+
+        self._visited.add(k)
+        self._path_cache.clear()
+
+    def visited(self, k):
+        return (k in self._visited)
+
+    def path(self, x, y):
+        """
+        :param x: start
+        :param y: end
+        :return: the path from x to y [v1, v2, ..., v_n, y]
+        """
+        if x == y:
+            return []
+        if x not in self._index or y not in self._index:
+            return [y]
+        key = (x, y)
+        if key in self._path_cache:
+            self._path_cache.move_to_end(key)
+            return list(self._path_cache[key])
+
+        path = []
+        stack = [(self._index[x], self._index[y])]
+        while stack:
+            i, j = stack.pop()
+            if i == j:
+                continue
+            k = self._point[i, j]
+            if k < 0:     # Direct edge
+                path.append(self._vps[j])
+            else:
+                stack.append((k, j))
+                stack.append((i, k))
+
+        self._path_cache[key] = path
+        if len(self._path_cache) > self._path_cache_size:
+            self._path_cache.popitem(last=False)
+        return list(path)
+
+
+class IncrementalShortestPaths(object):
+    """
+    All-pairs shortest paths of an undirected weighted nx.Graph, kept up to
+    date in place while nodes and edges are added.
+
+    `dist` / `path` hold the same content as
+    dict(nx.all_pairs_dijkstra_path_length(G)) / dict(nx.all_pairs_dijkstra_path(G)).
+    An inserted edge only repairs, per source, the region whose distance it
+    shortens (a Dijkstra restricted to the improved vertices), so distances
+    are accumulated edge by edge from the source exactly as networkx does.
+    Sources hit by an exact tie or an edge weight increase fall back to
+    networkx so that tie-breaking stays identical.
+
+    The same distances are mirrored in a dense `dist_array` (rows/cols given
+    by `index`, inf if unreachable) and the path lengths in `hops_array`
+    (0 if unreachable) for vectorized consumers.
+    """
+    def __init__(self, graph_nx, capacity=64):
+        self.graph_nx = graph_nx
+        self.dist = {}      # source to {target: distance}
+        self.path = {}      # source to {target: [source, ..., target]}
+        self.index = {}     # viewpoint to row of dist_array
+        self.dist_array = np.full((capacity, capacity), np.inf)
+        self.hops_array = np.zeros((capacity, capacity), dtype=np.int64)
+        for vp in self.graph_nx.nodes:
+            self._add_row(vp)
+        self.recompute()
+
+    def _add_row(self, vp):
+        if vp in self.index:
+            return
+        row = len(self.index)
+        if row == len(self.dist_array):
+            dist_array = np.full((2 * row, 2 * row), np.inf)
+            dist_array[:row, :row] = self.dist_array
+            self.dist_array = dist_array
+            hops_array = np.zeros((2 * row, 2 * row), dtype=np.int64)
+            hops_array[:row, :row] = self.hops_array
+            self.hops_array = hops_array
+        self.index[vp] = row
+        self.dist_array[row, row] = 0
+        self.hops_array[row, row] = 1
+
+    def _fill_row(self, source):
+        row = self.dist_array[self.index[source]]
+        row[:] = np.inf
+        targets = [self.index[vp] for vp in self.dist[source].keys()]
+        row[targets] = list(self.dist[source].values())
+        row = self.hops_array[self.index[source]]
+        row[:] = 0
+        targets = [self.index[vp] for vp in self.path[source].keys()]
+        row[targets] = [len(path) for path in self.path[source].values()]
+
+    def recompute(self, source=None):
+        if source is None:
+            self.dist = dict(nx.all_pairs_dijkstra_path_length(self.graph_nx))
+            self.path = dict(nx.all_pairs_dijkstra_path(self.graph_nx))
+            for vp in self.dist.keys():
+                self._fill_row(vp)
+        else:
+            self.dist[source] = nx.single_source_dijkstra_path_length(self.graph_nx, source)
+            self.path[source] = nx.single_source_dijkstra_path(self.graph_nx, source)
+            self._fill_row(source)
+
+    def add_node(self, vp):
+        self.graph_nx.add_node(vp)
+        if vp not in self.dist:
+            self._add_row(vp)
+            self.dist[vp] = {vp: 0}
+            self.path[vp] = {vp: [vp]}
+
+    def add_edge(self, u, v, weight):
+        old_weight = self.graph_nx[u][v]['weight'] if self.graph_nx.has_edge(u, v) else None
+        self.add_node(u)
+        self.add_node(v)
+        self.graph_nx.add_edge(u, v, weight=weight)
+        if u == v or weight == old_weight:
+            return
+        if old_weight is not None and weight > old_weight:
+            self.recompute()
+            return
+        for source in list(self.dist.keys()):
+            if not self._repair(source, u, v, weight):
+                self.recompute(source)
+
+    def _repair(self, source, u, v, weight):
+        """ returns False on an exact tie, where networkx's choice is kept instead """
+        dist, path = self.dist[source], self.path[source]
+        tentative = {}      # vertex to (improved distance, predecessor)
+        heap = []
+        c = count()
+
+        def relax(x, y, new_dis):
+            if y in tentative:
+                old_dis, old_prev = tentative[y]
+            elif y in dist:
+                old_dis, old_prev = dist[y], path[y][-2] if len(path[y]) > 1 else None
+            else:
+                old_dis, old_prev = None, None
+            # an improved predecessor can round to the same distance, the path
+            # still goes through its new path
+            if old_dis is None or new_dis < old_dis or (new_dis == old_dis and old_prev == x):
+                tentative[y] = (new_dis, x)
+                heapq.heappush(heap, (new_dis, next(c), y))
+            elif new_dis == old_dis:
+                return False
+            return True
+
+        for a, b in ((u, v), (v, u)):
+            if a in dist and not relax(a, b, dist[a] + weight):
+                return False
+
+        done = set()
+        while heap:
+            d, _, x = heapq.heappop(heap)
+            if x in done or d != tentative[x][0]:
+                continue
+            done.add(x)
+            dist[x] = d
+            path[x] = path[tentative[x][1]] + [x]
+            self.dist_array[self.index[source], self.index[x]] = d
+            self.hops_array[self.index[source], self.index[x]] = len(path[x])
+            for y, e in self.graph_nx[x].items():
+                if y not in done and not relax(x, y, d + e['weight']):
+                    return False
+        return True
+
+
+class PositionTable(MutableMapping):
+    """
+    viewpoint to position (x, y, z) mapping backed by a preallocated array.
+
+    Rows are kept in insertion order (like a dict), so iteration and the
+    first-nearest tie-breaking of GraphMap._localize are unchanged. A uniform
+    hash grid with cells of `cell_size` answers radius queries by only looking
+    at the 27 cells around the query point.
+    """
+    def __init__(self, cell_size, capacity=64):
+        self.cell_size = max(cell_size, 1e-6) * (1 + 1e-6)   # margin against rounding at the cell border
+        self._pos = np.zeros((capacity, 3), dtype=np.float64)
+        self._dtypes = [None] * capacity    # returned values keep the dtype they were set with
+        self._ids = [None] * capacity       # row to viewpoint
+        self._rows = {}                     # viewpoint to row, in insertion order
+        self._cells = [None] * capacity     # row to grid cell
+        self._grid = defaultdict(set)       # grid cell to rows
+        self._size = 0                      # rows used, including deleted ones
+
+    def _cell(self, pos):
+        return tuple(np.floor(np.asarray(pos[:3], dtype=np.float64) / self.cell_size).astype(np.int64).tolist())
+
+    def _grow(self):
+        capacity = 2 * len(self._pos)
+        pos = np.zeros((capacity, 3), dtype=np.float64)
+        pos[:self._size] = self._pos[:self._size]
+        self._pos = pos
+        extra = capacity - len(self._ids)
+        self._dtypes += [None] * extra
+        self._ids += [None] * extra
+        self._cells += [None] * extra
+
+    def _compact(self):
+        rows = list(self._rows.values())
+        self._pos[:len(rows)] = self._pos[rows]
+        self._dtypes[:len(rows)] = [self._dtypes[r] for r in rows]
+        self._cells[:len(rows)] = [self._cells[r] for r in rows]
+        self._ids[:len(rows)] = list(self._rows.keys())
+        self._rows = {vp: r for r, vp in enumerate(self._rows.keys())}
+        self._size = len(rows)
+        self._grid = defaultdict(set)
+        for r in range(self._size):
+            self._grid[self._cells[r]].add(r)
+
+    def __setitem__(self, vp, pos):
+        cell = self._cell(pos)
+        row = self._rows.get(vp)
+        if row is None:
+            if self._size == len(self._pos):
+                self._grow()
+            row = self._size
+            self._size += 1
+            self._rows[vp] = row
+            self._ids[row] = vp
+        elif self._cells[row] != cell:
+            self._grid[self._cells[row]].discard(row)
+        self._pos[row] = pos[:3]
+        self._dtypes[row] = getattr(pos, 'dtype', np.float64)
+        self._cells[row] = cell
+        self._grid[cell].add(row)
+
+    def __getitem__(self, vp):
+        row = self._rows[vp]
+        return self._pos[row].astype(self._dtypes[row])
+
+    def __delitem__(self, vp):
+        row = self._rows.pop(vp)
+        self._grid[self._cells[row]].discard(row)
+        if self._size - len(self._rows) > max(64, len(self._rows)):
+            self._compact()
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, vp):
+        return vp in self._rows
+
+    def as_array(self):
+        """ returns viewpoints and their positions as a (N, 3) array """
+        rows = np.fromiter(self._rows.values(), dtype=np.int64, count=len(self._rows))
+        return list(self._rows.keys()), self._pos[rows]
+
+    def distances(self, qpos):
+        """
+        viewpoints and their distances to qpos, as calc_position_distance in float64
+        (squares are exact products here, where numpy scalars may go through pow)
+        """
+        vps, pos = self.as_array()
+        qpos = np.asarray(qpos)
+        dx = pos[:, 0] - qpos[0]
+        dy = pos[:, 1] - qpos[1]
+        dz = pos[:, 2] - qpos[2]
+        return vps, np.sqrt(dx**2 + dy**2 + dz**2)
+
+    def nearest(self, qpos, radius, ignore_height=False):
+        """ first nearest viewpoint within radius, None if there is none """
+        if ignore_height or radius > self.cell_size:
+            rows = np.fromiter(self._rows.values(), dtype=np.int64, count=len(self._rows))
+        else:
+            cx, cy, cz = self._cell(qpos)
+            rows = [r for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                    for r in self._grid.get((cx+dx, cy+dy, cz+dz), ())]
+            rows = np.sort(np.array(rows, dtype=np.int64))
+        if len(rows) == 0:
+            return None
+        qpos = np.asarray(qpos)
+        if ignore_height:
+            dis = ((qpos[[0,2]] - self._pos[rows][:, [0,2]])**2).sum(1)**0.5
+        else:
+            dis = ((qpos - self._pos[rows])**2).sum(1)**0.5
+        i = np.argmin(dis)
+        return None if dis[i] > radius else self._ids[rows[i]]
+
+
 class GraphMap(object):
-    def __init__(self, has_real_pos, loc_noise, merge_ghost, ghost_aug):
+    def __init__(self, has_real_pos, loc_noise, merge_ghost, ghost_aug, incremental_sp=False, compact=False,
+                 evict='farthest', max_real_pos=0):
 
         self.graph_nx = nx.Graph()
+        # update shortest paths in place instead of rerunning all-pairs dijkstra
+        self.sp_engine = IncrementalShortestPaths(self.graph_nx) if incremental_sp else None
+        # keep node & ghost positions in arrays with a spatial hash for _localize
+        self.compact = compact
+        # strategy of evict_ghosts / select_nodes, checked here rather than on the first eviction
+        self.evict = self._check_evict(evict)
 
-        self.node_pos = {}          # viewpoint to position (x, y, z)
+        self.node_pos = PositionTable(loc_noise) if compact else {}   # viewpoint to position (x, y, z)
         self.node_embeds = {}       # viewpoint to pano feature
         self.node_stepId = {}
 
         self.ghost_cnt = 0          # id to create ghost 
         self.allnode_cnt = 0
-        self.ghost_pos = {}
-        self.ghost_mean_pos = {}
-        self.ghost_embeds = {}      # viewpoint to single_view feature
-        self.ghost_fronts = {}      # viewpoint to front_vp id
-        self.ghost_real_pos = {}    # for training
+        self.ghost_pos = {}         # viewpoint to [sum of observed positions, count]
+        self.ghost_mean_pos = PositionTable(loc_noise) if compact else {}
+        self.ghost_embeds = {}      # viewpoint to [sum of single_view features, count]
+        self.ghost_fronts = {}      # viewpoint to front_vp ids, without repeats
+        self.front_cache = {}       # viewpoint to (dist, front_vp) of its nearest front
+        self.front_cache_hits = 0
+        self.front_cache_misses = 0
+        self.ghost_real_pos = {}    # for training, the real positions observed, up to max_real_pos
+        self.max_real_pos = max_real_pos    # beyond, a uniform sample of the observations is kept; 0 keeps all
+        # seeded once from the global random state, so that each map samples its own
+        # observations and the merges leave the global random state alone
+        self.real_pos_rng = random.Random(random.getrandbits(64)) if max_real_pos > 0 else None
         self.has_real_pos = has_real_pos
         self.merge_ghost = merge_ghost
         self.ghost_aug = ghost_aug  # 0 ~ 1, noise level
@@ -163,7 +570,13 @@ class GraphMap(object):
 
         self.last_del_ghost = ''
 
+        self.dist_dtype = None      # dtype of edge weights, hence of shortest_dist values
+        self.version = 0            # bumped on every change of the map
+        self.pair_dists_cache = None
+
     def _localize(self, qpos, kpos_dict, ignore_height=False):
+        if isinstance(kpos_dict, PositionTable):
+            return kpos_dict.nearest(qpos, self.loc_noise, ignore_height)
         min_dis = 10000
         min_vp = None
         for kvp, kpos in kpos_dict.items():
@@ -193,41 +606,67 @@ class GraphMap(object):
         cand_pos = [p for p in estimate_cand_pos(cur_pos, cur_ori, cand_ang, cand_dis)]
         return cur_vp, cand_vp, cand_pos
 
+    def _add_node(self, vp):
+        if self.sp_engine is not None:
+            self.sp_engine.add_node(vp)
+        else:
+            self.graph_nx.add_node(vp)
+
+    def _add_edge(self, u, v, dis):
+        dis_dtype = np.asarray(dis).dtype
+        self.dist_dtype = dis_dtype if self.dist_dtype is None else np.promote_types(self.dist_dtype, dis_dtype)
+        if self.sp_engine is not None:
+            self.sp_engine.add_edge(u, v, dis)
+        else:
+            self.graph_nx.add_edge(u, v, weight=dis)
+
     def delete_ghost(self, vp):
         self.ghost_pos.pop(vp)
         self.ghost_mean_pos.pop(vp)
         self.ghost_embeds.pop(vp)
         self.ghost_fronts.pop(vp)
+        self.front_cache.pop(vp, None)
         if self.has_real_pos:
             self.ghost_real_pos.pop(vp)
         self.last_del_ghost = vp
+        self.version += 1
 
     def update_graph(self, prev_vp, step_id,
                            cur_vp, cur_pos, cur_embeds,
                            cand_vp, cand_pos, cand_embeds, 
-                           cand_real_pos, imgs):
+                           cand_real_pos, imgs, cand_nvp=None):
+        # cand_nvp: node each cand localizes to (or None), if already known
         nearby_cand_wp = set()
         new_ghost_node = []
+        self.version += 1
 
         # 1. connect prev_vp
-        self.graph_nx.add_node(cur_vp)
+        self._add_node(cur_vp)
         if prev_vp is not None:
             prev_pos = self.node_pos[prev_vp]
             dis = calc_position_distance(prev_pos, cur_pos)
-            self.graph_nx.add_edge(prev_vp, cur_vp, weight=dis)
+            self._add_edge(prev_vp, cur_vp, dis)
 
         # 2. update node & ghost info
+        if cur_vp in self.node_pos:
+            # a moved front invalidates the cached distances of its ghosts only
+            for gvp, fronts in self.ghost_fronts.items():
+                if cur_vp in fronts:
+                    self.front_cache.pop(gvp, None)
         self.node_pos[cur_vp] = cur_pos
         self.node_embeds[cur_vp] = cur_embeds
         self.node_stepId[cur_vp] = step_id
 
         del_idx = 0
         for i, (cvp, cpos, cembeds) in enumerate(zip(cand_vp, cand_pos, cand_embeds)):
-            localized_nvp = self._localize(cpos, self.node_pos)
+            if cand_nvp is None:
+                localized_nvp = self._localize(cpos, self.node_pos)
+            else:
+                localized_nvp = cand_nvp[i]
             # cand overlap with node, connect cur_vp with localized_nvp
             if localized_nvp is not None :
                 dis = calc_position_distance(cur_pos, self.node_pos[localized_nvp])
-                self.graph_nx.add_edge(cur_vp, localized_nvp, weight=dis)
+                self._add_edge(cur_vp, localized_nvp, dis)
                 imgs.pop(i-del_idx)
                 del_idx += 1
             # cand not overlap with node, create/update ghost
@@ -240,7 +679,7 @@ class GraphMap(object):
                         gvp = str(self.allnode_cnt)
                         self.allnode_cnt += 1
                         self.ghost_cnt += 1
-                        self.ghost_pos[gvp] = [cpos]
+                        self.ghost_pos[gvp] = [cpos, 1]
                         self.ghost_mean_pos[gvp] = cpos
                         self.ghost_embeds[gvp] = [cembeds, 1]
                         self.ghost_fronts[gvp] = [cur_vp]
@@ -251,13 +690,24 @@ class GraphMap(object):
                     # update ghost
                     else:
                         gvp = localized_gvp
-                        self.ghost_pos[gvp].append(cpos)
-                        self.ghost_mean_pos[gvp] = np.mean(self.ghost_pos[gvp], axis=0)
+                        # running sums, added in observation order as np.mean would
+                        self.ghost_pos[gvp][0] = self.ghost_pos[gvp][0] + cpos
+                        self.ghost_pos[gvp][1] += 1
+                        self.ghost_mean_pos[gvp] = self.ghost_pos[gvp][0] / self.ghost_pos[gvp][1]
                         self.ghost_embeds[gvp][0] = self.ghost_embeds[gvp][0] + cembeds
                         self.ghost_embeds[gvp][1] += 1
-                        self.ghost_fronts[gvp].append(cur_vp)
+                        if cur_vp not in self.ghost_fronts[gvp]:
+                            self.ghost_fronts[gvp].append(cur_vp)
+                        self.front_cache.pop(gvp, None)
                         if self.has_real_pos:
-                            self.ghost_real_pos[gvp].append(cand_real_pos[i])
+                            real_pos = self.ghost_real_pos[gvp]
+                            if self.max_real_pos <= 0 or len(real_pos) < self.max_real_pos:
+                                real_pos.append(cand_real_pos[i])
+                            else:
+                                # reservoir: each observation is kept with equal chance
+                                k = self.real_pos_rng.randrange(self.ghost_pos[gvp][1])
+                                if k < self.max_real_pos:
+                                    real_pos[k] = cand_real_pos[i]
                         imgs.pop(i-del_idx)
                         del_idx += 1
                         nearby_cand_wp.add(gvp)
@@ -266,7 +716,7 @@ class GraphMap(object):
                     gvp = str(self.allnode_cnt)
                     self.allnode_cnt += 1
                     self.ghost_cnt += 1
-                    self.ghost_pos[gvp] = [cpos]
+                    self.ghost_pos[gvp] = [cpos, 1]
                     self.ghost_mean_pos[gvp] = cpos
                     self.ghost_embeds[gvp] = [cembeds, 1]
                     self.ghost_fronts[gvp] = [cur_vp]
@@ -275,21 +725,41 @@ class GraphMap(object):
                     nearby_cand_wp.add(gvp)
                     new_ghost_node.append(gvp)
         
-        self.ghost_aug_pos = deepcopy(self.ghost_mean_pos)
-        if self.ghost_aug != 0:
-            for gvp, gpos in self.ghost_aug_pos.items():
-                gpos_noise = np.random.normal(loc=(0,0,0), scale=(self.ghost_aug,0,self.ghost_aug), size=(3,))
-                gpos_noise[gpos_noise < -self.ghost_aug] = -self.ghost_aug
-                gpos_noise[gpos_noise >  self.ghost_aug] =  self.ghost_aug
-                self.ghost_aug_pos[gvp] = gpos + gpos_noise
+        if self.ghost_aug != 0 and len(self.ghost_mean_pos) > 0:
+            # every augmented position is resampled at each step, so is the nearest
+            # front of every ghost: with ghost_aug the cache only lasts within a step
+            self.front_cache.clear()
+            if self.compact:
+                gvps, gpos = self.ghost_mean_pos.as_array()
+            else:
+                gvps, gpos = list(self.ghost_mean_pos.keys()), np.array(list(self.ghost_mean_pos.values()))
+            # one draw for all ghosts, the same numbers as drawing ghost by ghost
+            gpos_noise = np.random.normal(loc=(0,0,0), scale=(self.ghost_aug,0,self.ghost_aug), size=(len(gvps), 3))
+            gpos_noise = np.clip(gpos_noise, -self.ghost_aug, self.ghost_aug)
+            self.ghost_aug_pos = dict(zip(gvps, gpos + gpos_noise))
+        elif self.compact:
+            self.ghost_aug_pos = dict(self.ghost_mean_pos.items())
+        else:
+            # positions are replaced, never updated in place
+            self.ghost_aug_pos = dict(self.ghost_mean_pos)
 
-        self.shortest_path = dict(nx.all_pairs_dijkstra_path(self.graph_nx))
-        self.shortest_dist = dict(nx.all_pairs_dijkstra_path_length(self.graph_nx))
+        if self.sp_engine is not None:
+            self.shortest_path = self.sp_engine.path
+            self.shortest_dist = self.sp_engine.dist
+        else:
+            self.shortest_path = dict(nx.all_pairs_dijkstra_path(self.graph_nx))
+            self.shortest_dist = dict(nx.all_pairs_dijkstra_path_length(self.graph_nx))
 
         return list(nearby_cand_wp), imgs, new_ghost_node
 
     def front_to_ghost_dist(self, ghost_vp):
         # assume the nearest front
+        # cached until the ghost gets a new front, one of its fronts moves or its
+        # augmented position changes (every step with ghost_aug)
+        if ghost_vp in self.front_cache:
+            self.front_cache_hits += 1
+            return self.front_cache[ghost_vp]
+        self.front_cache_misses += 1
         min_dis = 10000
         min_front = None
         for front_vp in self.ghost_fronts[ghost_vp]:
@@ -299,8 +769,79 @@ class GraphMap(object):
             if dis < min_dis:
                 min_dis = dis
                 min_front = front_vp
+        self.front_cache[ghost_vp] = (min_dis, min_front)
         return min_dis, min_front
 
+    def get_node_dist_array(self, node_vp_ids):
+        """ node x node shortest distances (float64, inf if unreachable) """
+        if self.sp_engine is not None:
+            rows = [self.sp_engine.index[vp] for vp in node_vp_ids]
+            return self.sp_engine.dist_array[np.ix_(rows, rows)]
+        return np.array(
+            [[self.shortest_dist[u].get(v, np.inf) for v in node_vp_ids] for u in node_vp_ids],
+            dtype=np.float64,
+        ).reshape(len(node_vp_ids), len(node_vp_ids))
+
+    def get_ghost_fronts(self, ghost_vp_ids, node_vp_ids):
+        """ index in node_vp_ids of the nearest front of each ghost, and the distance to it """
+        node_idx = {vp: i for i, vp in enumerate(node_vp_ids)}
+        front_idx = np.zeros(len(ghost_vp_ids), dtype=np.int64)
+        front_dis = np.zeros(len(ghost_vp_ids), dtype=np.float64)
+        for i, vp in enumerate(ghost_vp_ids):
+            front_dis[i], front_vp = self.front_to_ghost_dist(vp)
+            front_idx[i] = node_idx[front_vp]
+        return front_idx, front_dis
+
+    def get_pair_dists(self, node_vp_ids=None, ghost_vp_ids=None):
+        """
+        Shortest distances / MAX_DIST between all pairs of [None] + nodes + ghosts,
+        a ghost being reached through its nearest front. Cached until the map changes.
+        """
+        if node_vp_ids is None:
+            node_vp_ids = list(self.node_pos.keys())
+        if ghost_vp_ids is None:
+            ghost_vp_ids = list(self.ghost_pos.keys())
+        key = (self.version, tuple(node_vp_ids), tuple(ghost_vp_ids))
+        if self.pair_dists_cache is not None and self.pair_dists_cache[0] == key:
+            return self.pair_dists_cache[1]
+
+        num_nodes = len(node_vp_ids)
+        # fronts left out of node_vp_ids still route their ghosts
+        node_set = set(node_vp_ids)
+        dist_vp_ids = list(node_vp_ids)
+        for vp in ghost_vp_ids:
+            front_vp = self.front_to_ghost_dist(vp)[1]
+            if front_vp not in node_set:
+                node_set.add(front_vp)
+                dist_vp_ids.append(front_vp)
+        node_dist = self.get_node_dist_array(dist_vp_ids)
+        front_idx, front_dis = self.get_ghost_fronts(ghost_vp_ids, dist_vp_ids)
+
+        pair_dists = np.zeros((1 + num_nodes + len(ghost_vp_ids),) * 2, dtype=np.float64)
+        nodes, ghosts = slice(1, 1 + num_nodes), slice(1 + num_nodes, None)
+        # node to node stays in the dtype of shortest_dist, like the scalar version
+        pair_dists[nodes, nodes] = node_dist[:num_nodes, :num_nodes].astype(self.dist_dtype or np.float64) / MAX_DIST
+        pair_dists[nodes, ghosts] = (node_dist[:num_nodes, front_idx] + front_dis[None, :]) / MAX_DIST
+        pair_dists[ghosts, ghosts] = (
+            front_dis[:, None] + node_dist[np.ix_(front_idx, front_idx)] + front_dis[None, :]
+        ) / MAX_DIST
+        # distances are taken from the first to the second vp, then mirrored
+        pair_dists = np.triu(pair_dists, 1)
+        pair_dists = (pair_dists + pair_dists.T).astype(np.float32)
+
+        self.pair_dists_cache = (key, pair_dists)
+        return pair_dists
+
+    def get_shortest_from(self, source, targets):
+        """ shortest distances (float64) and path lengths from source to each of targets """
+        if self.sp_engine is not None:
+            row = self.sp_engine.index[source]
+            cols = [self.sp_engine.index[vp] for vp in targets]
+            return self.sp_engine.dist_array[row, cols], self.sp_engine.hops_array[row, cols]
+        sp_dist = np.array([self.shortest_dist[source][vp] for vp in targets], dtype=np.float64)
+        sp_step = np.array([len(self.shortest_path[source][vp]) for vp in targets], dtype=np.int64)
+        return sp_dist, sp_step
+
     def get_node_embeds(self, vp):
         # if not vp.startswith('g'):
         if vp in list(self.node_pos.keys()):
@@ -355,14 +896,515 @@ class GraphMap(object):
         rel_ang_fts = get_angle_fts(rel_angles[:, 0], rel_angles[:, 1], angle_feat_size=4)
         return np.concatenate([rel_ang_fts, rel_dists], 1)
 
+    def get_pos_fts_batch(self, cur_vp, cur_pos, cur_ori, gmap_vp_ids):
+        """ get_pos_fts for all of gmap_vp_ids in one pass, with the same outputs """
+        base_heading = heading_from_quaternion(cur_ori)
+        rel_angles = np.zeros((len(gmap_vp_ids), 2), dtype=np.float64)
+        rel_dists = np.zeros((len(gmap_vp_ids), 3), dtype=np.float64)
+
+        ghost_idx, node_idx = [], []
+        for i, vp in enumerate(gmap_vp_ids):
+            if vp is None:
+                continue
+            elif vp in self.ghost_pos:
+                ghost_idx.append(i)
+            else:
+                node_idx.append(i)
+        ghost_vps = [gmap_vp_ids[i] for i in ghost_idx]
+        node_vps = [gmap_vp_ids[i] for i in node_idx]
+        fronts = [self.front_to_ghost_dist(vp) for vp in ghost_vps]
+        front_dis = np.array([dis for dis, _ in fronts], dtype=np.float64)
+
+        # shortest distances / steps from cur_vp to the nodes and to the fronts of the ghosts
+        sp_dist, sp_step = self.get_shortest_from(cur_vp, node_vps + [vp for _, vp in fronts])
+        num_nodes = len(node_vps)
+        # node distances stay in the dtype of shortest_dist, like the scalar version
+        node_dist = sp_dist[:num_nodes].astype(self.dist_dtype or np.float64)
+        rel_dists[node_idx, 1] = node_dist / MAX_DIST
+        rel_dists[node_idx, 2] = sp_step[:num_nodes] / MAX_STEP
+        rel_dists[ghost_idx, 1] = (sp_dist[num_nodes:] + front_dis) / MAX_DIST
+        rel_dists[ghost_idx, 2] = (sp_step[num_nodes:] + 1) / MAX_STEP
+
+        vp_idx = node_idx + ghost_idx
+        vp_pos = [self.node_pos[vp] for vp in node_vps] + [self.ghost_aug_pos[vp] for vp in ghost_vps]
+        # positions of different dtypes are computed apart, as their numerics differ
+        for dtype in set(np.asarray(pos).dtype for pos in vp_pos):
+            sel = [k for k, pos in enumerate(vp_pos) if np.asarray(pos).dtype == dtype]
+            rel_heading, rel_elevation, rel_dist = calculate_vp_rel_pos_fts_batch(
+                cur_pos, np.array([vp_pos[k] for k in sel], dtype=dtype),
+                base_heading, 0, to_clock=True,
+            )
+            rows = [vp_idx[k] for k in sel]
+            rel_angles[rows, 0] = rel_heading
+            rel_angles[rows, 1] = rel_elevation
+            rel_dists[rows, 0] = rel_dist / MAX_DIST
+
+        rel_angles = rel_angles.astype(np.float32)
+        rel_dists = rel_dists.astype(np.float32)
+        rel_ang_fts = get_angle_fts(rel_angles[:, 0], rel_angles[:, 1], angle_feat_size=4)
+        return np.concatenate([rel_ang_fts, rel_dists], 1)
+
+    def get_ghost_dists(self, cur_pos):
+        """ ghost ids and the line distance from cur_pos to their mean positions """
+        if isinstance(self.ghost_mean_pos, PositionTable):
+            return self.ghost_mean_pos.distances(cur_pos)
+        ghost_vp_ids = list(self.ghost_mean_pos.keys())
+        dis = [calc_position_distance(cur_pos, self.ghost_mean_pos[vp]) for vp in ghost_vp_ids]
+        return ghost_vp_ids, np.array(dis)
+
     def search_distant_ghost(self, cur_pos, thresho1d = 3.0):
-        distant_ghost = []
+        ghost_vp_ids, dis = self.get_ghost_dists(cur_pos)
+        return [ghost_vp_ids[k] for k in np.flatnonzero(dis >= thresho1d)]
+
+    @staticmethod
+    def _check_evict(strategy):
+        if strategy not in EVICT_STRATEGIES:
+            raise ValueError(f'unknown gmap eviction strategy {strategy!r}, expected one of {EVICT_STRATEGIES}')
+        return strategy
+
+    def _keep_order(self, scores, keep_first=()):
+        """ indices by decreasing score, ties in gmap order, keep_first before all """
+        scores = np.array(scores, dtype=np.float64)
+        scores[list(keep_first)] = np.inf
+        return np.argsort(-scores, kind='stable')
+
+    def evict_ghosts(self, cur_pos, max_ghosts, strategy=None, ignore=()):
+        """
+        Ghosts to delete so that at most max_ghosts are left, 0 for no limit.
+        ignore: ghosts that are deleted anyway, they do not count in the budget.
+        strategy (the one of the GraphMap if None):
+            farthest: from cur_pos, the distance of search_distant_ghost
+            oldest: by the step of the front the ghost was first seen from
+            stop_score: by the best stop score of its fronts
+        """
+        strategy = self.evict if strategy is None else self._check_evict(strategy)
+        ghost_vp_ids = [vp for vp in self.ghost_pos.keys() if vp not in ignore]
+        if max_ghosts <= 0 or len(ghost_vp_ids) <= max_ghosts:
+            return []
+        if strategy == 'farthest':
+            ghost_dists = dict(zip(*self.get_ghost_dists(cur_pos)))
+            scores = [-ghost_dists[vp] for vp in ghost_vp_ids]
+        elif strategy == 'oldest':
+            scores = [self.node_stepId[self.ghost_fronts[vp][0]] for vp in ghost_vp_ids]
+        else:
+            scores = [
+                max(self.node_stop_scores.get(front_vp, 0) for front_vp in self.ghost_fronts[vp])
+                for vp in ghost_vp_ids
+            ]
+        evicted = set(self._keep_order(scores)[max_ghosts:])
+        return [vp for i, vp in enumerate(ghost_vp_ids) if i in evicted]
+
+    def select_nodes(self, cur_vp, cur_pos, max_nodes, strategy=None):
+        """
+        Nodes fed to the gmap input, in gmap order: all of them, or max_nodes with cur_vp
+        always kept, 0 for no limit. Dropped nodes stay in the graph and its shortest paths.
+        strategy (the one of the GraphMap if None):
+            farthest: drop the nodes farthest from cur_pos
+            oldest: drop the nodes with the lowest step id
+            stop_score: drop the nodes with the lowest stop score
+        """
+        strategy = self.evict if strategy is None else self._check_evict(strategy)
+        node_vp_ids = list(self.node_pos.keys())
+        if max_nodes <= 0 or len(node_vp_ids) <= max_nodes:
+            return node_vp_ids
+        if strategy == 'farthest':
+            scores = [-calc_position_distance(cur_pos, self.node_pos[vp]) for vp in node_vp_ids]
+        elif strategy == 'oldest':
+            scores = [self.node_stepId[vp] for vp in node_vp_ids]
+        else:
+            scores = [self.node_stop_scores.get(vp, 0) for vp in node_vp_ids]
+        kept = set(self._keep_order(scores, keep_first=[node_vp_ids.index(cur_vp)])[:max_nodes])
+        return [vp for i, vp in enumerate(node_vp_ids) if i in kept]
+
+
+class BatchGraphMap(object):
+    """
+    The GraphMaps of all envs in a rollout, usable as a list of GraphMap.
+
+    Given a device, the nodes and ghosts of every env are also mirrored in
+    padded tensors, one slot per viewpoint in GraphMap order (ghost slots
+    are compacted after deletions). Candidate localization, distant-ghost
+    search and the navigation inputs of the whole batch are then a few
+    array ops. Topology (ids, ghost merging, shortest paths) stays in the
+    per-env GraphMaps, whose shortest path arrays (incremental_sp) are
+    stacked as they are.
+    """
+    def __init__(self, gmaps, device=None, capacity=32):
+        self.gmaps = list(gmaps)
+        if device is not None and any(gmap.sp_engine is None for gmap in self.gmaps):
+            raise ValueError('BatchGraphMap on a device needs GraphMaps with incremental_sp')
+        self.device = device
+        self.capacity = capacity
+        self.node_slots = [{} for _ in self.gmaps]     # viewpoint to slot, in node_pos order
+        self.ghost_slots = [{} for _ in self.gmaps]    # viewpoint to slot, in ghost_pos order
+        self.num_ghost_slots = [0 for _ in self.gmaps]  # slots used, deleted ghosts included
+        self.nodes = None       # name to (num_envs, slots, ...) tensor, created on the first update
+        self.node_pos_dtype = np.dtype(np.float64)  # dtype agents' positions come in
+        self.ghosts = None
+
+    def __len__(self):
+        return len(self.gmaps)
+
+    def __getitem__(self, i):
+        return self.gmaps[i]
+
+    def __iter__(self):
+        return iter(self.gmaps)
+
+    def pop(self, i):
+        if self.nodes is not None:
+            keep = torch.tensor([j for j in range(len(self.gmaps)) if j != i], device=self.device)
+            for bufs in (self.nodes, self.ghosts):
+                for name, buf in bufs.items():
+                    bufs[name] = buf[keep]
+        self.node_slots.pop(i)
+        self.ghost_slots.pop(i)
+        self.num_ghost_slots.pop(i)
+        return self.gmaps.pop(i)
+
+    def _init_buffers(self, embeds):
+        num_envs, dim = len(self.gmaps), embeds.shape[-1]
+        self.nodes = {
+            'pos': torch.zeros(num_envs, self.capacity, 3, dtype=torch.float64, device=self.device),
+            'embeds': embeds.new_zeros(num_envs, self.capacity, dim),
+            'step_ids': torch.zeros(num_envs, self.capacity, dtype=torch.long, device=self.device),
+        }
+        self.ghosts = {
+            'mean_pos': torch.zeros(num_envs, self.capacity, 3, dtype=torch.float64, device=self.device),
+            'aug_pos': torch.zeros(num_envs, self.capacity, 3, dtype=torch.float64, device=self.device),
+            'embeds': embeds.new_zeros(num_envs, self.capacity, dim),
+            'valid': torch.zeros(num_envs, self.capacity, dtype=torch.bool, device=self.device),
+            # ghost slot x node slot, the fronts of each ghost
+            'fronts': torch.zeros(num_envs, self.capacity, self.capacity, dtype=torch.bool, device=self.device),
+        }
+
+    @staticmethod
+    def _reserve(bufs, num_slots):
+        cur_slots = next(iter(bufs.values())).shape[1]
+        if num_slots <= cur_slots:
+            return
+        num_slots = max(num_slots, 2 * cur_slots)
+        for name, buf in bufs.items():
+            pad = buf.new_zeros((buf.shape[0], num_slots - cur_slots) + buf.shape[2:])
+            bufs[name] = torch.cat([buf, pad], 1)
+
+    def _write(self, bufs, name, env_idx, slot_idx, values):
+        if len(env_idx) == 0:
+            return
+        buf = bufs[name]
+        index = (torch.tensor(env_idx, device=self.device), torch.tensor(slot_idx, device=self.device))
+        values = torch.as_tensor(values, device=self.device).to(buf.dtype)
+        # out of place, the embeds may carry autograd history
+        bufs[name] = buf.index_put(index, values)
+
+    def identify_node(self, cur_pos, cur_ori, cand_angles, cand_distances):
+        outs = [
+            gmap.identify_node(cur_pos[i], cur_ori[i], cand_angles[i], cand_distances[i])
+            for i, gmap in enumerate(self.gmaps)
+        ]
+        cur_vp, cand_vp, cand_pos = [list(x) for x in zip(*outs)]
+        return cur_vp, cand_vp, cand_pos
+
+    def update_graph(self, prev_vp, step_id,
+                           cur_vp, cur_pos, cur_embeds,
+                           cand_vp, cand_pos, cand_embeds,
+                           cand_real_pos, imgs):
+        if self.device is not None:
+            if self.nodes is None:
+                self._init_buffers(cur_embeds)
+            # cur_vp is in node_pos before its candidates are localized
+            slots = [self.node_slots[i].setdefault(vp, len(self.node_slots[i])) for i, vp in enumerate(cur_vp)]
+            self._reserve(self.nodes, max(slots) + 1)
+            fronts = self.ghosts['fronts']
+            num_node_slots = self.nodes['pos'].shape[1]
+            if fronts.shape[2] < num_node_slots:
+                pad = fronts.new_zeros(fronts.shape[:2] + (num_node_slots - fronts.shape[2],))
+                self.ghosts['fronts'] = torch.cat([fronts, pad], 2)
+            env_idx = list(range(len(self.gmaps)))
+            self._write(self.nodes, 'pos', env_idx, slots, np.array(cur_pos, dtype=np.float64))
+            self.node_pos_dtype = np.array(cur_pos).dtype
+            self._write(self.nodes, 'embeds', env_idx, slots, cur_embeds)
+            self._write(self.nodes, 'step_ids', env_idx, slots, step_id)
+            cand_nvp = self.localize(cand_pos)
+        else:
+            cand_nvp = [None] * len(self.gmaps)
+
+        nearby_cand_wp, cand_imgs, new_ghost_node = [], [], []
+        for i, gmap in enumerate(self.gmaps):
+            nearby_wp, imgs_i, ghost_node = gmap.update_graph(prev_vp[i], step_id,
+                                       cur_vp[i], cur_pos[i], cur_embeds[i],
+                                       cand_vp[i], cand_pos[i], cand_embeds[i],
+                                       cand_real_pos[i], imgs[i], cand_nvp[i])
+            nearby_cand_wp.append(nearby_wp)
+            cand_imgs.append(imgs_i)
+            new_ghost_node.append(ghost_node)
+
+        if self.device is not None:
+            self._update_ghosts(cur_vp, nearby_cand_wp, new_ghost_node)
+        return nearby_cand_wp, cand_imgs, new_ghost_node
+
+    def _update_ghosts(self, cur_vp, nearby_cand_wp, new_ghost_node):
+        updated, moved = [], []     # (env, viewpoint) of new / merged ghosts, of ghosts with a new aug_pos
+        for i, gmap in enumerate(self.gmaps):
+            for vp in new_ghost_node[i]:
+                self.ghost_slots[i][vp] = self.num_ghost_slots[i]
+                self.num_ghost_slots[i] += 1
+            updated.extend((i, vp) for vp in nearby_cand_wp[i])
+            # augmentation resamples every ghost
+            moved.extend((i, vp) for vp in (gmap.ghost_pos if gmap.ghost_aug != 0 else nearby_cand_wp[i]))
+        self._reserve(self.ghosts, max(self.num_ghost_slots) + 1)
+        created = [(i, self.ghost_slots[i][vp]) for i in range(len(self.gmaps)) for vp in new_ghost_node[i]]
+        if len(created) > 0:
+            # slots left over by _compact_ghosts hold stale fronts
+            self._write(self.ghosts, 'fronts', [i for i, _ in created], [k for _, k in created], False)
+        if len(updated) > 0:
+            env_idx = [i for i, _ in updated]
+            slot_idx = [self.ghost_slots[i][vp] for i, vp in updated]
+            mean_pos = np.array([self.gmaps[i].ghost_mean_pos[vp] for i, vp in updated], dtype=np.float64)
+            embeds = torch.stack([
+                self.gmaps[i].ghost_embeds[vp][0] / self.gmaps[i].ghost_embeds[vp][1] for i, vp in updated
+            ])
+            self._write(self.ghosts, 'mean_pos', env_idx, slot_idx, mean_pos)
+            self._write(self.ghosts, 'embeds', env_idx, slot_idx, embeds)
+            self._write(self.ghosts, 'valid', env_idx, slot_idx, True)
+            # cur_vp is now a front of every ghost its candidates created or merged into
+            index = (torch.tensor(env_idx, device=self.device), torch.tensor(slot_idx, device=self.device),
+                     torch.tensor([self.node_slots[i][cur_vp[i]] for i in env_idx], device=self.device))
+            self.ghosts['fronts'] = self.ghosts['fronts'].index_put(index, torch.tensor(True, device=self.device))
+        if len(moved) > 0:
+            aug_pos = np.array([self.gmaps[i].ghost_aug_pos[vp] for i, vp in moved], dtype=np.float64)
+            self._write(self.ghosts, 'aug_pos',
+                        [i for i, _ in moved], [self.ghost_slots[i][vp] for i, vp in moved], aug_pos)
+
+    def delete_ghosts(self, ghost_vps):
+        """ ghost_vps: per env, the ghosts to delete in order """
+        env_idx, slot_idx = [], []
+        for i, vps in enumerate(ghost_vps):
+            for vp in vps:
+                self.gmaps[i].delete_ghost(vp)
+                if self.device is not None:
+                    env_idx.append(i)
+                    slot_idx.append(self.ghost_slots[i].pop(vp))
+        if len(env_idx) > 0:
+            self._compact_ghosts()
+
+    def _compact_ghosts(self):
+        num_envs = len(self.gmaps)
+        width = max([len(slots) for slots in self.ghost_slots] + [1])
+        index = np.zeros((num_envs, width), dtype=np.int64)
+        for i, slots in enumerate(self.ghost_slots):
+            index[i, :len(slots)] = list(slots.values())
+            self.ghost_slots[i] = {vp: k for k, vp in enumerate(slots.keys())}
+            self.num_ghost_slots[i] = len(slots)
+        index = torch.from_numpy(index).to(self.device)
+        for name, buf in self.ghosts.items():
+            shape = (num_envs, width) + buf.shape[2:]
+            self.ghosts[name] = buf.gather(1, index.view(num_envs, width, *([1] * (buf.dim() - 2))).expand(shape))
+        num_ghosts = torch.tensor(self.num_ghost_slots, device=self.device)
+        self.ghosts['valid'] = torch.arange(width, device=self.device)[None, :] < num_ghosts[:, None]
+
+    @staticmethod
+    def _dist(a, b):
+        # same float ops as calc_position_distance
+        d = b - a
+        return (d[..., 0] * d[..., 0] + d[..., 1] * d[..., 1] + d[..., 2] * d[..., 2]).sqrt()
+
+    def localize(self, qpos):
+        """ for each env's queries (Q, 3), the nearest node within loc_noise, as GraphMap._localize """
+        num_envs = len(self.gmaps)
+        max_q = max([len(q) for q in qpos] + [1])
+        pad_q = np.zeros((num_envs, max_q, 3), dtype=np.float64)
+        for i, q in enumerate(qpos):
+            pad_q[i, :len(q)] = q
+        pad_q = torch.from_numpy(pad_q).to(self.device)
+
+        num_node_slots = max(len(slots) for slots in self.node_slots)
+        dis = self._dist(self.nodes['pos'][:, None, :num_node_slots, :], pad_q[:, :, None, :])
+        num_nodes = torch.tensor([len(slots) for slots in self.node_slots], device=self.device)
+        node_valid = torch.arange(dis.shape[2], device=self.device)[None, :] < num_nodes[:, None]
+        dis = dis.masked_fill(~node_valid[:, None, :], np.inf)
+        min_slot = dis.argmin(2)    # first of the nearest, like the scalar loop
+        min_dis = dis.gather(2, min_slot[:, :, None])[:, :, 0]
+        loc_noise = torch.tensor([gmap.loc_noise for gmap in self.gmaps], device=self.device)
+        hit = ((min_dis <= loc_noise[:, None]) & (min_dis < 10000)).cpu().numpy()
+        min_slot = min_slot.cpu().numpy()
+
+        localized = []
+        for i, q in enumerate(qpos):
+            node_vps = list(self.node_slots[i].keys())
+            localized.append([node_vps[min_slot[i, k]] if hit[i, k] else None for k in range(len(q))])
+        return localized
+
+    def search_distant_ghosts(self, cur_pos, thresho1d=3.0):
+        if self.device is None:
+            return [gmap.search_distant_ghost(cur_pos[i], thresho1d) for i, gmap in enumerate(self.gmaps)]
+        cur_pos = torch.from_numpy(np.array(cur_pos, dtype=np.float64)).to(self.device)
+        num_ghost_slots = max(self.num_ghost_slots)
+        dis = self._dist(cur_pos[:, None, :], self.ghosts['mean_pos'][:, :num_ghost_slots])
+        distant = ((dis >= thresho1d) & self.ghosts['valid'][:, :num_ghost_slots]).cpu().numpy()
+        return [
+            [vp for vp, slot in self.ghost_slots[i].items() if distant[i, slot]]
+            for i in range(len(self.gmaps))
+        ]
+
+    def _stack_shortest_paths(self, cur_vp):
+        """ node x node distances and the path lengths from cur_vp, stacked over envs in slot order """
+        num_node_slots = max(len(slots) for slots in self.node_slots)
+        node_dist = np.zeros((len(self.gmaps), num_node_slots, num_node_slots), dtype=np.float64)
+        cur_hops = np.zeros((len(self.gmaps), num_node_slots), dtype=np.int64)
+        for i, gmap in enumerate(self.gmaps):
+            # rows of the shortest path arrays are added with the nodes, so they are in slot order
+            sp, num_nodes = gmap.sp_engine, len(self.node_slots[i])
+            node_dist[i, :num_nodes, :num_nodes] = sp.dist_array[:num_nodes, :num_nodes]
+            cur_hops[i, :num_nodes] = sp.hops_array[sp.index[cur_vp[i]], :num_nodes]
+        return node_dist, cur_hops
+
+    @staticmethod
+    def _rel_pos_fts(cur_pos, vp_pos, base_heading):
+        """ calculate_vp_rel_pos_fts_batch(cur_pos[i], vp_pos[i], base_heading[i], to_clock=True) for each env """
+        diff = vp_pos - cur_pos[:, None, :]
+        work_dtype = np.asarray(diff.dtype.type(0) * 2).dtype
+        dx, dy, dz = np.moveaxis(diff.astype(work_dtype), -1, 0)
+        xz_dist = np.maximum(np.sqrt(dx**2 + dz**2), 1e-8)
+        xyz_dist = np.maximum(np.sqrt(dx**2 + dy**2 + dz**2), 1e-8)
+        heading = np.arcsin(-dx / xz_dist)
+        heading = np.where(vp_pos[:, :, 2] > cur_pos[:, None, 2], np.pi - heading, heading)
+        # base_heading is a scalar there, which may not promote the headings
+        heading_dtype = (heading[:0] - np.float64(0)).dtype
+        heading = heading.astype(heading_dtype) - base_heading[:, None].astype(heading_dtype)
+        heading = 2 * np.pi - heading
+        elevation = np.arcsin(dz / xyz_dist)
+        return heading, elevation, xyz_dist
+
+    def get_nav_inputs(self, cur_vp, cur_pos, cur_ori, batch_node_vp_ids=None):
+        """
+        inputs of the navigation mode, padded over envs, as built from get_pos_fts & get_pair_dists
+        batch_node_vp_ids: per env, the nodes in the gmap input in gmap order, all of them if None
+
+        Distances and pos fts are computed on the host in numpy, over all envs at once, with
+        the same float ops as the per-env path so that they are equal; the device tensors
+        are then reordered into gmap order.
+        """
+        num_envs = len(self.gmaps)
+        num_node_slots = max(len(slots) for slots in self.node_slots)
+        num_ghost_slots = max(self.num_ghost_slots)
+
+        batch_gmap_vp_ids, batch_no_vp_left = [], []
+        node_kept = np.zeros((num_envs, num_node_slots), dtype=bool)
+        for i, gmap in enumerate(self.gmaps):
+            ghost_vp_ids = list(gmap.ghost_pos.keys())
+            kept_vp_ids = list(gmap.node_pos.keys()) if batch_node_vp_ids is None else batch_node_vp_ids[i]
+            node_kept[i, [self.node_slots[i][vp] for vp in kept_vp_ids]] = True
+            batch_gmap_vp_ids.append([None] + kept_vp_ids + ghost_vp_ids)
+            batch_no_vp_left.append(len(ghost_vp_ids) == 0)
+        node_dist, cur_hops = self._stack_shortest_paths(cur_vp)
+        cur_slot = np.array([self.node_slots[i][vp] for i, vp in enumerate(cur_vp)])
+        base_heading = np.array([heading_from_quaternion(ori) for ori in cur_ori], dtype=np.float64)
+        # node distances stay in the dtype of the edge weights, like the per-env path
+        dist_dtypes = np.array([np.dtype(gmap.dist_dtype or np.float64) for gmap in self.gmaps])
+
+        node_pos = self.nodes['pos'][:, :num_node_slots].cpu().numpy().astype(self.node_pos_dtype)
+        ghost_pos = self.ghosts['aug_pos'][:, :num_ghost_slots].cpu().numpy()
+        ghost_valid = self.ghosts['valid'][:, :num_ghost_slots].cpu().numpy()
+        fronts = self.ghosts['fronts'][:, :num_ghost_slots, :num_node_slots].cpu().numpy()
+        cur_pos = np.array(cur_pos)
+
+        # nearest front of each ghost, as front_to_ghost_dist
+        diff = ghost_pos[:, :, None, :] - node_pos[:, None, :, :]
+        front_dis = np.sqrt(diff[..., 0]**2 + diff[..., 1]**2 + diff[..., 2]**2)
+        front_dis[~fronts] = np.inf
+        front_idx = front_dis.argmin(2)
+        front_dis = np.take_along_axis(front_dis, front_idx[:, :, None], 2)[:, :, 0]
+        front_idx[~ghost_valid] = 0
+        front_dis[~ghost_valid] = 0
+
+        # everything below is in slot space: [None] + node slots + ghost slots
+        nodes = slice(1, 1 + num_node_slots)
+        ghosts = slice(1 + num_node_slots, None)
+        num_slots = 1 + num_node_slots + num_ghost_slots
+
+        # pair distances, a ghost being reached through its nearest front
+        node_front = np.take_along_axis(node_dist, front_idx[:, None, :].repeat(num_node_slots, 1), 2)
+        front_front = np.take_along_axis(node_front, front_idx[:, :, None].repeat(num_ghost_slots, 2), 1)
+        pair_dists = np.zeros((num_envs, num_slots, num_slots), dtype=np.float64)
+        for dtype in set(dist_dtypes):
+            sel = dist_dtypes == dtype
+            pair_dists[sel, nodes, nodes] = node_dist[sel].astype(dtype) / MAX_DIST
+        pair_dists[:, nodes, ghosts] = (node_front + front_dis[:, None, :]) / MAX_DIST
+        pair_dists[:, ghosts, ghosts] = (
+            front_dis[:, :, None] + front_front + front_dis[:, None, :]
+        ) / MAX_DIST
+        # slot order agrees with gmap order, so this takes distances from the first vp like get_pair_dists
+        pair_dists = np.triu(pair_dists, 1)
+        pair_dists = (pair_dists + pair_dists.transpose(0, 2, 1)).astype(np.float32)
+
+        # pos fts: (sin(heading), cos(heading), sin(elevation), cos(elevation),
+        #  line_dist, shortest_dist, shortest_step)
+        rel_angles = np.zeros((num_envs, num_slots, 2), dtype=np.float64)
+        rel_dists = np.zeros((num_envs, num_slots, 3), dtype=np.float64)
+        for slots, vp_pos in ((nodes, node_pos), (ghosts, ghost_pos)):
+            rel_heading, rel_elevation, rel_dist = self._rel_pos_fts(cur_pos, vp_pos, base_heading)
+            rel_angles[:, slots, 0] = rel_heading
+            rel_angles[:, slots, 1] = rel_elevation
+            rel_dists[:, slots, 0] = rel_dist / MAX_DIST
+        cur_dist = node_dist[np.arange(num_envs), cur_slot]
+        for dtype in set(dist_dtypes):
+            sel = dist_dtypes == dtype
+            rel_dists[sel, nodes, 1] = cur_dist[sel].astype(dtype) / MAX_DIST
+        rel_dists[:, nodes, 2] = cur_hops / MAX_STEP
+        rel_dists[:, ghosts, 1] = (np.take_along_axis(cur_dist, front_idx, 1) + front_dis) / MAX_DIST
+        rel_dists[:, ghosts, 2] = (np.take_along_axis(cur_hops, front_idx, 1) + 1) / MAX_STEP
+        # the None slot
+        rel_angles[:, 0] = 0
+        rel_dists[:, 0] = 0
+        rel_angles = rel_angles.astype(np.float32).reshape(-1, 2)
+        rel_ang_fts = get_angle_fts(rel_angles[:, 0], rel_angles[:, 1], angle_feat_size=4)
+        pos_fts = np.concatenate([rel_ang_fts.reshape(num_envs, num_slots, 4), rel_dists.astype(np.float32)], 2)
+
+        device = self.device
+        pair_dists = torch.from_numpy(pair_dists).to(device)
+        pos_fts = torch.from_numpy(pos_fts).to(device)
+        # dropped nodes still take part in the shortest paths, they only leave the gmap input
+        node_valid = torch.from_numpy(node_kept).to(device)
+        num_nodes = node_valid.long().sum(1)
+        ghost_valid = self.ghosts['valid'][:, :num_ghost_slots]
+        zeros = lambda *shape, dtype: torch.zeros(num_envs, *shape, dtype=dtype, device=device)
+
+        step_ids = torch.cat([
+            zeros(1, dtype=torch.long), self.nodes['step_ids'][:, :num_node_slots], zeros(num_ghost_slots, dtype=torch.long)
+        ], 1)
+        visited_masks = torch.cat([zeros(1, dtype=torch.bool), node_valid, zeros(num_ghost_slots, dtype=torch.bool)], 1)
+        img_fts = self.nodes['embeds'][:, :num_node_slots]
+        img_fts = torch.cat([
+            img_fts.new_zeros(num_envs, 1, img_fts.shape[2]), img_fts, self.ghosts['embeds'][:, :num_ghost_slots]
+        ], 1)
 
-        for kvp, kpos in self.ghost_mean_pos.items():
-            dis = calc_position_distance(cur_pos, kpos)
-            if dis >= thresho1d:
-                distant_ghost.append(kvp)
+        # slot to gmap position: None, the kept nodes, then the alive ghosts in order
+        gmap_lens = [len(vp_ids) for vp_ids in batch_gmap_vp_ids]
+        max_gmap_len = max(gmap_lens)
+        ghost_col = 1 + num_nodes[:, None] + ghost_valid.long().cumsum(1) - 1
+        node_col = 1 + node_valid.long().cumsum(1) - 1
+        slot_col = torch.cat([zeros(1, dtype=torch.long), node_col, ghost_col], 1)
+        slot_valid = torch.cat([torch.ones(num_envs, 1, dtype=torch.bool, device=device), node_valid, ghost_valid], 1)
+        slot_col = slot_col.masked_fill(~slot_valid, max_gmap_len)
+        src_slot = zeros(max_gmap_len + 1, dtype=torch.long).scatter_(
+            1, slot_col, torch.arange(num_slots, device=device).expand(num_envs, -1)
+        )[:, :max_gmap_len]
+        batch_gmap_lens = torch.tensor(gmap_lens, device=device)
+        batch_gmap_masks = torch.arange(max_gmap_len, device=device)[None, :] < batch_gmap_lens[:, None]
 
-        return distant_ghost
+        def take(x):
+            shape = (num_envs, max_gmap_len) + x.shape[2:]
+            index = src_slot.view(num_envs, max_gmap_len, *([1] * (x.dim() - 2))).expand(shape)
+            masks = batch_gmap_masks.view(num_envs, max_gmap_len, *([1] * (x.dim() - 2)))
+            return x.gather(1, index).masked_fill(~masks, 0)
 
+        gmap_pair_dists = take(pair_dists)
+        gmap_pair_dists = take(gmap_pair_dists.transpose(1, 2)).transpose(1, 2)
 
+        return {
+            'gmap_vp_ids': batch_gmap_vp_ids, 'gmap_step_ids': take(step_ids),
+            'gmap_img_fts': take(img_fts), 'gmap_pos_fts': take(pos_fts),
+            'gmap_masks': batch_gmap_masks, 'gmap_visited_masks': take(visited_masks), 'gmap_pair_dists': gmap_pair_dists,
+            'no_vp_left': batch_no_vp_left,
+        }
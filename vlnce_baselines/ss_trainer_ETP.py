@@ -1,11 +1,11 @@
 import gc
+import glob
 import os
 import sys
 import random
 import warnings
 from collections import defaultdict
 from typing import Dict, List
-import jsonlines
 
 import lmdb
 import msgpack_numpy
@@ -32,9 +32,16 @@ from habitat_baselines.utils.common import batch_obs
 
 from vlnce_baselines.common.aux_losses import AuxLosses
 from vlnce_baselines.common.base_il_trainer import BaseVLNCETrainer
-from vlnce_baselines.common.env_utils import construct_envs, construct_envs_for_rl, is_slurm_batch_job
+from vlnce_baselines.common.env_utils import construct_envs, construct_envs_for_rl, is_slurm_batch_job, VectorEnvGroup
+from vlnce_baselines.common.profiler import RolloutProfiler
+from vlnce_baselines.common.metrics import MetricWorkerPool, episode_metrics, dtw_distance
+from vlnce_baselines.common.result_store import EpisodeResultStore, read_results, aggregate_results, file_hash
+from vlnce_baselines.common.dispatcher import EpisodeDispatcher, scene_batches
+from vlnce_baselines.common.predictions import PredictionShardWriter, compact_path, merge_predictions
+from vlnce_baselines.common.feature_cache import PanoFeatureCache
+from vlnce_baselines.common.feature_store import PanoFeatureStore
 from vlnce_baselines.common.utils import extract_instruction_tokens
-from vlnce_baselines.models.graph_utils import GraphMap, MAX_DIST
+from vlnce_baselines.models.graph_utils import GraphMap, BatchGraphMap, MAX_DIST
 from vlnce_baselines.utils import reduce_loss
 
 from .utils import get_camera_orientations12
@@ -54,7 +61,7 @@ import gzip
 import json
 from copy import deepcopy
 from torch.cuda.amp import autocast, GradScaler
-from vlnce_baselines.common.ops import pad_tensors_wgrad, gen_seq_masks
+from vlnce_baselines.common.ops import pad_tensors_wgrad, gen_seq_masks, PinnedBatchBuffer
 from torch.nn.utils.rnn import pad_sequence
 
 # from vlnce_baselines.models.r2rce_prompt import make_r2rce_json_prompts
@@ -69,6 +76,11 @@ class RLTrainer(BaseVLNCETrainer):
         super().__init__(config)
         # self.max_len = int(config.IL.max_traj_len) #  * 0.97 transfered gt path got 0.96 spl
         self.max_len = 20
+        self.rollout_stats = defaultdict(float)   # env steps & seconds spent in rollout
+        self.profiler = RolloutProfiler(enabled=config.IL.profile_rollout)
+        self.dispatcher = None      # queue of the eval / inference episodes shared by the ranks
+        self.pano_cache = None      # embeddings of the panoramas seen, kept across checkpoints
+        self.pano_store = None      # precomputed embeddings, IL.pano_feature_store
 
     def _make_dirs(self):
         if self.config.local_rank == 0:
@@ -101,7 +113,8 @@ class RLTrainer(BaseVLNCETrainer):
         crop_config = self.config.RL.POLICY.OBS_TRANSFORMS.CENTER_CROPPER_PER_SENSOR.SENSOR_CROPS
         task_config = self.config.TASK_CONFIG
         camera_orientations = get_camera_orientations12()
-        for sensor_type in ["RGB", "DEPTH"]:
+        # the depth views are only encoded, which the pano feature store stands in for
+        for sensor_type in (["RGB"] if self.config.IL.pano_feature_store else ["RGB", "DEPTH"]):
             resizer_size = dict(resize_config)[sensor_type.lower()]
             cropper_size = dict(crop_config)[sensor_type.lower()]
             sensor = getattr(task_config.SIMULATOR, f"{sensor_type}_SENSOR")
@@ -249,21 +262,38 @@ class RLTrainer(BaseVLNCETrainer):
         logger.info(f"Agent parameters: {params/1e6:.2f} MB. Trainable: {params_t/1e6:.2f} MB.")
         logger.info("Finished setting up policy.")
 
+        net = self.policy.net.module if hasattr(self.policy.net, 'module') else self.policy.net
+        net.profiler = self.profiler
+        if self.pano_cache is None and self.config.IL.pano_cache_size > 0:
+            self.pano_cache = PanoFeatureCache(
+                self.config.IL.pano_cache_size, self.config.IL.pano_cache_pos_res, self.config.IL.pano_cache_heading_res,
+                device=self.device,
+            )
+            for fname in self._pano_cache_files():
+                logger.info(f"Loaded {self.pano_cache.load(fname)} panoramas of the feature cache {fname}")
+        net.pano_cache = self.pano_cache
+        if self.pano_store is None and self.config.IL.pano_feature_store:
+            self.pano_store = PanoFeatureStore(self.config.IL.pano_feature_store)
+        net.pano_store = self.pano_store
+
+        # reused pinned buffers for the collation of the pano & gmap inputs
+        self.vp_buffer = PinnedBatchBuffer(self.device)
+        self.gmap_buffer = PinnedBatchBuffer(self.device)
+
         return start_iter
 
     def _teacher_action(self, batch_angles, batch_distances, candidate_lengths):
         if self.config.MODEL.task_type == 'r2r':
-            cand_dists_to_goal = [[] for _ in range(len(batch_angles))]
+            # all cands of all envs, the envs being asked at once
+            cand_dists_to_goal = self.envs.call(
+                ["cand_dist_to_goal_batch"] * self.envs.num_envs,
+                [{"angles": angles, "forwards": distances} for angles, distances in zip(batch_angles, batch_distances)]
+            )
+            curr_dists_to_goal = self.envs.call(["current_dist_to_goal"] * self.envs.num_envs)
             oracle_cand_idx = []
             for j in range(len(batch_angles)):
-                for k in range(len(batch_angles[j])):
-                    angle_k = batch_angles[j][k]
-                    forward_k = batch_distances[j][k]
-                    dist_k = self.envs.call_at(j, "cand_dist_to_goal", {"angle": angle_k, "forward": forward_k})
-                    cand_dists_to_goal[j].append(dist_k)
-                curr_dist_to_goal = self.envs.call_at(j, "current_dist_to_goal")
                 # if within target range (which def as 3.0)
-                if curr_dist_to_goal < 1.5:
+                if curr_dists_to_goal[j] < 1.5:
                     oracle_cand_idx.append(candidate_lengths[j] - 1)
                 else:
                     oracle_cand_idx.append(np.argmin(cand_dists_to_goal[j]))
@@ -282,79 +312,110 @@ class RLTrainer(BaseVLNCETrainer):
             return oracle_cand_idx
 
     def _teacher_action_new(self, batch_gmap_vp_ids, batch_no_vp_left):
-        teacher_actions = []
+        teacher_actions = [None] * self.envs.num_envs
         cur_episodes = self.envs.current_episodes()
-        for i, (gmap_vp_ids, gmap, no_vp_left) in enumerate(zip(batch_gmap_vp_ids, self.gmaps, batch_no_vp_left)):
-            curr_dis_to_goal = self.envs.call_at(i, "current_dist_to_goal")
-            if curr_dis_to_goal < 1.5:
-                teacher_actions.append(0)
+        curr_dis_to_goal = self.envs.call(["current_dist_to_goal"] * self.envs.num_envs)
+        # ghosts to pick the expert's from, empty for envs that stop or have none
+        batch_ghost_vp_pos = []
+        for i, (gmap, no_vp_left) in enumerate(zip(self.gmaps, batch_no_vp_left)):
+            ghost_vp_pos = []
+            if curr_dis_to_goal[i] < 1.5:
+                teacher_actions[i] = 0
             else:
                 if no_vp_left:
-                    teacher_actions.append(-100)
-                elif self.config.IL.expert_policy == 'spl':
+                    teacher_actions[i] = -100
+                elif self.config.IL.expert_policy in ['spl', 'ndtw']:
                     ghost_vp_pos = [(vp, random.choice(pos)) for vp, pos in gmap.ghost_real_pos.items()]
-                    ghost_dis_to_goal = [
-                        self.envs.call_at(i, "point_dist_to_goal", {"pos": p[1]})
-                        for p in ghost_vp_pos
-                    ]
-                    target_ghost_vp = ghost_vp_pos[np.argmin(ghost_dis_to_goal)][0]
-                    teacher_actions.append(gmap_vp_ids.index(target_ghost_vp))
-                elif self.config.IL.expert_policy == 'ndtw':
-                    ghost_vp_pos = [(vp, random.choice(pos)) for vp, pos in gmap.ghost_real_pos.items()]
-                    target_ghost_vp = self.envs.call_at(i, "ghost_dist_to_ref", {
-                        "ghost_vp_pos": ghost_vp_pos,
-                        "ref_path": self.gt_data[str(cur_episodes[i].episode_id)]['locations'],
-                    })
-                    teacher_actions.append(gmap_vp_ids.index(target_ghost_vp))
                 else:
                     raise NotImplementedError
+            batch_ghost_vp_pos.append(ghost_vp_pos)
+
+        # the envs are asked at once
+        if self.config.IL.expert_policy == 'spl':
+            batch_ghost_dis_to_goal = self.envs.call(
+                ["point_dist_to_goal_batch"] * self.envs.num_envs,
+                [{"points": [p[1] for p in ghost_vp_pos]} for ghost_vp_pos in batch_ghost_vp_pos]
+            )
+            batch_target_ghost_vp = [
+                ghost_vp_pos[np.argmin(ghost_dis_to_goal)][0] if len(ghost_vp_pos) > 0 else None
+                for ghost_vp_pos, ghost_dis_to_goal in zip(batch_ghost_vp_pos, batch_ghost_dis_to_goal)
+            ]
+        else:
+            batch_target_ghost_vp = self.envs.call(
+                ["ghost_dist_to_ref"] * self.envs.num_envs,
+                [
+                    {
+                        "ghost_vp_pos": ghost_vp_pos,
+                        "ref_path": self.gt_data[str(cur_episodes[i].episode_id)]['locations'],
+                    }
+                    for i, ghost_vp_pos in enumerate(batch_ghost_vp_pos)
+                ]
+            )
+        for i, (gmap_vp_ids, ghost_vp_pos) in enumerate(zip(batch_gmap_vp_ids, batch_ghost_vp_pos)):
+            if len(ghost_vp_pos) > 0:
+                teacher_actions[i] = gmap_vp_ids.index(batch_target_ghost_vp[i])
        
         return torch.tensor(teacher_actions).cuda()
 
     def _vp_feature_variable(self, obs):
-        batch_rgb_fts, batch_dep_fts, batch_loc_fts = [], [], []
-        batch_nav_types, batch_view_lens = [], []
+        bs = self.envs.num_envs
+        pano_angle_fts = obs['pano_angle_fts'].numpy()
 
-        for i in range(self.envs.num_envs):
-            rgb_fts, dep_fts, loc_fts , nav_types = [], [], [], []
+        # views of each env: the cands, then the pano views without cand
+        batch_view_idxes, batch_cand_lens = [], []
+        for i in range(bs):
             cand_idxes = np.zeros(12, dtype=np.bool)
             cand_idxes[obs['cand_img_idxes'][i]] = True
-            # cand
-            rgb_fts.append(obs['cand_rgb'][i])
-            dep_fts.append(obs['cand_depth'][i])
-            loc_fts.append(obs['cand_angle_fts'][i])
-            nav_types += [1] * len(obs['cand_angles'][i])
-            # non-cand
-            rgb_fts.append(obs['pano_rgb'][i][~cand_idxes])
-            dep_fts.append(obs['pano_depth'][i][~cand_idxes])
-            loc_fts.append(obs['pano_angle_fts'][~cand_idxes])
-            nav_types += [0] * (12-np.sum(cand_idxes))
-            
-            batch_rgb_fts.append(torch.cat(rgb_fts, dim=0))
-            batch_dep_fts.append(torch.cat(dep_fts, dim=0))
-            batch_loc_fts.append(torch.cat(loc_fts, dim=0))
-            batch_nav_types.append(torch.LongTensor(nav_types))
-            batch_view_lens.append(len(nav_types))
+            batch_view_idxes.append(np.concatenate([obs['cand_img_idxes'][i], np.flatnonzero(~cand_idxes)]))
+            batch_cand_lens.append(len(obs['cand_angles'][i]))
+        batch_view_lens = [len(view_idxes) for view_idxes in batch_view_idxes]
+        max_view_len = max(batch_view_lens)
+
         # collate
-        batch_rgb_fts = pad_tensors_wgrad(batch_rgb_fts)
-        batch_dep_fts = pad_tensors_wgrad(batch_dep_fts)
-        batch_loc_fts = pad_tensors_wgrad(batch_loc_fts).cuda()
-        batch_nav_types = pad_sequence(batch_nav_types, batch_first=True).cuda()
-        batch_view_lens = torch.LongTensor(batch_view_lens).cuda()
+        host = self.vp_buffer.begin({
+            'view_idxes': (bs, max_view_len),
+            'loc_fts': (bs, max_view_len, pano_angle_fts.shape[1]),
+            'nav_types': (bs, max_view_len),
+            'view_lens': (bs,),
+        })
+        host['view_idxes'][:] = 12      # padding, a zero view
+        for i in range(bs):
+            view_len, cand_len = batch_view_lens[i], batch_cand_lens[i]
+            host['view_idxes'][i, :view_len] = batch_view_idxes[i]
+            host['loc_fts'][i, :cand_len] = obs['cand_angle_fts'][i].numpy()
+            host['loc_fts'][i, cand_len:view_len] = pano_angle_fts[batch_view_idxes[i][cand_len:]]
+            host['nav_types'][i, :cand_len] = 1
+            host['view_lens'][i] = view_len
+        batch = self.vp_buffer.send()
+
+        view_idxes = batch['view_idxes'].long()
+        env_idxes = torch.arange(bs, device=view_idxes.device).unsqueeze(1)
+        batch_rgb_fts = torch.cat([obs['pano_rgb'], obs['pano_rgb'].new_zeros(bs, 1, obs['pano_rgb'].size(2))], 1)
+        batch_dep_fts = torch.cat([obs['pano_depth'], obs['pano_depth'].new_zeros(bs, 1, obs['pano_depth'].size(2))], 1)
+        batch_rgb_fts = batch_rgb_fts[env_idxes, view_idxes]
+        batch_dep_fts = batch_dep_fts[env_idxes, view_idxes]
 
         return {
-            'rgb_fts': batch_rgb_fts, 'dep_fts': batch_dep_fts, 'loc_fts': batch_loc_fts,
-            'nav_types': batch_nav_types, 'view_lens': batch_view_lens,
+            'rgb_fts': batch_rgb_fts, 'dep_fts': batch_dep_fts, 'loc_fts': batch['loc_fts'],
+            'nav_types': batch['nav_types'].long(), 'view_lens': batch['view_lens'].long(),
         }
         
     def _nav_gmap_variable(self, cur_vp, cur_pos, cur_ori):
+        # nodes within the gmap budget, all of them when IL.max_gmap_nodes is 0
+        batch_node_vp_ids = [
+            gmap.select_nodes(cur_vp[i], cur_pos[i], self.config.IL.max_gmap_nodes)
+            for i, gmap in enumerate(self.gmaps)
+        ]
+        if self.gmaps.device is not None:
+            return self.gmaps.get_nav_inputs(cur_vp, cur_pos, cur_ori, batch_node_vp_ids)
+
         batch_gmap_vp_ids, batch_gmap_step_ids, batch_gmap_lens = [], [], []
         batch_gmap_img_fts, batch_gmap_pos_fts = [], []
-        batch_gmap_pair_dists, batch_gmap_visited_masks = [], []
+        batch_gmap_pair_dists = []
         batch_no_vp_left = []
 
         for i, gmap in enumerate(self.gmaps):
-            node_vp_ids = list(gmap.node_pos.keys())
+            node_vp_ids = batch_node_vp_ids[i]
             ghost_vp_ids = list(gmap.ghost_pos.keys())
             if len(ghost_vp_ids) == 0:
                 batch_no_vp_left.append(True)
@@ -362,8 +423,7 @@ class RLTrainer(BaseVLNCETrainer):
                 batch_no_vp_left.append(False)
 
             gmap_vp_ids = [None] + node_vp_ids + ghost_vp_ids
-            gmap_step_ids = [0] + [gmap.node_stepId[vp] for vp in node_vp_ids] + [0]*len(ghost_vp_ids)
-            gmap_visited_masks = [0] + [1] * len(node_vp_ids) + [0] * len(ghost_vp_ids)
+            gmap_step_ids = [gmap.node_stepId[vp] for vp in node_vp_ids]
 
             gmap_img_fts = [gmap.get_node_embeds(vp) for vp in node_vp_ids] + \
                            [gmap.get_node_embeds(vp) for vp in ghost_vp_ids]
@@ -371,54 +431,43 @@ class RLTrainer(BaseVLNCETrainer):
                 [torch.zeros_like(gmap_img_fts[0])] + gmap_img_fts, dim=0
             )
 
-            gmap_pos_fts = gmap.get_pos_fts(
+            gmap_pos_fts = gmap.get_pos_fts_batch(
                 cur_vp[i], cur_pos[i], cur_ori[i], gmap_vp_ids
             )
-            gmap_pair_dists = np.zeros((len(gmap_vp_ids), len(gmap_vp_ids)), dtype=np.float32)
-            for j in range(1, len(gmap_vp_ids)):
-                for k in range(j+1, len(gmap_vp_ids)):
-                    vp1 = gmap_vp_ids[j]
-                    vp2 = gmap_vp_ids[k]
-                    if vp1 in list(gmap.node_pos.keys()) and vp2 in list(gmap.node_pos.keys()):
-                        dist = gmap.shortest_dist[vp1][vp2]
-                    elif vp1 in list(gmap.node_pos.keys()) and not vp2 in list(gmap.node_pos.keys()):
-                        front_dis2, front_vp2 = gmap.front_to_ghost_dist(vp2)
-                        dist = gmap.shortest_dist[vp1][front_vp2] + front_dis2
-                    elif not vp1 in list(gmap.node_pos.keys()) and not vp2 in list(gmap.node_pos.keys()):
-                        front_dis1, front_vp1 = gmap.front_to_ghost_dist(vp1)
-                        front_dis2, front_vp2 = gmap.front_to_ghost_dist(vp2)
-                        dist = front_dis1 + gmap.shortest_dist[front_vp1][front_vp2] + front_dis2
-                    else:
-                        raise NotImplementedError
-                    gmap_pair_dists[j, k] = gmap_pair_dists[k, j] = dist / MAX_DIST
+            gmap_pair_dists = gmap.get_pair_dists(node_vp_ids, ghost_vp_ids)
             
             batch_gmap_vp_ids.append(gmap_vp_ids)
-            batch_gmap_step_ids.append(torch.LongTensor(gmap_step_ids))
+            batch_gmap_step_ids.append(gmap_step_ids)
             batch_gmap_lens.append(len(gmap_vp_ids))
             batch_gmap_img_fts.append(gmap_img_fts)
-            batch_gmap_pos_fts.append(torch.from_numpy(gmap_pos_fts))
-            batch_gmap_pair_dists.append(torch.from_numpy(gmap_pair_dists))
-            batch_gmap_visited_masks.append(torch.BoolTensor(gmap_visited_masks))
+            batch_gmap_pos_fts.append(gmap_pos_fts)
+            batch_gmap_pair_dists.append(gmap_pair_dists)
         
         # collate
-        batch_gmap_step_ids = pad_sequence(batch_gmap_step_ids, batch_first=True).cuda()
-        batch_gmap_img_fts = pad_tensors_wgrad(batch_gmap_img_fts)
-        batch_gmap_pos_fts = pad_tensors_wgrad(batch_gmap_pos_fts).cuda()
-        batch_gmap_lens = torch.LongTensor(batch_gmap_lens)
-        batch_gmap_masks = gen_seq_masks(batch_gmap_lens).cuda()
-        batch_gmap_visited_masks = pad_sequence(batch_gmap_visited_masks, batch_first=True).cuda()
-
         bs = self.envs.num_envs
         max_gmap_len = max(batch_gmap_lens)
-        gmap_pair_dists = torch.zeros(bs, max_gmap_len, max_gmap_len).float()
+        host = self.gmap_buffer.begin({
+            'gmap_step_ids': (bs, max_gmap_len),
+            'gmap_pos_fts': (bs, max_gmap_len, batch_gmap_pos_fts[0].shape[1]),
+            'gmap_masks': (bs, max_gmap_len),
+            'gmap_visited_masks': (bs, max_gmap_len),
+            'gmap_pair_dists': (bs, max_gmap_len, max_gmap_len),
+        })
         for i in range(bs):
-            gmap_pair_dists[i, :batch_gmap_lens[i], :batch_gmap_lens[i]] = batch_gmap_pair_dists[i]
-        gmap_pair_dists = gmap_pair_dists.cuda()
+            gmap_len, num_nodes = batch_gmap_lens[i], len(batch_gmap_step_ids[i])
+            host['gmap_step_ids'][i, 1:num_nodes+1] = batch_gmap_step_ids[i]
+            host['gmap_pos_fts'][i, :gmap_len] = batch_gmap_pos_fts[i]
+            host['gmap_masks'][i, :gmap_len] = 1
+            host['gmap_visited_masks'][i, 1:num_nodes+1] = 1
+            host['gmap_pair_dists'][i, :gmap_len, :gmap_len] = batch_gmap_pair_dists[i]
+        batch = self.gmap_buffer.send()
+        batch_gmap_img_fts = pad_tensors_wgrad(batch_gmap_img_fts)
 
         return {
-            'gmap_vp_ids': batch_gmap_vp_ids, 'gmap_step_ids': batch_gmap_step_ids,
-            'gmap_img_fts': batch_gmap_img_fts, 'gmap_pos_fts': batch_gmap_pos_fts, 
-            'gmap_masks': batch_gmap_masks, 'gmap_visited_masks': batch_gmap_visited_masks, 'gmap_pair_dists': gmap_pair_dists,
+            'gmap_vp_ids': batch_gmap_vp_ids, 'gmap_step_ids': batch['gmap_step_ids'].long(),
+            'gmap_img_fts': batch_gmap_img_fts, 'gmap_pos_fts': batch['gmap_pos_fts'], 
+            'gmap_masks': batch['gmap_masks'].bool(), 'gmap_visited_masks': batch['gmap_visited_masks'].bool(),
+            'gmap_pair_dists': batch['gmap_pair_dists'],
             'no_vp_left': batch_no_vp_left,
         }
 
@@ -474,6 +523,7 @@ class RLTrainer(BaseVLNCETrainer):
 
             sample_ratio = self.config.IL.sample_ratio ** (idx // self.config.IL.decay_interval + 1)
             # sample_ratio = self.config.IL.sample_ratio ** (idx // self.config.IL.decay_interval)
+            self.profiler.reset()
             logs = self._train_interval(interval, self.config.IL.ml_weight, sample_ratio)
 
             if self.local_rank < 1:
@@ -484,6 +534,10 @@ class RLTrainer(BaseVLNCETrainer):
                     writer.add_scalar(f'loss/{k}', logs[k], cur_iter)
                 logger.info(loss_str)
                 self.save_checkpoint(cur_iter)
+            self._log_rollout_profile(
+                os.path.join(self.config.TENSORBOARD_DIR, f"rollout_profile_r{self.local_rank}.json"),
+                writer, cur_iter,
+            )
         
     def _train_interval(self, interval, ml_weight, sample_ratio):
         self.policy.train()
@@ -569,11 +623,9 @@ class RLTrainer(BaseVLNCETrainer):
             if os.path.exists(fname) and not os.path.isfile(self.config.EVAL.CKPT_PATH_DIR):
                 print("skipping -- evaluation exists.")
                 return
-        self.envs = construct_envs(
+        self.envs = self._construct_eval_envs(
             self.config, 
-            get_env_class(self.config.ENV_NAME),
-            episodes_allowed=self.traj[::5] if self.config.EVAL.fast_eval else self.traj,
-            auto_reset_done=False, # unseen: 11006 
+            episodes_allowed=self.traj[::5] if self.config.EVAL.fast_eval else self.traj, # unseen: 11006 
         )
         dataset_length = sum(self.envs.number_of_episodes)
         print('local rank:', self.local_rank, '|', 'dataset length:', dataset_length)
@@ -582,48 +634,85 @@ class RLTrainer(BaseVLNCETrainer):
         observation_space = apply_obs_transforms_obs_space(
             self.envs.observation_spaces[0], obs_transforms
         )
-        self._initialize_policy(
-            self.config,
-            load_from_ckpt=True,
-            observation_space=observation_space,
-            action_space=self.envs.action_spaces[0],
-        )
+        if self.envs is self.eval_envs and self.policy is not None:
+            # same envs and model as the last checkpoint, only the weights change
+            self._load_policy_weights(checkpoint_path, strict=False)
+        else:
+            self._initialize_policy(
+                self.config,
+                load_from_ckpt=True,
+                observation_space=observation_space,
+                action_space=self.envs.action_spaces[0],
+            )
         self.policy.eval()
         self.waypoint_predictor.eval()
 
         if self.config.EVAL.EPISODE_COUNT == -1:
-            eps_to_eval = sum(self.envs.number_of_episodes)
+            eps_to_eval = dataset_length
+        else:
+            eps_to_eval = min(self.config.EVAL.EPISODE_COUNT, dataset_length)
+        # with EVAL.resume, episodes finished by an earlier, interrupted run of this
+        # eval, of the same checkpoint file and eval config, are skipped
+        split = self.config.TASK_CONFIG.DATASET.SPLIT
+        result_tag = self._result_tag(checkpoint_path)
+        self.result_store = EpisodeResultStore(
+            os.path.join(self.config.RESULTS_DIR, f"stats_ep_ckpt_{checkpoint_index}_{split}_r{self.local_rank}.jsonl"),
+            resume=self.config.EVAL.resume, tag=result_tag,
+        )
+        if self.config.EVAL.resume:
+            rank_eps = set(str(ep_id) for ep_id in (self.traj[::5] if self.config.EVAL.fast_eval else self.traj))
+            self.stat_eps = read_results(self._result_store_files(checkpoint_index), result_tag, rank_eps)
+        else:
+            # only the store of the rank, just started over
+            self.stat_eps = {}
+        if len(self.stat_eps) > 0:
+            logger.info(f"LOCAL RANK: {self.local_rank}, resuming after {len(self.stat_eps)} evaluated episodes")
+        self.dispatcher = self._init_dispatcher(
+            os.path.join(self.config.RESULTS_DIR, f"dispatch_ckpt_{checkpoint_index}_{split}.json"),
+            eps_to_eval, self.stat_eps,
+        )
+        eval_eps = self._eval_episode_ids(eps_to_eval)
+        if self.config.use_pbar:
+            # with a dispatcher, the total grows with the batches the rank claims
+            self.pbar = tqdm.tqdm(
+                total=eps_to_eval if self.dispatcher is None else len(self.stat_eps), initial=len(self.stat_eps)
+            )
         else:
-            eps_to_eval = min(self.config.EVAL.EPISODE_COUNT, sum(self.envs.number_of_episodes))
-        self.stat_eps = {}
-        self.pbar = tqdm.tqdm(total=eps_to_eval) if self.config.use_pbar else None
+            self.pbar = None
+        self.metric_pool = MetricWorkerPool(self._episode_metrics, self.config.IL.metric_workers)
 
-        while len(self.stat_eps) < eps_to_eval:
-            self.rollout('eval')
-        self.envs.close()
+        self.rollout_stats.clear()
+        self.profiler.reset()
+        if self.config.IL.continuous_eval or self.dispatcher is not None:
+            self._continuous_rollout('eval', eps_to_eval)
+        else:
+            while len(self.stat_eps) < eps_to_eval:
+                self.rollout('eval')
+        if self.envs is not self.eval_envs:
+            self.envs.close()
+        with self.profiler.phase('metrics_join'):
+            self.metric_pool.join()
+        self.metric_pool.close()
+        self.result_store.close()
+        self._log_rollout_speed()
+        self._save_pano_cache()
+        self._log_rollout_profile(
+            os.path.join(
+                self.config.RESULTS_DIR,
+                f"rollout_profile_ckpt_{checkpoint_index}_{self.config.TASK_CONFIG.DATASET.SPLIT}_r{self.local_rank}.json",
+            ),
+            writer, checkpoint_index + 1,
+        )
 
         if self.world_size > 1:
+            logger.info(f"rank {self.local_rank}'s {len(self.stat_eps)}-episode results: {aggregate_results(self.stat_eps)}")
+            # the stores of all ranks are complete
             distr.barrier()
-        aggregated_states = {}
-        num_episodes = len(self.stat_eps)
-        for stat_key in next(iter(self.stat_eps.values())).keys():
-            aggregated_states[stat_key] = (
-                sum(v[stat_key] for v in self.stat_eps.values()) / num_episodes
-            )
-        total = torch.tensor(num_episodes).cuda()
-        if self.world_size > 1:
-            distr.reduce(total,dst=0)
-        total = total.item()
-
-        if self.world_size > 1:
-            logger.info(f"rank {self.local_rank}'s {num_episodes}-episode results: {aggregated_states}")
-            for k,v in aggregated_states.items():
-                v = torch.tensor(v*num_episodes).cuda()
-                cat_v = gather_list_and_concat(v,self.world_size)
-                v = (sum(cat_v)/total).item()
-                aggregated_states[k] = v
+        # merge the stores of all ranks, on the episodes of this eval
+        all_stat_eps = read_results(self._result_store_files(checkpoint_index), result_tag, eval_eps)
+        aggregated_states = aggregate_results(all_stat_eps)
+        total = len(all_stat_eps)
         
-        split = self.config.TASK_CONFIG.DATASET.SPLIT
         fname = os.path.join(
             self.config.RESULTS_DIR,
             f"stats_ep_ckpt_{checkpoint_index}_{split}_r{self.local_rank}_w{self.world_size}.json",
@@ -665,7 +754,8 @@ class RLTrainer(BaseVLNCETrainer):
         crop_config = self.config.RL.POLICY.OBS_TRANSFORMS.CENTER_CROPPER_PER_SENSOR.SENSOR_CROPS
         task_config = self.config.TASK_CONFIG
         camera_orientations = get_camera_orientations12()
-        for sensor_type in ["RGB", "DEPTH"]:
+        # the depth views are only encoded, which the pano feature store stands in for
+        for sensor_type in (["RGB"] if self.config.IL.pano_feature_store else ["RGB", "DEPTH"]):
             resizer_size = dict(resize_config)[sensor_type.lower()]
             cropper_size = dict(crop_config)[sensor_type.lower()]
             sensor = getattr(task_config.SIMULATOR, f"{sensor_type}_SENSOR")
@@ -702,6 +792,7 @@ class RLTrainer(BaseVLNCETrainer):
             episodes_allowed=self.traj,
             auto_reset_done=False,
         )
+        dataset_length = sum(self.envs.number_of_episodes)
 
         obs_transforms = get_active_obs_transforms(self.config)
         observation_space = apply_obs_transforms_obs_space(
@@ -717,49 +808,167 @@ class RLTrainer(BaseVLNCETrainer):
         self.waypoint_predictor.eval()
 
         if self.config.INFERENCE.EPISODE_COUNT == -1:
-            eps_to_infer = sum(self.envs.number_of_episodes)
+            eps_to_infer = dataset_length
         else:
-            eps_to_infer = min(self.config.INFERENCE.EPISODE_COUNT, sum(self.envs.number_of_episodes))
-        self.path_eps = defaultdict(list)
-        self.inst_ids: Dict[str, int] = {}   # transfer submit format
-        self.pbar = tqdm.tqdm(total=eps_to_infer)
+            eps_to_infer = min(self.config.INFERENCE.EPISODE_COUNT, dataset_length)
+        # the paths of the finished episodes go to the shard of the rank right away
+        self.infer_eps = set()
+        self.prediction_writer = PredictionShardWriter(self._prediction_shard_file(self.local_rank))
+        self.dispatcher = self._init_dispatcher(
+            os.path.splitext(self.config.INFERENCE.PREDICTIONS_FILE)[0] + "_dispatch.json",
+            eps_to_infer, self.infer_eps,
+        )
+        # with a dispatcher, the total grows with the batches the rank claims
+        self.pbar = tqdm.tqdm(total=eps_to_infer if self.dispatcher is None else 0)
 
-        while len(self.path_eps) < eps_to_infer:
-            self.rollout('infer')
+        self.rollout_stats.clear()
+        self.profiler.reset()
+        if self.config.IL.continuous_eval or self.dispatcher is not None:
+            self._continuous_rollout('infer', eps_to_infer)
+        else:
+            while len(self.infer_eps) < eps_to_infer:
+                self.rollout('infer')
         self.envs.close()
+        self.prediction_writer.close()
+        self._log_rollout_speed()
+        self._save_pano_cache()
+        self._log_rollout_profile(
+            os.path.splitext(self.config.INFERENCE.PREDICTIONS_FILE)[0] + f"_rollout_profile_r{self.local_rank}.json"
+        )
+
+        if self.world_size > 1:
+            # the shards of all ranks are complete
+            distr.barrier()
+        if self.local_rank < 1:
+            count = merge_predictions(
+                [self._prediction_shard_file(rank) for rank in range(self.world_size)],
+                self.config.INFERENCE.PREDICTIONS_FILE,
+                # 'rxr' format for rxr-habitat leaderboard
+                self.config.MODEL.task_type,
+            )
+            logger.info(f"Predictions of {count} episodes saved to: {self.config.INFERENCE.PREDICTIONS_FILE}")
+
+    def _prediction_shard_file(self, rank):
+        return os.path.splitext(self.config.INFERENCE.PREDICTIONS_FILE)[0] + f"_r{rank}.jsonl"
+
+    def _pano_cache_files(self):
+        r"""The feature cache files saved by the ranks of earlier runs."""
+        if not self.config.IL.pano_cache_file:
+            return []
+        root, ext = os.path.splitext(self.config.IL.pano_cache_file)
+        return sorted(glob.glob(f"{root}_r*{ext}"))
+
+    def _save_pano_cache(self):
+        if self.pano_cache is None or not self.config.IL.pano_cache_file:
+            return
+        root, ext = os.path.splitext(self.config.IL.pano_cache_file)
+        self.pano_cache.save(f"{root}_r{self.local_rank}{ext}")
+
+    def _log_rollout_speed(self):
+        if self.rollout_stats['time'] > 0:
+            if self.dispatcher is not None:
+                rollout = "continuous, dispatched"
+            elif self.config.IL.continuous_eval:
+                rollout = "continuous"
+            elif self.config.IL.pipeline_groups > 1:
+                rollout = f"pipelined in {self.config.IL.pipeline_groups} groups"
+            else:
+                rollout = "serial"
+            logger.info(
+                f"LOCAL RANK: {self.local_rank}, rollout ({rollout}): "
+                f"{self.rollout_stats['steps'] / self.rollout_stats['time']:.2f} steps/s"
+            )
+        if self.pano_cache is not None:
+            logger.info(
+                f"LOCAL RANK: {self.local_rank}, pano feature cache: hit rate {100 * self.pano_cache.hit_rate:.1f}% "
+                f"({self.pano_cache.hits} / {self.pano_cache.hits + self.pano_cache.misses}), "
+                f"{len(self.pano_cache)} panoramas"
+            )
+            self.pano_cache.reset_stats()
+        if self.pano_store is not None:
+            logger.info(
+                f"LOCAL RANK: {self.local_rank}, pano feature store: {self.pano_store.lookups} panoramas, "
+                f"{self.pano_store.mean_dist:.3f} m on average from the precomputed ones"
+            )
+            self.pano_store.reset_stats()
+
+    def _log_rollout_profile(self, fname, writer=None, step=0):
+        if not self.profiler.enabled:
+            return
+        self.profiler.save_json(fname)
+        if writer is not None:
+            self.profiler.write_tensorboard(writer, step)
+        phases = self.profiler.summary()['phases']
+        logger.info(
+            f"LOCAL RANK: {self.local_rank}, rollout ms/step: " + ", ".join(
+                f"{k} {v['wall_ms_per_step']:.1f}" for k, v in phases.items() if 'wall_ms_per_step' in v
+            )
+        )
+
+    def _episode_metrics(self, info, ep_id, ghost_cnt):
+        if self.config.IL.exact_dtw:
+            dtw_func = dtw_distance
+        else:
+            dtw_func = lambda pred_path, gt_path: fastdtw(pred_path, gt_path, dist=NDTW.euclidean_distance)[0]
+        metric = episode_metrics(info, self.gt_data[str(ep_id)]['locations'], dtw_func)
+        metric['ghost_cnt'] = ghost_cnt
+        self.result_store.append(ep_id, metric)
+        return metric
+
+    def _init_dispatcher(self, fname, num_eps, done_eps):
+        r"""The queue of the first num_eps episodes that are not in done_eps, in
+        scene-grouped batches of IL.dispatch_episodes, pulled by the envs of all ranks.
+        Every rank holds all the episodes, their scenes split over its envs.
+        Rank 0 (re)builds it while the others wait. None for the static split.
+        """
+        if self.config.IL.dispatch_episodes <= 0:
+            return None
+        dispatcher = EpisodeDispatcher(fname)
+        if self.local_rank < 1:
+            episodes = sum(self.envs.call(["get_episode_scenes"] * self.envs.num_envs), [])
+            episodes = [ep for ep in episodes[:num_eps] if ep[0] not in done_eps]
+            dispatcher.create(scene_batches(episodes, self.config.IL.dispatch_episodes))
+        if self.world_size > 1:
+            distr.barrier()
+        return dispatcher
+
+    def _result_tag(self, checkpoint_path):
+        r"""What the per-episode results depend on besides the episode: the checkpoint
+        file and the eval config. Stores of another tag are not resumed nor merged.
+        """
+        return {
+            "checkpoint": file_hash(checkpoint_path),
+            "split": self.config.TASK_CONFIG.DATASET.SPLIT,
+            "fast_eval": self.config.EVAL.fast_eval,
+            "episode_count": self.config.EVAL.EPISODE_COUNT,
+            "exact_dtw": self.config.IL.exact_dtw,
+        }
 
+    def _eval_episode_ids(self, num_eps):
+        r"""Ids of the episodes evaluated over all ranks: those of the envs of each
+        rank, as split by collect_val_traj, or the first num_eps ones dispatched.
+        """
+        episodes = sum(self.envs.call(["get_episode_scenes"] * self.envs.num_envs), [])
+        if self.dispatcher is not None:
+            return set(str(ep_id) for ep_id, _ in episodes[:num_eps])
+        ep_ids = [str(ep_id) for ep_id, _ in episodes]
         if self.world_size > 1:
-            aggregated_path_eps = [None for _ in range(self.world_size)]
-            distr.all_gather_object(aggregated_path_eps, self.path_eps)
-            tmp_eps_dict = {}
-            for x in aggregated_path_eps:
-                tmp_eps_dict.update(x)
-            self.path_eps = tmp_eps_dict
-
-            aggregated_inst_ids = [None for _ in range(self.world_size)]
-            distr.all_gather_object(aggregated_inst_ids, self.inst_ids)
-            tmp_inst_dict = {}
-            for x in aggregated_inst_ids:
-                tmp_inst_dict.update(x)
-            self.inst_ids = tmp_inst_dict
-
-
-        if self.config.MODEL.task_type == "r2r":
-            with open(self.config.INFERENCE.PREDICTIONS_FILE, "w") as f:
-                json.dump(self.path_eps, f, indent=2)
-            logger.info(f"Predictions saved to: {self.config.INFERENCE.PREDICTIONS_FILE}")
-        else:  # use 'rxr' format for rxr-habitat leaderboard
-            preds = []
-            for k,v in self.path_eps.items():
-                # save only positions that changed
-                path = [v[0]["position"]]
-                for p in v[1:]:
-                    if p["position"] != path[-1]: path.append(p["position"])
-                preds.append({"instruction_id": self.inst_ids[k], "path": path})
-            preds.sort(key=lambda x: x["instruction_id"])
-            with jsonlines.open(self.config.INFERENCE.PREDICTIONS_FILE, mode="w") as writer:
-                writer.write_all(preds)
-            logger.info(f"Predictions saved to: {self.config.INFERENCE.PREDICTIONS_FILE}")
+            all_ep_ids = [None for _ in range(self.world_size)]
+            distr.all_gather_object(all_ep_ids, ep_ids)
+            ep_ids = sum(all_ep_ids, [])
+        return set(ep_ids)
+
+    def _result_store_files(self, checkpoint_index):
+        split = self.config.TASK_CONFIG.DATASET.SPLIT
+        if self.config.EVAL.resume:
+            # also the ranks of earlier runs with more gpus
+            return sorted(glob.glob(os.path.join(
+                self.config.RESULTS_DIR, f"stats_ep_ckpt_{checkpoint_index}_{split}_r*.jsonl"
+            )))
+        return [
+            os.path.join(self.config.RESULTS_DIR, f"stats_ep_ckpt_{checkpoint_index}_{split}_r{rank}.jsonl")
+            for rank in range(self.world_size)
+        ]
 
     def get_pos_ori(self):
         pos_ori = self.envs.call(['get_pos_ori']*self.envs.num_envs)
@@ -778,53 +987,183 @@ class RLTrainer(BaseVLNCETrainer):
         self.envs.resume_all()
         observations = self.envs.reset()
 
+        if mode == 'eval' or mode == 'infer':
+            done_eps = self.stat_eps if mode == 'eval' else self.infer_eps
+            env_to_pause = [i for i, ep in enumerate(self.envs.current_episodes()) 
+                            if ep.episode_id in done_eps]    
+            for i in reversed(env_to_pause):
+                self.envs.pause_at(i)
+                observations.pop(i)
+            if self.envs.num_envs == 0: return
+
+        tic = time.time()
+        if self.config.IL.pipeline_groups > 1:
+            loss, total_actions = self._pipelined_rollout(mode, observations)
+        else:
+            steps = self._rollout_steps(mode, observations)
+            env_actions = next(steps)
+            while True:
+                try:
+                    with self.profiler.phase('env_step'):
+                        outputs = self.envs.step(env_actions)
+                    env_actions = steps.send(outputs)
+                except StopIteration as e:
+                    loss, total_actions = e.value
+                    break
+        self.rollout_stats['steps'] += total_actions
+        self.rollout_stats['time'] += time.time() - tic
+
+        if mode == 'train':
+            loss = ml_weight * loss / total_actions
+            self.loss += loss
+            self.logs['IL_loss'].append(loss.item())
+
+    def _pipelined_rollout(self, mode, observations):
+        """
+        Splits the envs in IL.pipeline_groups groups, each with its own _rollout_steps.
+        A group runs the policy while the others simulate the actions it sent before.
+        """
+        envs = self.envs
+        episodes = envs.current_episodes()
+        groups = [
+            VectorEnvGroup(envs, env_ids, [episodes[i] for i in env_ids])
+            for env_ids in np.array_split(np.arange(envs.num_envs), self.config.IL.pipeline_groups)
+            if len(env_ids) > 0
+        ]
+        steps = [
+            self._rollout_steps(mode, [observations[i] for i in group.env_ids], group)
+            for group in groups
+        ]
+        for group, group_steps in zip(groups, steps):
+            group.async_step(next(group_steps))
+
+        loss, total_actions = 0., 0.
+        running = list(zip(groups, steps))
+        try:
+            while len(running) > 0:
+                for group, group_steps in list(running):
+                    with self.profiler.phase('env_step'):
+                        outputs = group.wait_step()
+                    try:
+                        group.async_step(group_steps.send(outputs))
+                    except StopIteration as e:
+                        loss += e.value[0]
+                        total_actions += e.value[1]
+                        running.remove((group, group_steps))
+        finally:
+            self.envs = envs
+        return loss, total_actions
+
+    def _continuous_rollout(self, mode, num_eps):
+        """
+        Eval / inference where an env is reset with its next episode as soon as it is done,
+        not once all envs are done. Each env is a slot running its own _rollout_steps,
+        which holds the GraphMap, prev_vp and text embeddings of its episode, and is
+        stepped asynchronously like the groups of _pipelined_rollout.
+        With a dispatcher, the episodes of an env are the batches it claims from the
+        queue shared by the ranks, one batch after the other.
+        """
+        envs = self.envs
+        done_eps = self.stat_eps if mode == 'eval' else self.infer_eps
+        slots = {}      # env index to (VectorEnvGroup, _rollout_steps)
+        episodes_left = [0] * envs.num_envs     # episodes of each env (or of its claimed batch) not reset yet
+        envs.resume_all()
+        if self.dispatcher is None:
+            # the done episodes are dropped from the episodes of each env up front,
+            # so that an env is reset once per episode it runs
+            for i, episodes in enumerate(envs.call(["get_episode_scenes"] * envs.num_envs)):
+                ep_ids = [ep_id for ep_id, _ in episodes if ep_id not in done_eps]
+                envs.call_at(i, "set_episodes", {"episode_ids": ep_ids})
+                episodes_left[i] = len(ep_ids)
+        else:
+            # an env only claims batches of its own scenes
+            env_scenes = [
+                set(scene_id for _, scene_id in episodes)
+                for episodes in envs.call(["get_episode_scenes"] * envs.num_envs)
+            ]
+
+        def reset(i):
+            # the next episode of env i, of its episodes or of its claimed batch
+            if episodes_left[i] == 0:
+                if self.dispatcher is None:
+                    return None, None
+                batch = self.dispatcher.claim(env_scenes[i])
+                if batch is None:   # the queue is empty
+                    return None, None
+                envs.call_at(i, "set_episodes", {"episode_ids": batch})
+                episodes_left[i] = len(batch)
+                if self.pbar is not None:
+                    self.pbar.total += len(batch)
+                    self.pbar.refresh()
+            episodes_left[i] -= 1
+            return envs.reset_at(i), envs.call_at(i, "get_current_episode")
+
+        def start(i):
+            # the next episode of env i, if any is left and the eval needs more
+            if len(done_eps) + len(slots) >= num_eps:
+                return
+            observations, episode = reset(i)
+            if episode is None:
+                return
+            group = VectorEnvGroup(envs, [i], [episode])
+            steps = self._rollout_steps(mode, observations, group)
+            group.async_step(next(steps))
+            slots[i] = (group, steps)
+
+        tic = time.time()
+        try:
+            for i in range(envs.num_envs):
+                start(i)
+            while len(slots) > 0:
+                for i in list(slots.keys()):
+                    group, steps = slots[i]
+                    with self.profiler.phase('env_step'):
+                        outputs = group.wait_step()
+                    try:
+                        group.async_step(steps.send(outputs))
+                    except StopIteration as e:
+                        self.rollout_stats['steps'] += e.value[1]
+                        del slots[i]
+                        start(i)
+        finally:
+            self.envs = envs
+        self.rollout_stats['time'] += time.time() - tic
+
+    def _rollout_steps(self, mode, observations, envs=None):
+        """
+        The rollout of the envs (a VectorEnvGroup or all of self.envs), as a generator:
+        it yields the env actions of each step and is sent the outputs of envs.step.
+        Returns the loss and the number of actions.
+        """
+        if envs is None:
+            envs = self.envs
+        self.envs = envs
 
         assert self.envs.num_envs == 1,'only support batch size of 1'
         instr = []
         instr.append(observations[0]['instruction']['text'])
 
-        agent = GPTNavAgent()
+        agent = GPTNavAgent(profiler=self.profiler)
+        profiler = self.profiler
 
 
         instr_max_len = self.config.IL.max_text_len # r2r 80, rxr 200
         instr_pad_id = 1 if self.config.MODEL.task_type == 'rxr' else 0
-        observations = extract_instruction_tokens(observations, self.config.TASK_CONFIG.TASK.INSTRUCTION_SENSOR_UUID,
-                                                  max_length=instr_max_len, pad_id=instr_pad_id)
-        batch = batch_obs(observations, self.device)
-        batch = apply_obs_transforms_batch(batch, self.obs_transforms)
-        
-        if mode == 'eval':
-            env_to_pause = [i for i, ep in enumerate(self.envs.current_episodes()) 
-                            if ep.episode_id in self.stat_eps]    
-            self.envs, batch = self._pause_envs(self.envs, batch, env_to_pause)
-            if self.envs.num_envs == 0: return
-        if mode == 'infer':
-            env_to_pause = [i for i, ep in enumerate(self.envs.current_episodes()) 
-                            if ep.episode_id in self.path_eps]    
-            self.envs, batch = self._pause_envs(self.envs, batch, env_to_pause)
-            if self.envs.num_envs == 0: return
-            curr_eps = self.envs.current_episodes()
-            for i in range(self.envs.num_envs):
-                if self.config.MODEL.task_type == 'rxr':
-                    ep_id = curr_eps[i].episode_id
-                    k = curr_eps[i].instruction.instruction_id
-                    self.inst_ids[ep_id] = int(k)
-
-
-
-
-
-
-
+        with profiler.phase('obs_transform'):
+            observations = extract_instruction_tokens(observations, self.config.TASK_CONFIG.TASK.INSTRUCTION_SENSOR_UUID,
+                                                      max_length=instr_max_len, pad_id=instr_pad_id)
+            batch = batch_obs(observations, self.device)
+            batch = apply_obs_transforms_batch(batch, self.obs_transforms)
 
         # encode instructions
-        all_txt_ids = batch['instruction']
-        all_txt_masks = (all_txt_ids != instr_pad_id)
-        all_txt_embeds = self.policy.net(
-            mode='language',
-            txt_ids=all_txt_ids,
-            txt_masks=all_txt_masks,
-        )
+        with profiler.phase('language'):
+            all_txt_ids = batch['instruction']
+            all_txt_masks = (all_txt_ids != instr_pad_id)
+            all_txt_embeds = self.policy.net(
+                mode='language',
+                txt_ids=all_txt_ids,
+                txt_masks=all_txt_masks,
+            )
 
         loss = 0.
         total_actions = 0.
@@ -832,71 +1171,82 @@ class RLTrainer(BaseVLNCETrainer):
 
         have_real_pos = (mode == 'train' or self.config.VIDEO_OPTION)
         ghost_aug = self.config.IL.ghost_aug if mode == 'train' else 0
-        self.gmaps = [GraphMap(have_real_pos, 
+        self.gmaps = BatchGraphMap([GraphMap(have_real_pos, 
                                self.config.IL.loc_noise, 
                                self.config.MODEL.merge_ghost,
-                               ghost_aug) for _ in range(self.envs.num_envs)]
+                               ghost_aug,
+                               incremental_sp=self.config.IL.incremental_sp,
+                               compact=self.config.IL.compact_gmap,
+                               evict=self.config.IL.gmap_evict,
+                               max_real_pos=self.config.IL.max_ghost_real_pos) for _ in range(self.envs.num_envs)],
+                               device=self.device if self.config.IL.batch_gmap else None)
         prev_vp = [None] * self.envs.num_envs
+        # the scenes of the envs, for the poses of the panoramas
+        use_pano_poses = self.pano_cache is not None or self.pano_store is not None
+        if use_pano_poses:
+            scene_ids = [ep.scene_id for ep in self.envs.current_episodes()]
 
 
 
         for stepk in range(self.max_len):
             total_actions += self.envs.num_envs
+            profiler.count('steps', self.envs.num_envs)
             txt_masks = all_txt_masks[not_done_index]
             txt_embeds = all_txt_embeds[not_done_index]
             
+            # the pose of the observations
+            with profiler.phase('env_query'):
+                cur_pos, cur_ori = self.get_pos_ori()
+            pano_poses = list(zip(scene_ids, cur_pos, cur_ori)) if use_pano_poses else None
+
             # cand waypoint prediction
-            wp_outputs = self.policy.net(
-                mode = "waypoint",
-                waypoint_predictor = self.waypoint_predictor,
-                observations = batch,
-                in_train = (mode == 'train' and self.config.IL.waypoint_aug),
-            )
+            with profiler.phase('waypoint'):
+                wp_outputs = self.policy.net(
+                    mode = "waypoint",
+                    waypoint_predictor = self.waypoint_predictor,
+                    observations = batch,
+                    in_train = (mode == 'train' and self.config.IL.waypoint_aug),
+                    pano_poses = pano_poses,
+                )
 
             # pano encoder
-            vp_inputs = self._vp_feature_variable(wp_outputs)
-            vp_inputs.update({
-                'mode': 'panorama',
-            })
-            pano_embeds, pano_masks = self.policy.net(**vp_inputs)
-            avg_pano_embeds = torch.sum(pano_embeds * pano_masks.unsqueeze(2), 1) / \
-                              torch.sum(pano_masks, 1, keepdim=True)
+            with profiler.phase('panorama'):
+                vp_inputs = self._vp_feature_variable(wp_outputs)
+                vp_inputs.update({
+                    'mode': 'panorama',
+                })
+                pano_embeds, pano_masks = self.policy.net(**vp_inputs)
+                avg_pano_embeds = torch.sum(pano_embeds * pano_masks.unsqueeze(2), 1) / \
+                                  torch.sum(pano_masks, 1, keepdim=True)
 
             # get vp_id, vp_pos of cur_node and cand_ndoe
-            cur_pos, cur_ori = self.get_pos_ori()
-            cur_vp, cand_vp, cand_pos = [], [], []
-            for i in range(self.envs.num_envs):
-                cur_vp_i, cand_vp_i, cand_pos_i = self.gmaps[i].identify_node(
-                    cur_pos[i], cur_ori[i], wp_outputs['cand_angles'][i], wp_outputs['cand_distances'][i]
-                )
-                cur_vp.append(cur_vp_i)
-                cand_vp.append(cand_vp_i)
-                cand_pos.append(cand_pos_i)
+            profiler.start('gmap_update')
+            cur_vp, cand_vp, cand_pos = self.gmaps.identify_node(
+                cur_pos, cur_ori, wp_outputs['cand_angles'], wp_outputs['cand_distances']
+            )
+            profiler.stop('gmap_update')
             
+            profiler.start('env_query')
             if mode == 'train' or self.config.VIDEO_OPTION:
-                cand_real_pos = []
-                for i in range(self.envs.num_envs):
-                    cand_real_pos_i = [
-                        self.envs.call_at(i, "get_cand_real_pos", {"angle": ang, "forward": dis})
-                        for ang, dis in zip(wp_outputs['cand_angles'][i], wp_outputs['cand_distances'][i])
+                # all cands of all envs, the envs being asked at once
+                cand_real_pos = self.envs.call(
+                    ["get_cand_real_pos_batch"] * self.envs.num_envs,
+                    [
+                        {"angles": angles, "forwards": distances}
+                        for angles, distances in zip(wp_outputs['cand_angles'], wp_outputs['cand_distances'])
                     ]
-                    cand_real_pos.append(cand_real_pos_i)
+                )
             else:
                 cand_real_pos = [None] * self.envs.num_envs
+            profiler.stop('env_query')
 
-            nearby_cand_wp = []
-            cand_imgs = []
-            new_ghost_node = []
-            for i in range(self.envs.num_envs):
-                cur_embeds = avg_pano_embeds[i]
-                cand_embeds = pano_embeds[i][vp_inputs['nav_types'][i]==1]
-                nearby_wp,  imgs, ghost_node = self.gmaps[i].update_graph(prev_vp[i], stepk+1,
-                                           cur_vp[i], cur_pos[i], cur_embeds,
-                                           cand_vp[i], cand_pos[i], cand_embeds,
-                                           cand_real_pos[i],wp_outputs['cand_img'][i])
-                nearby_cand_wp.append(nearby_wp)
-                cand_imgs.append(imgs)
-                new_ghost_node.append(ghost_node)
+            profiler.start('gmap_update')
+            cand_embeds = [pano_embeds[i][vp_inputs['nav_types'][i]==1] for i in range(self.envs.num_envs)]
+            nearby_cand_wp, cand_imgs, new_ghost_node = self.gmaps.update_graph(prev_vp, stepk+1,
+                                           cur_vp, cur_pos, avg_pano_embeds,
+                                           cand_vp, cand_pos, cand_embeds,
+                                           cand_real_pos, wp_outputs['cand_img'])
+            profiler.stop('gmap_update')
 
             gmap_vp_ids = []
             for i, gmap in enumerate(self.gmaps):
@@ -905,7 +1255,8 @@ class RLTrainer(BaseVLNCETrainer):
                 vp_ids = [None] + node_vp_ids + ghost_vp_ids
                 gmap_vp_ids.append(gmap_vp_ids)
 
-            nav_inputs = self._nav_gmap_variable(cur_vp, cur_pos, cur_ori)
+            with profiler.phase('nav_gmap_variable'):
+                nav_inputs = self._nav_gmap_variable(cur_vp, cur_pos, cur_ori)
             # nav_inputs.update({
             #     'mode': 'navigation',
             #     'txt_embeds': txt_embeds,
@@ -945,9 +1296,11 @@ class RLTrainer(BaseVLNCETrainer):
 
             # vp_name = self.gmaps[i].node_pos.values()
 
-            a_t = agent.rollout(cur_vp, nearby_cand_wp, self.gmaps, 1, instr, cand_imgs, stepk, new_ghost_node)
+            with profiler.phase('agent'):
+                a_t = agent.rollout(cur_vp, nearby_cand_wp, self.gmaps, 1, instr, cand_imgs, stepk, new_ghost_node)
             if a_t[0]!=0:
-                a_t[0] += len(gmap.node_pos.keys())
+                # ghosts follow the nodes of the gmap input, which may be fewer than the gmap's
+                a_t[0] += len(nav_inputs['gmap_vp_ids'][0]) - 1 - len(self.gmaps[0].ghost_pos)
 
 
 
@@ -957,7 +1310,8 @@ class RLTrainer(BaseVLNCETrainer):
             # logits.masked_fill_(nav_inputs['gmap_visited_masks'], -float('inf'))
 
             if mode == 'train' or self.config.VIDEO_OPTION:
-                teacher_actions = self._teacher_action_new(nav_inputs['gmap_vp_ids'], no_vp_left)
+                with profiler.phase('teacher'):
+                    teacher_actions = self._teacher_action_new(nav_inputs['gmap_vp_ids'], no_vp_left)
             if mode == 'train':
                 loss += F.cross_entropy(nav_logits, teacher_actions, reduction='sum', ignore_index=-100)
 
@@ -974,7 +1328,10 @@ class RLTrainer(BaseVLNCETrainer):
             cpu_a_t = a_t
 
             # make equiv action
+            profiler.start('gmap_update')
             env_actions = []
+            del_ghosts = [[] for _ in range(self.envs.num_envs)]
+            distant_ghosts = self.gmaps.search_distant_ghosts(cur_pos)
             use_tryout = (self.config.IL.tryout and not self.config.TASK_CONFIG.SIMULATOR.HABITAT_SIM_V0.ALLOW_SLIDING)
             for i, gmap in enumerate(self.gmaps):
                 if cpu_a_t[i] == 0 or stepk == self.max_len - 1 or no_vp_left[i]:
@@ -1051,22 +1408,18 @@ class RLTrainer(BaseVLNCETrainer):
                     )
                     prev_vp[i] = front_vp
 
-                    gmap.delete_ghost(ghost_vp)
-
-                    # delete img of the selected ghost point that is gonna be visited
-                    idx = agent.prompt_manager.nodes_list[i].index(ghost_vp)
-                    agent.prompt_manager.node_imgs[i][idx] = None
-                    
-                    # delete the connectivity relation of the selected ghost point and other visited points
-                    for node in agent.prompt_manager.graph[i].keys():
-                        if ghost_vp in agent.prompt_manager.graph[i][node]:
-                            agent.prompt_manager.graph[i][node].remove(ghost_vp)
+                    del_ghosts[i].append(ghost_vp)
 
 
 
 
                     # search for the ghost vp far away from the current location
-                    sel_ghost = gmap.search_distant_ghost(cur_pos[i])
+                    sel_ghost = [vp for vp in distant_ghosts[i] if vp != ghost_vp]
+                    # and the ones over the ghost budget
+                    sel_ghost += gmap.evict_ghosts(
+                        cur_pos[i], self.config.IL.max_gmap_ghosts,
+                        ignore=set(sel_ghost + [ghost_vp]),
+                    )
 
                     # delete the selected ghost point
                     # sel_ghost = []
@@ -1075,45 +1428,33 @@ class RLTrainer(BaseVLNCETrainer):
 
                         # if self.config.MODEL.consume_ghost:
                         #     gmap.delete_ghost(ghost_vp)
-                        gmap.delete_ghost(ghost_vp)
-
-                        # delete img of the selected ghost point that is gonna be visited
-                        idx = agent.prompt_manager.nodes_list[i].index(ghost_vp)
-                        agent.prompt_manager.node_imgs[i][idx] = None
-                        
-                        # delete the connectivity relation of the selected ghost point and other visited points
-                        for node in agent.prompt_manager.graph[i].keys():
-                            if ghost_vp in agent.prompt_manager.graph[i][node]:
-                                agent.prompt_manager.graph[i][node].remove(ghost_vp)
-
-            outputs = self.envs.step(env_actions)
+                        del_ghosts[i].append(ghost_vp)
+
+                    # delete the imgs of the selected ghost that is gonna be visited & of the dropped ones,
+                    # and their connectivity relation with the visited points
+                    agent.prompt_manager.delete_ghosts(i, del_ghosts[i])
+
+            self.gmaps.delete_ghosts(del_ghosts)
+            profiler.stop('gmap_update')
+
+            gmaps = self.gmaps
+            outputs = yield env_actions
+            # other groups may have run in between
+            self.envs, self.gmaps = envs, gmaps
             observations, _, dones, infos = [list(x) for x in zip(*outputs)]
+            profiler.count('episodes', sum(dones))
 
             # calculate metric
+            profiler.start('metrics')
             if mode == 'eval':
                 curr_eps = self.envs.current_episodes()
                 for i in range(self.envs.num_envs):
                     if not dones[i]:
                         continue
-                    info = infos[i]
                     ep_id = curr_eps[i].episode_id
-                    gt_path = np.array(self.gt_data[str(ep_id)]['locations']).astype(np.float)
-                    pred_path = np.array(info['position']['position'])
-                    distances = np.array(info['position']['distance'])
-                    metric = {}
-                    metric['steps_taken'] = info['steps_taken']
-                    metric['distance_to_goal'] = distances[-1]
-                    metric['success'] = 1. if distances[-1] <= 3. else 0.
-                    metric['oracle_success'] = 1. if (distances <= 3.).any() else 0.
-                    metric['path_length'] = float(np.linalg.norm(pred_path[1:] - pred_path[:-1],axis=1).sum())
-                    metric['collisions'] = info['collisions']['count'] / len(pred_path)
-                    gt_length = distances[0]
-                    metric['spl'] = metric['success'] * gt_length / max(gt_length, metric['path_length'])
-                    dtw_distance = fastdtw(pred_path, gt_path, dist=NDTW.euclidean_distance)[0]
-                    metric['ndtw'] = np.exp(-dtw_distance / (len(gt_path) * 3.))
-                    metric['sdtw'] = metric['ndtw'] * metric['success']
-                    metric['ghost_cnt'] = self.gmaps[i].ghost_cnt
-                    self.stat_eps[ep_id] = metric
+                    # the episode counts as done right away, its metrics are filled in by the pool
+                    self.stat_eps[ep_id] = {}
+                    self.metric_pool.submit(self.stat_eps[ep_id], infos[i], ep_id, self.gmaps[i].ghost_cnt)
                     self.pbar.update()
 
             # record path
@@ -1124,23 +1465,15 @@ class RLTrainer(BaseVLNCETrainer):
                         continue
                     info = infos[i]
                     ep_id = curr_eps[i].episode_id
-                    self.path_eps[ep_id] = [
-                        {
-                            'position': info['position_infer']['position'][0],
-                            'heading': info['position_infer']['heading'][0],
-                            'stop': False
-                        }
-                    ]
-                    for p, h in zip(info['position_infer']['position'][1:], info['position_infer']['heading'][1:]):
-                        if p != self.path_eps[ep_id][-1]['position']:
-                            self.path_eps[ep_id].append({
-                                'position': p,
-                                'heading': h,
-                                'stop': False
-                            })
-                    self.path_eps[ep_id] = self.path_eps[ep_id][:500]
-                    self.path_eps[ep_id][-1]['stop'] = True
+                    path = compact_path(info['position_infer']['position'], info['position_infer']['heading'])
+                    # transfer submit format
+                    instruction_id = None
+                    if self.config.MODEL.task_type == 'rxr':
+                        instruction_id = int(curr_eps[i].instruction.instruction_id)
+                    self.prediction_writer.append(ep_id, path, instruction_id)
+                    self.infer_eps.add(ep_id)
                     self.pbar.update()
+            profiler.stop('metrics')
 
             # pause env
             if sum(dones) > 0:
@@ -1152,16 +1485,16 @@ class RLTrainer(BaseVLNCETrainer):
                         # graph stop
                         self.gmaps.pop(i)
                         prev_vp.pop(i)
+                        if use_pano_poses:
+                            scene_ids.pop(i)
 
             if self.envs.num_envs == 0:
                 break
 
             # obs for next step
-            observations = extract_instruction_tokens(observations,self.config.TASK_CONFIG.TASK.INSTRUCTION_SENSOR_UUID)
-            batch = batch_obs(observations, self.device)
-            batch = apply_obs_transforms_batch(batch, self.obs_transforms)
+            with profiler.phase('obs_transform'):
+                observations = extract_instruction_tokens(observations,self.config.TASK_CONFIG.TASK.INSTRUCTION_SENSOR_UUID)
+                batch = batch_obs(observations, self.device)
+                batch = apply_obs_transforms_batch(batch, self.obs_transforms)
 
-        if mode == 'train':
-            loss = ml_weight * loss / total_actions
-            self.loss += loss
-            self.logs['IL_loss'].append(loss.item())
\ No newline at end of file
+        return loss, total_actions
\ No newline at end of file
@@ -34,9 +34,56 @@ def neighborhoods(mu, x_range, y_range, sigma, circular_x=True, gaussian=False):
     return output
 
 
-def nms(pred, max_predictions=10, sigma=(1.0,1.0), gaussian=False):
+# suppression masks of all peak positions, by (height, width, sigma, device)
+_suppression_tables = {}
+
+
+def suppression_table(height, width, sigma, device):
+    """ Masks of neighborhoods() centered at each position of a height x width map,
+        as nms() builds them for its peaks
+    Outputs:
+        bool tensor (height*width, height*width), row ix for the peak at flat index ix
+    """
+    key = (height, width, tuple(sigma), str(device))
+    if key not in _suppression_tables:
+        ix = torch.arange(height*width, device=device)
+        # the peak position as computed by nms()
+        mu = torch.stack([ix % width, ix / width], dim=1).float()
+        g = neighborhoods(mu, width, height, sigma)
+        _suppression_tables[key] = g.reshape(height*width, height*width).bool()
+    return _suppression_tables[key]
+
+
+def nms_fast(pred, max_predictions=10, sigma=(1.0,1.0)):
+    ''' nms() with gaussian=False: the same peaks, each suppressed with its row of
+        a precomputed suppression_table() instead of building the masks each time
+        Input (batch_size, 1, height, width) '''
+
+    shape = pred.shape
+    table = suppression_table(shape[-2], shape[-1], sigma, pred.device)
+
+    flat_pred = pred.reshape((shape[0],-1))
+    supp_pred = flat_pred.clone()
+    peaks = []
+    for i in range(max_predictions):
+        # the first max over the entire map, as torch.max in nms()
+        ix = torch.argmax(supp_pred, dim=1)
+        peaks.append(ix)
+        supp_pred.masked_fill_(table[ix], 0)
+
+    peaks = torch.stack(peaks, dim=1)
+    flat_output = torch.zeros_like(flat_pred)
+    flat_output.scatter_(1, peaks, flat_pred.gather(1, peaks))
+    flat_output[flat_output < 0] = 0
+    return flat_output.reshape(shape)
+
+
+def nms(pred, max_predictions=10, sigma=(1.0,1.0), gaussian=False, fast=False):
     ''' Input (batch_size, 1, height, width) '''
 
+    if fast and not gaussian:
+        return nms_fast(pred, max_predictions, sigma)
+
     shape = pred.shape
 
     output = torch.zeros_like(pred)